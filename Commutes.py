@@ -0,0 +1,128 @@
+import datetime
+
+from consts import COMMUTE_AGGREGATE, COMMUTE_LAT_LON, COMMUTE_TYPE, COMMUTE_TYPES, OSRM_HOST
+from HTTPSession import HTTPSession
+from Logger import get_logger
+from Metrics import Metrics
+from RouteCache import RouteCache
+from Routing import Router
+
+logger = get_logger(__name__)
+
+commute_aggregates = ("max", "min", "weighted")
+
+
+def travel_time_col(commute_name: str, commute_type: str) -> str:
+    """Name of the column holding the travel time to one commute by one mode."""
+    return f"TRAVEL TIME ({commute_name}, {commute_type})"
+
+
+def is_travel_time_col(col: str) -> bool:
+    """Checks if a column holds the travel time to one commute by one mode."""
+    return col.startswith("TRAVEL TIME (") and col.endswith(")")
+
+
+class CommuteMatrix:
+    def __init__(self, commutes: list = None, aggregate: str = COMMUTE_AGGREGATE, session: HTTPSession = None,
+                 osrm_host: str = OSRM_HOST, route_cache: RouteCache = None, metrics: Metrics = None):
+        """
+        Travel times from listings to several commute locations, each by one or more modes. Every mode gets one
+        Router, and each chunk of listings is resolved against all of that mode's locations in one table request.
+        Args:
+            commutes: list of dicts with "name", "lat_lon" and "modes", and optionally "weight" (defaults to 1).
+                Defaults to COMMUTE_LAT_LON by COMMUTE_TYPE.
+            aggregate: how TRAVEL TIME combines the travel times: "max", "min" or "weighted" (weighted mean)
+            session: HTTPSession used for OSRM requests
+            osrm_host: scheme and host of the OSRM server
+            route_cache: RouteCache checked before querying OSRM
+            metrics: Metrics the routers record the time taken to route each listing in
+        """
+        if not commutes:
+            commutes = [{"name": "commute", "lat_lon": COMMUTE_LAT_LON, "modes": [COMMUTE_TYPE]}]
+        if aggregate not in commute_aggregates:
+            raise ValueError(f"commute_aggregate must be one of {list(commute_aggregates)}")
+        for commute in commutes:
+            if not all(key in commute for key in ("name", "lat_lon", "modes")):
+                raise KeyError("Each commute needs a name, lat_lon and modes.")
+            if not set(commute["modes"]) <= set(COMMUTE_TYPES):
+                raise ValueError(f"Commute modes must be in {list(COMMUTE_TYPES)}")
+        self.commutes = commutes
+        self.aggregate = aggregate
+        self.lat_lon = tuple(commutes[0]["lat_lon"])
+
+        # (commute name, mode, weight) for each travel time, in column order
+        self.legs = [(commute["name"], mode, commute.get("weight", 1)) for commute in commutes
+                     for mode in commute["modes"]]
+        self.routers = {}
+        for _, mode, _ in self.legs:
+            if mode not in self.routers:
+                self.routers[mode] = Router(session=session, commute_type=mode, commute_lat_lon=self.lat_lon,
+                                            osrm_host=osrm_host, route_cache=route_cache, metrics=metrics)
+
+    @property
+    def columns(self) -> list:
+        """Extra travel time columns, one per commute and mode. None when there is only one, in TRAVEL TIME."""
+        if len(self.legs) == 1:
+            return []
+        return [travel_time_col(name, mode) for name, mode, _ in self.legs]
+
+    @property
+    def commute_key(self) -> str:
+        """Identifies the commutes and aggregate these travel times are for. Same as Router.commute_key for one."""
+        if len(self.legs) == 1:
+            return next(iter(self.routers.values())).commute_key
+        legs = ";".join(f"{mode}:{commute['lat_lon'][0]},{commute['lat_lon'][1]}"
+                        for commute in self.commutes for mode in commute["modes"])
+        weights = ",".join(str(weight) for _, _, weight in self.legs)
+        return f"{self.aggregate}[{weights}]:{legs}"
+
+    def resolve_travel_times(self, listings: list) -> list:
+        """
+        Sets travel_time, and travel_times when there are several commutes or modes, on every listing. Makes one
+        chunked set of table requests per mode.
+        Args:
+            listings: Listings whose lat_lon is set
+
+        Returns: the listings that got every travel time, in their original order
+        """
+        lat_lons = [listing.lat_lon for listing in listings]
+        # mode -> one row of durations per listing, in the order of that mode's commutes
+        rows = {}
+        for mode, router in self.routers.items():
+            destinations = [tuple(commute["lat_lon"]) for commute in self.commutes if mode in commute["modes"]]
+            rows[mode] = router.resolve_matrix(lat_lons, destinations)
+
+        routed = []
+        for i, listing in enumerate(listings):
+            if any(rows[mode][i] is None for mode in rows):
+                logger.warning("Could not get travel time for listing %d - %s", listing.pid, listing.url,
+                               extra={"pid": listing.pid})
+                continue
+            # Next unused destination of each mode, walking the commutes in order
+            next_destination = dict.fromkeys(rows, 0)
+            durations = []
+            for _, mode, _ in self.legs:
+                durations.append(rows[mode][i][next_destination[mode]])
+                next_destination[mode] += 1
+            listing.travel_time = self.aggregate_durations(durations)
+            listing.travel_times = dict(zip(self.columns, (datetime.timedelta(seconds=duration)
+                                                           for duration in durations)))
+            routed.append(listing)
+        return routed
+
+    def aggregate_durations(self, durations: list) -> datetime.timedelta:
+        """
+        Combines the travel times of one listing into its TRAVEL TIME.
+        Args:
+            durations: travel time in seconds for each commute and mode, in column order
+
+        Returns: the aggregate travel time
+        """
+        if self.aggregate == "max":
+            seconds = max(durations)
+        elif self.aggregate == "min":
+            seconds = min(durations)
+        else:
+            weights = [weight for _, _, weight in self.legs]
+            seconds = sum(weight * duration for weight, duration in zip(weights, durations)) / sum(weights)
+        return datetime.timedelta(seconds=seconds)
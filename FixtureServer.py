@@ -0,0 +1,212 @@
+import json, re, threading, time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+# PID of the first listing served from a recorded search page
+FIRST_PID = 7_000_000_000
+
+
+class FixtureServer:
+    def __init__(self, durations: dict = None, default_duration: float = 600.0, fail_table: bool = False,
+                 host: str = "127.0.0.1", port: int = 0, search_page: str = None, listing_page: str = None,
+                 listings: int = 0, pid_offset: int = 0, latency: float = 0.0, fail_search_offsets: set = None):
+        """
+        Local stand-in for an OSRM server that serves canned responses, so routing can be run without the network.
+        Point a Search at it with the "osrm_host" search setting, or a Router with its osrm_host argument.
+        Supports the route and table services of every profile (/routed-<profile>/route/v1/..., .../table/v1/...).
+        Given a recorded search page and listing page, it also stands in for Craigslist: point a Search at it with the
+        "craigslist_host" search setting too. The listings of the recorded search page are repeated, with new PIDs
+        and shifted lat/lons, to serve any number of listings, page by page.
+        Args:
+            durations: Canned travel times in seconds, keyed by the (lat, lon) of the start of the route, rounded to
+                5 decimals. Use None as a value to simulate OSRM not finding a route.
+            default_duration: Travel time for coordinates not in durations
+            fail_table: Answer every table request with a 500, to exercise the single route fallback
+            host: Interface to listen on
+            port: Port to listen on. 0 picks a free port.
+            search_page: HTML of a recorded Craigslist results page, with the listings' lat/lon in its embedded JSON
+            listing_page: HTML of a recorded Craigslist listing page
+            listings: number of listings served across the results pages
+            pid_offset: listings served start at PID FIRST_PID + pid_offset. Raising it between runs drops the oldest
+                listings and adds as many new ones.
+            latency: seconds every response is delayed by
+            fail_search_offsets: answer the results pages starting at these listing offsets with a 503
+        """
+        self.durations = durations if durations is not None else {}
+        self.default_duration = default_duration
+        self.fail_table = fail_table
+        self.listings = listings
+        self.pid_offset = pid_offset
+        self.latency = latency
+        self.fail_search_offsets = fail_search_offsets if fail_search_offsets is not None else set()
+        self.request_counts = {"route": 0, "table": 0, "search": 0, "listing": 0}
+        self._lock = threading.Lock()
+        if search_page is not None:
+            self.load_search_page(search_page)
+        self.listing_page = listing_page
+        self.server = ThreadingHTTPServer((host, port), self._make_handler())
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        """Scheme, host and port of the running server."""
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "FixtureServer":
+        """Starts serving in a background thread."""
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stops the server and frees the port."""
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self) -> "FixtureServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def load_search_page(self, search_page: str) -> None:
+        """
+        Splits a recorded results page into the HTML around its listings, the HTML of each listing, and each
+        listing's lat/lon from the embedded JSON, so pages of other listings can be put together from them.
+        Args:
+            search_page: HTML of a recorded Craigslist results page
+        """
+        listing_items = list(re.finditer(r'<li class="cl-static-search-result".*?</li>', search_page, re.S))
+        self.page_head = search_page[:listing_items[0].start()]
+        self.page_tail = search_page[listing_items[-1].end():]
+        self.listing_items = [item.group() for item in listing_items]
+        script = re.search(r'(<script[^>]*id="ld_searchpage_results"[^>]*>)(.*?)(</script>)', self.page_head, re.S)
+        self.search_page_json = json.loads(script.group(2))
+        self.page_head = self.page_head.replace(script.group(), script.group(1) + "{search_page_json}" + script.group(3))
+        self.lat_lons = [(item["item"]["latitude"], item["item"]["longitude"])
+                         for item in self.search_page_json["itemListElement"]]
+
+    def listing_lat_lon(self, i: int) -> tuple:
+        """Gets the lat/lon of the i-th listing served. Each repeat of the recorded listings is moved north-east."""
+        lat, lon = self.lat_lons[i % len(self.lat_lons)]
+        repeat = i // len(self.lat_lons)
+        return round(lat + repeat * 0.0007, 6), round(lon + repeat * 0.0009, 6)
+
+    def render_search_page(self, offset: int) -> str:
+        """
+        Puts together the results page starting at a listing offset, like Craigslist's s= parameter.
+        Args:
+            offset: number of listings on the pages before this one
+
+        Returns: HTML of the results page, without listings past the last one
+        """
+        page_size = len(self.listing_items)
+        items, json_items = [], []
+        for i in range(offset, min(offset + page_size, self.listings)):
+            pid = FIRST_PID + self.pid_offset + i
+            item = re.sub(r'href="https?://[^/"]+(/[^"]*/)\d+\.html"', f'href="{self.url}\\g<1>{pid}.html"',
+                          self.listing_items[i % page_size])
+            items.append(item)
+            lat, lon = self.listing_lat_lon(self.pid_offset + i)
+            json_item = json.loads(json.dumps(self.search_page_json["itemListElement"][i % page_size]))
+            json_item["position"] = str(i - offset)
+            json_item["item"]["latitude"], json_item["item"]["longitude"] = lat, lon
+            json_items.append(json_item)
+        search_page_json = dict(self.search_page_json, itemListElement=json_items)
+        return (self.page_head.replace("{search_page_json}", json.dumps(search_page_json))
+                + "\n".join(items) + self.page_tail)
+
+    def render_listing_page(self, pid: int) -> str:
+        """
+        Puts together the listing page of a listing served on the results pages, with its lat/lon.
+        Args:
+            pid: PID of the listing
+
+        Returns: HTML of the listing page
+        """
+        lat, lon = self.listing_lat_lon(pid - FIRST_PID)
+        listing_page = re.sub(r'data-latitude="[^"]*"', f'data-latitude="{lat}"', self.listing_page)
+        return re.sub(r'data-longitude="[^"]*"', f'data-longitude="{lon}"', listing_page)
+
+    def duration_for(self, lon_lat: str):
+        """
+        Looks up the canned travel time for an OSRM "lon,lat" coordinate.
+        Args:
+            lon_lat: coordinate as it appears in the OSRM URL
+
+        Returns: duration in seconds, or None if there is no route
+        """
+        lon, lat = (float(value) for value in lon_lat.split(","))
+        return self.durations.get((round(lat, 5), round(lon, 5)), self.default_duration)
+
+    def _count(self, service: str) -> None:
+        with self._lock:
+            self.request_counts[service] += 1
+
+    def _make_handler(self):
+        fixture_server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, like the real server
+
+            def log_message(self, format, *args):
+                pass
+
+            def send_json(self, body: dict, status: int = 200) -> None:
+                self.send_data(json.dumps(body).encode(), "application/json", status)
+
+            def send_data(self, data: bytes, content_type: str, status: int = 200) -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if fixture_server.latency:
+                    time.sleep(fixture_server.latency)
+                parsed = urlsplit(self.path)
+                if parsed.path.startswith("/search/") and hasattr(fixture_server, "listing_items"):
+                    fixture_server._count("search")
+                    offset = int(parse_qs(parsed.query).get("s", ["0"])[0])
+                    if offset in fixture_server.fail_search_offsets:
+                        self.send_data(b"Service Unavailable", "text/plain", status=503)
+                        return
+                    self.send_data(fixture_server.render_search_page(offset).encode(), "text/html")
+                    return
+                listing_pid = re.search(r"/(\d+)\.html$", parsed.path)
+                if listing_pid is not None and fixture_server.listing_page is not None:
+                    fixture_server._count("listing")
+                    self.send_data(fixture_server.render_listing_page(int(listing_pid.group(1))).encode(),
+                                   "text/html")
+                    return
+                path_parts = parsed.path.strip("/").split("/")
+                # /routed-<profile>/<service>/v1/<profile>/<coordinates>
+                if len(path_parts) != 5 or path_parts[1] not in ("route", "table"):
+                    self.send_json({"code": "InvalidUrl"}, status=400)
+                    return
+                service = path_parts[1]
+                coordinates = path_parts[4].split(";")
+                fixture_server._count(service)
+
+                if service == "route":
+                    duration = fixture_server.duration_for(coordinates[0])
+                    if duration is None:
+                        self.send_json({"code": "NoRoute", "routes": []})
+                    else:
+                        self.send_json({"code": "Ok", "routes": [{"duration": duration}]})
+                    return
+
+                if fixture_server.fail_table:
+                    self.send_json({"code": "InternalError"}, status=500)
+                    return
+                query = parse_qs(parsed.query)
+                sources = [int(i) for i in query["sources"][0].split(";")]
+                destinations = [int(i) for i in query["destinations"][0].split(";")]
+                durations = [[fixture_server.duration_for(coordinates[source]) for _ in destinations]
+                             for source in sources]
+                self.send_json({"code": "Ok", "durations": durations})
+
+        return Handler
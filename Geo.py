@@ -0,0 +1,32 @@
+import numpy as np
+
+# Mean radius of the Earth (IUGG), in miles
+EARTH_RADIUS_MILES = 3958.7613
+# Length of one degree of latitude, or of longitude at the equator, in miles
+MILES_PER_DEGREE = np.pi * EARTH_RADIUS_MILES / 180
+
+
+def haversine_miles(lat_lons, reference_lat_lons) -> np.ndarray:
+    """
+    Great-circle distances from every point to every reference point, in one vectorized pass. The Earth is treated as
+    a sphere of EARTH_RADIUS_MILES, which stays within 0.6% of the WGS-84 geodesic distance geopy.distance.distance
+    computes, anywhere on Earth. Around San Francisco the error is under 0.25%, i.e. under 0.1 mile for the distances
+    a search covers (up to about 40 miles), so a CROW_DISTANCE rounded to 0.1 mile is off by at most one step. See
+    benchmarks/bench_crow_distance.py.
+    Args:
+        lat_lons: (lat, lon) points in degrees, shape (N, 2)
+        reference_lat_lons: (lat, lon) reference points in degrees, shape (M, 2)
+
+    Returns: array of distances in miles, shape (N, M)
+    """
+    points = np.radians(np.asarray(lat_lons, dtype=float).reshape(-1, 2))
+    references = np.radians(np.asarray(reference_lat_lons, dtype=float).reshape(-1, 2))
+    lat = points[:, :1]
+    lon = points[:, 1:]
+    reference_lat = references[:, 0]
+    reference_lon = references[:, 1]
+
+    a = (np.sin((reference_lat - lat) / 2) ** 2
+         + np.cos(lat) * np.cos(reference_lat) * np.sin((reference_lon - lon) / 2) ** 2)
+    # Clip rounding errors that would push a (nearly) antipodal pair past 1
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
@@ -0,0 +1,222 @@
+import hashlib, os, sqlite3, threading, time
+
+import requests
+from requests.structures import CaseInsensitiveDict
+from consts import HTTP_CACHE_EVICT_TO, HTTP_CACHE_MAX_BYTES
+
+
+class CacheMissError(requests.RequestException):
+    """Raised in replay mode when a URL is not in the cache."""
+
+
+class HTTPCache:
+    def __init__(self, folder: str, max_bytes: int = HTTP_CACHE_MAX_BYTES, replay: bool = False,
+                 evict_to: float = HTTP_CACHE_EVICT_TO):
+        """
+        On-disk cache of HTTP responses. Bodies are stored once per content hash under <folder>/objects, and an index
+        maps each URL to its body and validators (ETag, Last-Modified). Cached URLs are revalidated with conditional
+        requests, so an unchanged page costs a 304 instead of a full download.
+        Args:
+            folder: Directory to store the cache in. Created if it does not exist.
+            max_bytes: Max total size of stored bodies. Least recently used URLs are evicted first, as soon as a stored
+                body takes the cache over it.
+            replay: Serve every request from the cache without touching the network. Missing URLs raise
+                CacheMissError.
+            evict_to: Share of max_bytes the cache is trimmed down to once it goes over max_bytes
+        """
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.replay = replay
+        self.evict_to = evict_to
+        self.stored_bytes = 0  # total size of stored bodies, set by evict and kept up to date by store
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(folder, "objects"), exist_ok=True)
+        self.conn = sqlite3.connect(os.path.join(folder, "index.sqlite"), check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "url TEXT PRIMARY KEY, sha256 TEXT, size INTEGER, etag TEXT, last_modified TEXT, "
+                "content_type TEXT, encoding TEXT, last_used REAL)"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self.evict()
+
+    def object_path(self, sha256: str) -> str:
+        """Path of a stored body, sharded by the first two characters of its hash."""
+        return os.path.join(self.folder, "objects", sha256[:2], sha256)
+
+    def lookup(self, url: str):
+        """
+        Gets the index entry of a URL.
+        Args:
+            url: requested URL
+
+        Returns: dict of the entry, or None if the URL is not cached
+        """
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT sha256, etag, last_modified, content_type, encoding FROM responses WHERE url = ?", (url,)
+            ).fetchone()
+        if row is None or not os.path.exists(self.object_path(row[0])):
+            return None
+        return dict(zip(("sha256", "etag", "last_modified", "content_type", "encoding"), row))
+
+    def conditional_headers(self, entry: dict) -> dict:
+        """
+        Builds the headers that make a request conditional on the cached copy being stale.
+        Args:
+            entry: index entry from lookup
+
+        Returns: dict of If-None-Match/If-Modified-Since headers
+        """
+        headers = {}
+        if entry["etag"]:
+            headers["If-None-Match"] = entry["etag"]
+        if entry["last_modified"]:
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def make_response(self, url: str, entry: dict) -> requests.Response:
+        """
+        Builds a response out of a cached body, and marks the URL as recently used.
+        Args:
+            url: requested URL
+            entry: index entry from lookup
+
+        Returns: requests.Response with status 200
+        """
+        with open(self.object_path(entry["sha256"]), "rb") as object_file:
+            content = object_file.read()
+        with self._lock, self.conn:
+            self.conn.execute("UPDATE responses SET last_used = ? WHERE url = ?", (time.time(), url))
+
+        response = requests.Response()
+        response.status_code = 200
+        response.url = url
+        response._content = content
+        response.encoding = entry["encoding"]
+        response.headers = CaseInsensitiveDict({"Content-Type": entry["content_type"] or ""})
+        if entry["etag"]:
+            response.headers["ETag"] = entry["etag"]
+        if entry["last_modified"]:
+            response.headers["Last-Modified"] = entry["last_modified"]
+        return response
+
+    def store(self, url: str, response: requests.Response) -> None:
+        """
+        Stores a 200 response.
+        Args:
+            url: requested URL
+            response: response to store
+        """
+        content = response.content
+        sha256 = hashlib.sha256(content).hexdigest()
+        path = self.object_path(sha256)
+        new_object = not os.path.exists(path)
+        if new_object:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temporary file first so a crash never leaves a partial body behind
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(temp_path, "wb") as object_file:
+                object_file.write(content)
+            os.replace(temp_path, path)
+
+        with self._lock, self.conn:
+            old_row = self.conn.execute("SELECT sha256, size FROM responses WHERE url = ?", (url,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, sha256, len(content), response.headers.get("ETag"), response.headers.get("Last-Modified"),
+                 response.headers.get("Content-Type"), response.encoding, time.time())
+            )
+            # Delete the previous body of this URL if nothing else points to it
+            orphaned = (old_row is not None and old_row[0] != sha256
+                        and self.conn.execute("SELECT EXISTS (SELECT 1 FROM responses WHERE sha256 = ?)",
+                                              (old_row[0],)).fetchone()[0] == 0)
+            self.stored_bytes += (len(content) if new_object else 0) - (old_row[1] if orphaned else 0)
+            over_limit = self.stored_bytes > self.max_bytes
+        if orphaned:
+            try:
+                os.remove(self.object_path(old_row[0]))
+            except FileNotFoundError:
+                pass
+        if over_limit:
+            self.evict(int(self.max_bytes * self.evict_to))
+
+    def get(self, fetch, url: str, **kwargs) -> requests.Response:
+        """
+        Gets a URL through the cache. Cached URLs are revalidated with a conditional request, and a 304 is answered
+        from the cache. In replay mode the network is never used.
+        Args:
+            fetch: function sending a GET request, called as fetch(url, **kwargs)
+            url: URL to request
+            **kwargs: passed on to fetch
+
+        Returns: the response
+        """
+        entry = self.lookup(url)
+        if self.replay:
+            if entry is None:
+                with self._lock:
+                    self.misses += 1
+                raise CacheMissError(f"{url} is not in the HTTP cache (replay mode)")
+            with self._lock:
+                self.hits += 1
+            return self.make_response(url, entry)
+
+        if entry is not None:
+            kwargs["headers"] = {**kwargs.get("headers", {}), **self.conditional_headers(entry)}
+        response = fetch(url, **kwargs)
+        if response.status_code == 304 and entry is not None:
+            with self._lock:
+                self.revalidated += 1
+            return self.make_response(url, entry)
+
+        with self._lock:
+            self.misses += 1
+        if response.status_code == 200:
+            self.store(url, response)
+        return response
+
+    def evict(self, target_bytes: int = None) -> None:
+        """
+        Deletes the least recently used URLs until stored bodies fit in target_bytes.
+        Args:
+            target_bytes: max total size of the bodies kept. Defaults to max_bytes.
+        """
+        if target_bytes is None:
+            target_bytes = self.max_bytes
+        with self._lock, self.conn:
+            # Bodies are shared between URLs with identical content, so count each one once
+            rows = self.conn.execute(
+                "SELECT url, sha256, size FROM responses ORDER BY last_used DESC"
+            ).fetchall()
+            kept_objects = set()
+            kept_bytes = 0
+            for url, sha256, size in rows:
+                if sha256 not in kept_objects and kept_bytes + size <= target_bytes:
+                    kept_objects.add(sha256)
+                    kept_bytes += size
+            evicted_urls = [(url,) for url, sha256, _ in rows if sha256 not in kept_objects]
+            self.conn.executemany("DELETE FROM responses WHERE url = ?", evicted_urls)
+            evicted_objects = {sha256 for _, sha256, _ in rows} - kept_objects
+            self.stored_bytes = kept_bytes
+        for sha256 in evicted_objects:
+            try:
+                os.remove(self.object_path(sha256))
+            except FileNotFoundError:
+                pass
+
+    def stats(self) -> dict:
+        """
+        Hit/revalidated/miss counts since the cache was opened. Revalidated means a 304 was served from the cache.
+        Returns: dict with "hits", "revalidated" and "misses"
+        """
+        return {"hits": self.hits, "revalidated": self.revalidated, "misses": self.misses}
+
+    def close(self) -> None:
+        """Applies the size limit and closes the index."""
+        self.evict()
+        self.conn.close()
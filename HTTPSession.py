@@ -0,0 +1,214 @@
+import random, threading, time
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from consts import (
+    HEADER,
+    HTTP_BACKOFF_BASE,
+    HTTP_BACKOFF_MAX,
+    HTTP_MAX_HOSTS,
+    HTTP_MAX_RETRIES,
+    HTTP_POOL_SIZE,
+    HTTP_RETRY_STATUSES,
+    HTTP_TIMEOUT
+)
+from HTTPCache import HTTPCache
+from RateLimiter import RateLimiter
+
+
+class HTTPSession:
+    _default = None
+    _default_lock = threading.Lock()
+
+    def __init__(self, pool_size: int = HTTP_POOL_SIZE, timeout: tuple = HTTP_TIMEOUT, headers: dict = HEADER,
+                 http_cache: HTTPCache = None, max_in_flight: int = None, rate_limiter: RateLimiter = None,
+                 max_retries: int = HTTP_MAX_RETRIES, in_flight: threading.BoundedSemaphore = None):
+        """
+        Wrapper around a requests.Session shared by a Search and all of its Listings. Keeps one pool of keep-alive
+        connections per host (Craigslist, OSRM), so each request after the first to a host skips the TCP and TLS
+        handshake. Requests are rate limited per host, and retried with backoff when they fail with a connection
+        error, a timeout, 429 or a 5xx.
+        Args:
+            pool_size: Max number of connections kept open per host. Should be at least the number of threads
+                making requests, otherwise extra connections are opened and thrown away.
+            timeout: (connect, read) timeout in seconds, used for every request unless overridden
+            headers: Default headers sent with every request
+            http_cache: HTTPCache for requests made with use_cache=True. No caching if not given.
+            max_in_flight: Max number of requests sent at the same time through this session, across every thread
+                and Search using it. No limit if not given.
+            rate_limiter: RateLimiter for requests to each host. A new one with the default limits if not given.
+            max_retries: Max number of times a failed request is retried
+            in_flight: Semaphore limiting the requests in flight across several sessions. Used instead of
+                max_in_flight if given.
+        """
+        self.timeout = timeout
+        self.http_cache = http_cache
+        if in_flight is None and max_in_flight:
+            in_flight = threading.BoundedSemaphore(max_in_flight)
+        self._in_flight = in_flight
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter()
+        self.max_retries = max_retries
+        self.retries = 0
+        self.failures = 0
+        self.hosts = {}  # host -> {"requests", "bytes"}, for requests that got a response
+        self._counter_lock = threading.Lock()
+        self.session = requests.Session()
+        self.session.headers.update(headers)
+        self.adapter = HTTPAdapter(pool_connections=HTTP_MAX_HOSTS, pool_maxsize=pool_size)
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+
+    @classmethod
+    def get_default(cls) -> "HTTPSession":
+        """
+        Gets a process-wide session, for Listings created without one.
+        Returns: the shared HTTPSession
+        """
+        with cls._default_lock:
+            if cls._default is None:
+                cls._default = cls()
+            return cls._default
+
+    def get(self, url: str, use_cache: bool = False, **kwargs) -> requests.Response:
+        """
+        Sends a GET request through the pooled session.
+        Args:
+            url: URL to request
+            use_cache: Go through the HTTP cache, if the session has one
+            **kwargs: passed on to requests.Session.get
+
+        Returns: the response. After the last retry, this can still be a 429 or 5xx response.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        if use_cache and self.http_cache is not None:
+            return self.http_cache.get(self.fetch, url, **kwargs)
+        return self.fetch(url, **kwargs)
+
+    def fetch(self, url: str, **kwargs) -> requests.Response:
+        """
+        Sends a GET request once the host's rate limit allows it, and retries it with jittered exponential backoff
+        if it fails with a connection error, a timeout, 429 or a 5xx.
+        Args:
+            url: URL to request
+            **kwargs: passed on to requests.Session.get
+
+        Returns: the response
+        """
+        host = urlsplit(url).hostname or ""
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire(host)
+            try:
+                response = self.send(url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    self.count_failure()
+                    raise
+                retry_after = None
+            else:
+                self.count_response(host, response)
+                if response.status_code not in HTTP_RETRY_STATUSES:
+                    self.rate_limiter.record_success(host)
+                    return response
+                retry_after = self.get_retry_after(response)
+                if response.status_code == 429:
+                    self.rate_limiter.record_throttled(host, retry_after)
+                if attempt >= self.max_retries:
+                    self.count_failure()
+                    return response
+
+            # Full jitter: a random wait up to the exponential backoff, so threads retrying together spread out
+            backoff = random.uniform(0, min(HTTP_BACKOFF_BASE * 2 ** attempt, HTTP_BACKOFF_MAX))
+            with self._counter_lock:
+                self.retries += 1
+            time.sleep(max(backoff, retry_after or 0.0))
+            attempt += 1
+
+    def send(self, url: str, **kwargs) -> requests.Response:
+        """
+        Sends a single GET request, waiting for a free slot if the number of requests in flight is limited.
+        Args:
+            url: URL to request
+            **kwargs: passed on to requests.Session.get
+
+        Returns: the response
+        """
+        if self._in_flight is None:
+            return self.session.get(url, **kwargs)
+        with self._in_flight:
+            return self.session.get(url, **kwargs)
+
+    @staticmethod
+    def get_retry_after(response: requests.Response) -> float | None:
+        """
+        Reads the Retry-After header of a response, given either in seconds or as an HTTP date.
+        Args:
+            response: 429 or 5xx response
+
+        Returns: seconds to wait, or None if the header is missing or invalid
+        """
+        retry_after = response.headers.get("Retry-After")
+        if not retry_after:
+            return None
+        try:
+            return max(float(retry_after), 0.0)
+        except ValueError:
+            pass
+        try:
+            return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0.0)
+        except (TypeError, ValueError):
+            return None
+
+    def count_response(self, host: str, response: requests.Response) -> None:
+        """Counts a response and the bytes of its body towards its host."""
+        with self._counter_lock:
+            host_stats = self.hosts.setdefault(host, {"requests": 0, "bytes": 0})
+            host_stats["requests"] += 1
+            host_stats["bytes"] += len(response.content)
+
+    def count_failure(self) -> None:
+        """Counts a request that still failed after its last retry."""
+        with self._counter_lock:
+            self.failures += 1
+
+    def retry_stats(self) -> dict:
+        """
+        Counts of retries and throttling since the session was created.
+        Returns: dict with "retries", "failures" (requests that failed after every retry), "throttled" (429
+            responses), "delayed" (requests held back by the rate limit) and "delayed_seconds"
+        """
+        return {"retries": self.retries, "failures": self.failures, **self.rate_limiter.stats()}
+
+    def host_stats(self) -> dict:
+        """
+        Counts of responses and bytes downloaded per host since the session was created. Pages served from the HTTP
+        cache are not counted, and a 304 revalidation counts as a request with no bytes.
+        Returns: dict of host -> dict with "requests" and "bytes"
+        """
+        with self._counter_lock:
+            return {host: dict(host_stats) for host, host_stats in self.hosts.items()}
+
+    def connection_stats(self) -> dict:
+        """
+        Counts connections opened vs. reused across all host pools. A request that did not open a new connection
+        reused a kept-alive one.
+        Returns: dict with "requests", "opened" and "reused" counts
+        """
+        pools = self.adapter.poolmanager.pools
+        opened = 0
+        requests_made = 0
+        for pool_key in pools.keys():
+            pool = pools.get(pool_key)
+            if pool is None:
+                continue
+            opened += pool.num_connections
+            requests_made += pool.num_requests
+        return {"requests": requests_made, "opened": opened, "reused": max(requests_made - opened, 0)}
+
+    def close(self) -> None:
+        """Closes all pooled connections, and the HTTP cache."""
+        self.session.close()
+        if self.http_cache is not None:
+            self.http_cache.close()
@@ -123,6 +123,7 @@ class JSONProcessing:
 
         """
         files = os.listdir(json_folder)
-        files = [file for file in files if file.endswith(".json")]
+        # Metrics reports were written as <search_name>.metrics.json before they were renamed to .metrics
+        files = [file for file in files if file.endswith(".json") and not file.endswith(".metrics.json")]
         return files
 
@@ -1,23 +1,61 @@
-import datetime, json, requests
+import datetime
+from array import array
 
 import bs4
-from bs4 import BeautifulSoup
-from consts import HEADER, COMMUTE_LAT_LON, COMMUTE_TYPE, OSRM_URL
-from geopy import distance
+import numpy as np
+import pandas as pd
+from consts import COMMUTE_LAT_LON, HTML_PARSER, PARTIAL_PARSING, cols
+from Geo import haversine_miles
+from HTTPSession import HTTPSession
+from Metrics import Metrics
+from Parsing import listing_page_strainer, make_soup
+from Routing import Router
+from Storage import get_timedelta_cols
+
+# Stand-in for a missing timedelta in an int64 column of microseconds. pandas reads it as NaT
+missing_timedelta = np.iinfo("int64").min
 
 
 class Listing:
-    def __init__(self, listing_raw: bs4.Tag, commute_type: str = "foot"):
+    # Thousands of Listings can be alive at once, so they get no per-instance __dict__
+    __slots__ = ("raw", "session", "router", "routes", "search_page_item", "search_page_only", "html_parser",
+                 "partial_parsing", "commute_lat_lon", "metrics", "listing_page_fetched", "from_store", "url", "pid",
+                 "title", "price", "location", "posted", "lat_lon", "crow_distance", "travel_time", "travel_times")
+
+    def __init__(self, listing_raw: bs4.Tag, commute_type: str = "foot", session: HTTPSession = None,
+                 router: Router = None, search_page_item: dict = None, search_page_only: bool = False,
+                 html_parser: str = HTML_PARSER, partial_parsing: bool = PARTIAL_PARSING,
+                 commute_lat_lon: tuple = COMMUTE_LAT_LON, metrics: Metrics = None):
         """
         Constructor for a Listing. Partially parses a bs4.Tag element to populate the instance with relevant info about
         the listing.
         Only partially parses so the listing can be checked against existing pid's and its HTML does not have to
-        be requested.
+        be requested. Once the fields are extracted, drop_parse_tree lets go of the search page, and the OSRM
+        response is dropped as soon as the travel time is read from it.
         Args:
             listing_raw: bs4.Tag element of a Craigslist listing
+            session: HTTPSession used for the listing page request. Defaults to a process-wide session.
+            router: Router used to query OSRM for the commute time. Defaults to one using the same session.
+            search_page_item: This listing's entry in the JSON embedded in the search page, if there is one
+            search_page_only: Take lat/lon and date posted from the search page when it has them, and only request
+                the listing page for fields that are still missing
+            html_parser: BeautifulSoup parser backend for the listing page
+            partial_parsing: Only parse the elements of the listing page that are read
+            commute_lat_lon: (lat, lon) the crow distance is measured to
+            metrics: Metrics the listing page fetch and parse times are recorded in. Not recorded if not given.
         """
         self.raw = listing_raw
-        self.routes = json.dumps({})
+        self.session = session if session is not None else HTTPSession.get_default()
+        self.router = router if router is not None else Router(session=self.session)
+        self.routes = None  # OSRM response, only kept until the travel time is read from it
+        self.search_page_item = search_page_item if search_page_item is not None else {}
+        self.search_page_only = search_page_only
+        self.html_parser = html_parser
+        self.partial_parsing = partial_parsing
+        self.commute_lat_lon = commute_lat_lon
+        self.metrics = metrics if metrics is not None else Metrics(enabled=False)
+        self.listing_page_fetched = False
+        self.from_store = False
 
         # Get listing url
         self.url = self.raw.find("a").get("href")
@@ -27,49 +65,119 @@ class Listing:
         self.title = ""
         self.price = 0
         self.location = ""
-        self.posted = datetime.timedelta()
+        self.posted = None  # timedelta object once found
         self.lat_lon = ()
         self.crow_distance = 0.0
-        self.travel_time = datetime.timedelta()
+        self.travel_time = None  # timedelta object once routed
+        self.travel_times = {}  # travel time column -> timedelta, when there are several commutes or modes
 
-    def generate_listing_data(self) -> None:
+    def generate_listing_data(self, route: bool = True) -> None:
         """
         Parses the HTML and grabs all the relevant info. The only thing generated is the travel time to a desired
         commute location.
+        Args:
+            route: Compute the crow distance and query OSRM for the travel time. Set to False when both are batched by
+                the caller.
         Returns: Nothing
 
+        """
+        # Already done if the caller parsed the search page fields to filter on them
+        if self.raw is not None:
+            self.get_summary_info()
+            if self.search_page_only:
+                self.get_search_page_info()
+            self.drop_parse_tree()
+        if not self.lat_lon or self.posted is None:
+            self.get_listing_page_info()
+        if route:
+            self.get_crow_distance()
+            self.init_routes()
+            self.get_travel_time()
+
+    def get_summary_info(self) -> None:
+        """
+        Gets price, title and location from the listing HTML on the search page. Needs no requests, so listings can
+        be filtered on these before anything is fetched.
         """
         # Usually price= $1,000. So replace comma with empty char and convert it to an int.
         self.price = int(self.raw.find(class_="price").text[1:].replace(",", "").strip())
         self.title = self.raw.find(class_="title").text.strip()
         self.location = self.raw.find(class_="location").text.strip()
-        self.get_listing_page_info()
-        self.init_routes()
-        self.get_travel_time()
+
+    def drop_parse_tree(self) -> None:
+        """
+        Lets go of the listing's HTML and its search page JSON once the search page fields are parsed. The Tag links
+        to the whole search page, so keeping it would keep the page's parse tree alive as long as the Listing.
+        """
+        self.raw = None
+        self.search_page_item = None
+
+    def load_stored(self, record: dict, commute_key: str) -> None:
+        """
+        Fills in the data another Search already resolved for this listing, so it does not have to be fetched again.
+        The travel time is only used if it was routed to the same commute. The stored crow distance is not used, as it
+        was measured to the commute of whichever Search stored the listing, so the caller measures it again.
+        Args:
+            record: stored fields from ListingStore.get
+            commute_key: CommuteMatrix.commute_key of the commutes this listing is being routed to
+        """
+        self.from_store = True
+        self.lat_lon = (record["lat"], record["lon"])
+        self.posted = datetime.datetime.now() - datetime.datetime.fromtimestamp(record["posted_at"])
+        if record["commute_key"] == commute_key:
+            self.travel_time = datetime.timedelta(seconds=record["travel_time"])
+            self.travel_times = {col: datetime.timedelta(seconds=seconds)
+                                 for col, seconds in record["travel_times"].items()}
+
+    def get_search_page_info(self) -> None:
+        """
+        Gets lat/lon and date posted from the search page, where it has them. Lat/lon comes from data-latitude and
+        data-longitude attributes in the listing HTML, or the JSON embedded in the search page. Date posted comes from
+        a <time datetime="..."> element in the listing HTML.
+        """
+        lat_lon_element = self.raw
+        if not lat_lon_element.has_attr("data-latitude"):
+            lat_lon_element = self.raw.find(attrs={"data-latitude": True})
+        if lat_lon_element is not None and lat_lon_element.has_attr("data-longitude"):
+            self.lat_lon = (
+                float(lat_lon_element["data-latitude"]),
+                float(lat_lon_element["data-longitude"]),
+            )
+        elif "latitude" in self.search_page_item and "longitude" in self.search_page_item:
+            self.lat_lon = (
+                float(self.search_page_item["latitude"]),
+                float(self.search_page_item["longitude"]),
+            )
+
+        time_element = self.raw.find("time", attrs={"datetime": True})
+        if time_element is not None:
+            # Usually "2023-10-01 12:30"; the date is all that's needed
+            date_posted = time_element["datetime"][:10]
+            self.posted = datetime.datetime.now() - datetime.datetime.strptime(date_posted, "%Y-%m-%d")
 
     def get_listing_page_info(self) -> None:
         """
         Sends a GET request to obtain the Listing HTML. Then gets all the info from the Listing page that could not
         be obtained from the Search page.
         """
-        listing_page_source = requests.get(self.url, headers=HEADER)
-        # Create new soup of new listing
-        listing_soup = BeautifulSoup(listing_page_source.text, "html.parser")
+        with self.metrics.time("listing_fetch"):
+            listing_page_source = self.session.get(self.url, use_cache=True)
+            listing_page_source.raise_for_status()
+        self.listing_page_fetched = True
+        with self.metrics.time("listing_parse"):
+            # Create new soup of new listing
+            listing_soup = make_soup(listing_page_source.text, self.html_parser,
+                                     parse_only=listing_page_strainer if self.partial_parsing else None)
 
-        # Grab element with lat/lon data
-        listing_lat_lon_element = listing_soup.find(id="map")
-        self.lat_lon = (
-            float(listing_lat_lon_element["data-latitude"]),
-            float(listing_lat_lon_element["data-longitude"]),
-        )
+            # Grab element with lat/lon data
+            listing_lat_lon_element = listing_soup.find(id="map")
+            self.lat_lon = (
+                float(listing_lat_lon_element["data-latitude"]),
+                float(listing_lat_lon_element["data-longitude"]),
+            )
 
-        # Crow distance is the distance to the commute location as the crow flies.
-        self.crow_distance = round(
-            distance.distance(self.lat_lon, COMMUTE_LAT_LON).miles, 1
-        )
-
-        # Grab date and time of posting
-        date_posted, time_posted = listing_soup.find(class_="date timeago").text.split()
+            # Grab date and time of posting
+            date_posted, time_posted = listing_soup.find(class_="date timeago").text.split()
 
         # Convert date posted to days since now that it has been up.
         days_since = datetime.datetime.strptime(date_posted, "%Y-%m-%d")
@@ -77,9 +185,19 @@ class Listing:
         # Converts datetime object with hours, etc. to days ago
         self.posted = datetime.datetime.now() - days_since  # timedelta object
 
-    def get_data(self) -> []:
+    def get_crow_distance(self) -> None:
+        """
+        Stores the distance to the commute location as the crow flies, in miles, as an instance variable
+        """
+        self.crow_distance = round(
+            float(haversine_miles(self.lat_lon, self.commute_lat_lon)[0, 0]), 1
+        )
+
+    def get_data(self, travel_time_cols: list = ()) -> []:
         """
         Getter for Listing data
+        Args:
+            travel_time_cols: extra travel time columns to add after the cols, from travel_times
         Returns: an array of the listing data
 
         """
@@ -92,21 +210,85 @@ class Listing:
             self.location,
             self.crow_distance,
             self.posted,
+            self.lat_lon[0],
+            self.lat_lon[1],
         ]
+        to_return.extend(self.travel_times[col] for col in travel_time_cols)
         return to_return
 
     def init_routes(self) -> None:
         """
         Queries OSRM for commute time by chosen commute type. Saves it in the current instance
         """
-        formatted_url = OSRM_URL.format(commute_type=COMMUTE_TYPE, start_lon=self.lat_lon[1], start_lat=self.lat_lon[0],
-                                        commute_lon=COMMUTE_LAT_LON[1], commute_lat=COMMUTE_LAT_LON[0])
-        r = requests.get(formatted_url)
-        self.routes = json.loads(r.content)
+        self.routes = self.router.route(self.lat_lon)
 
     def get_travel_time(self) -> None:
         """
-        Stores travel time to commute location as an instance variable
+        Stores travel time to commute location as an instance variable, then drops the OSRM response
         """
         route_data_json = self.routes.get("routes")[0]  # JSON of route information
         self.travel_time = datetime.timedelta(seconds=route_data_json["duration"])
+        self.routes = None
+
+
+class ListingColumns:
+    def __init__(self, columns: list = cols):
+        """
+        Accumulates finished listings column by column, in typed arrays, so a run holds a few machine words per
+        listing instead of a list of Python objects. PIDs and prices are int64, timedeltas are int64 microseconds
+        and floats are float64. Only text columns are kept as lists of str.
+        Args:
+            columns: columns of the listings, in the order of Listing.get_data
+        """
+        self.columns = columns
+        # Travel time columns of every commute and mode come after the cols, like in Listing.get_data
+        self.travel_time_cols = columns[len(cols):]
+        self.timedelta_cols = set(get_timedelta_cols(columns))
+        self.values = {}
+        for col in columns:
+            if col in self.timedelta_cols or col in ("PID", "PRICE ($)"):
+                self.values[col] = array("q")
+            elif col in ("CROW_DISTANCE", "LAT", "LON"):
+                self.values[col] = array("d")
+            else:
+                self.values[col] = []
+
+    def __len__(self) -> int:
+        return len(self.values[self.columns[0]])
+
+    def append(self, listing: Listing) -> None:
+        """
+        Adds a listing's fields. The Listing itself is not kept.
+        Args:
+            listing: Listing with every field resolved
+        """
+        for col, value in zip(self.columns, listing.get_data(self.travel_time_cols)):
+            if col in self.timedelta_cols:
+                value = missing_timedelta if value is None else value // datetime.timedelta(microseconds=1)
+            elif value is None and isinstance(self.values[col], array):
+                value = float("nan")
+            self.values[col].append(value)
+
+    def extend(self, listings: list) -> None:
+        """Adds the fields of every listing, in order."""
+        for listing in listings:
+            self.append(listing)
+
+    def to_df(self, start: int = 0) -> pd.DataFrame:
+        """
+        Builds a df straight from the arrays.
+        Args:
+            start: only include listings from this position on, e.g. the ones added since len was last read
+
+        Returns: df of the listings, with timedelta64 travel times and posted
+        """
+        data = {}
+        for col in self.columns:
+            values = self.values[col][start:]
+            if col in self.timedelta_cols:
+                data[col] = pd.to_timedelta(np.asarray(values, dtype="int64"), unit="us")
+            elif isinstance(values, array):
+                data[col] = np.asarray(values, dtype="int64" if values.typecode == "q" else "float64")
+            else:
+                data[col] = values
+        return pd.DataFrame(data, columns=self.columns)
@@ -0,0 +1,123 @@
+import json, sqlite3, threading, time
+from concurrent.futures import Future
+
+from consts import LISTING_STORE_TTL
+
+
+class ListingStore:
+    def __init__(self, path: str, ttl: float = LISTING_STORE_TTL):
+        """
+        Listings resolved by any Search, keyed by PID and stored in a SQLite file, so overlapping Searches don't fetch
+        and route the same listing again. Holds the data that comes from the listing page (lat/lon, date posted) and
+        the travel times for the commutes it was routed to. Listings being resolved right now are claimed by one
+        Search, and other Searches sharing the store wait for it instead of resolving them too.
+        Args:
+            path: path of the SQLite file. Created if it does not exist.
+            ttl: seconds a resolved listing can be reused for
+        """
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self.in_flight = {}  # pid -> Future, done once the Search that claimed the listing releases it
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS listings ("
+                "pid INTEGER PRIMARY KEY, lat REAL, lon REAL, crow_distance REAL, posted_at REAL, "
+                "commute_key TEXT, travel_time REAL, resolved_at REAL, travel_times TEXT)"
+            )
+            # Stores created before travel_times was added
+            if "travel_times" not in [row[1] for row in self.conn.execute("PRAGMA table_info(listings)")]:
+                self.conn.execute("ALTER TABLE listings ADD COLUMN travel_times TEXT")
+
+    def get(self, pid: int):
+        """
+        Looks up a resolved listing.
+        Args:
+            pid: PID of the listing
+
+        Returns: dict of the stored fields, or None if the listing is not stored or has expired. posted_at is a
+            timestamp of when the listing was posted, travel_time is in seconds, and travel_times maps each travel
+            time column to seconds.
+        """
+        with self._lock:
+            return self.read(pid)
+
+    def read(self, pid: int):
+        """Looks up a resolved listing, like get, without taking the lock."""
+        row = self.conn.execute(
+            "SELECT lat, lon, crow_distance, posted_at, commute_key, travel_time, travel_times, resolved_at "
+            "FROM listings WHERE pid = ?", (int(pid),)
+        ).fetchone()
+        if row is None or time.time() - row[7] > self.ttl:
+            return None
+        record = dict(zip(("lat", "lon", "crow_distance", "posted_at", "commute_key", "travel_time"), row))
+        record["travel_times"] = json.loads(row[6] or "{}")
+        return record
+
+    def claim(self, pid: int) -> tuple:
+        """
+        Looks up a resolved listing, and claims it for the caller to resolve if it is neither stored nor being
+        resolved by another Search. Both are checked at once, so two Searches never both claim a listing.
+        Args:
+            pid: PID of the listing
+
+        Returns: (record, in_flight). record is the stored fields like get, or None. If it is None, in_flight is None
+            when the caller claimed the listing, and must release it once it is stored or given up on. Otherwise it
+            is a Future that is done once the Search that claimed the listing releases it.
+        """
+        with self._lock:
+            record = self.read(pid)
+            if record is not None:
+                return record, None
+            if pid in self.in_flight:
+                return None, self.in_flight[pid]
+            self.in_flight[pid] = Future()
+            return None, None
+
+    def release(self, pids: list) -> None:
+        """
+        Releases claimed listings, whether they were stored or not, and wakes up the Searches waiting for them.
+        Args:
+            pids: PIDs of listings claimed with claim
+        """
+        with self._lock:
+            released = [self.in_flight.pop(pid) for pid in pids if pid in self.in_flight]
+        for future in released:
+            future.set_result(None)
+
+    def get_lat_lons(self, pids: list) -> dict:
+        """
+        Looks up the lat/lon of listings, however long ago they were resolved, since a listing does not move.
+        Args:
+            pids: PIDs of the listings
+
+        Returns: dict of PID -> (lat, lon), for the listings that are stored
+        """
+        lat_lons = {}
+        with self._lock:
+            for pid in pids:
+                row = self.conn.execute("SELECT lat, lon FROM listings WHERE pid = ?", (int(pid),)).fetchone()
+                if row is not None:
+                    lat_lons[int(pid)] = row
+        return lat_lons
+
+    def put_many(self, listings: list, commute_key: str) -> None:
+        """
+        Stores resolved listings.
+        Args:
+            listings: Listings with lat_lon, posted and travel_time set
+            commute_key: CommuteMatrix.commute_key of the commutes the travel times are for
+        """
+        now = time.time()
+        rows = [
+            (int(listing.pid), listing.lat_lon[0], listing.lat_lon[1], listing.crow_distance,
+             now - listing.posted.total_seconds(), commute_key, listing.travel_time.total_seconds(), now,
+             json.dumps({col: travel_time.total_seconds() for col, travel_time in listing.travel_times.items()}))
+            for listing in listings
+        ]
+        with self._lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def close(self) -> None:
+        """Closes the SQLite file."""
+        self.conn.close()
@@ -0,0 +1,78 @@
+import datetime, json, logging, sys
+
+from consts import LOG_FORMAT, LOG_LEVEL
+
+log_formats = ("text", "json")
+# Attributes every LogRecord has. Anything else on a record was passed with extra=, e.g. the search name or PID
+record_attrs = set(vars(logging.LogRecord("", logging.INFO, "", 0, "", (), None))) | {"message", "asctime", "context"}
+
+
+class ContextAdapter(logging.LoggerAdapter):
+    def process(self, msg, kwargs):
+        """Adds the adapter's fields, e.g. the search name, to the extra fields given with each message."""
+        kwargs["extra"] = {**self.extra, **kwargs.get("extra", {})}
+        return msg, kwargs
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        """Formats records as "<time> <level> [<search>] <message>", for reading in a terminal."""
+        super().__init__("%(asctime)s %(levelname)-7s %(context)s%(message)s", datefmt="%Y-%m-%d %H:%M:%S")
+
+    def format(self, record: logging.LogRecord) -> str:
+        record.context = f"[{record.search}] " if getattr(record, "search", None) else ""
+        return super().format(record)
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        """
+        Formats a record as one JSON object per line, with its extra fields as keys, for log collectors.
+        Args:
+            record: the log record
+
+        Returns: JSON with "time", "level", "logger", "message", any extra fields, and "exception" if there is one
+        """
+        entry = {
+            "time": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update({key: value for key, value in vars(record).items() if key not in record_attrs})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def get_logger(name: str, **context) -> logging.LoggerAdapter:
+    """
+    Gets a logger that adds context fields to every message.
+    Args:
+        name: logger name, usually the module's __name__
+        **context: fields added to every message, e.g. search="my-search"
+
+    Returns: logger adapter
+    """
+    return ContextAdapter(logging.getLogger(name), context)
+
+
+def setup_logging(level: str = LOG_LEVEL, log_format: str = LOG_FORMAT, stream=None) -> None:
+    """
+    Sends log messages at or above a level to a stream, replacing any earlier setup.
+    Args:
+        level: "DEBUG", "INFO", "WARNING" or "ERROR"
+        log_format: "text" or "json"
+        stream: stream to write to. Defaults to stderr.
+    """
+    if log_format not in log_formats:
+        raise ValueError(f"Log format must be one of {list(log_formats)}")
+    handler = logging.StreamHandler(stream if stream is not None else sys.stderr)
+    handler.setFormatter(TextFormatter() if log_format == "text" else JSONFormatter())
+    root_logger = logging.getLogger()
+    for old_handler in list(root_logger.handlers):
+        root_logger.removeHandler(old_handler)
+    root_logger.addHandler(handler)
+    root_logger.setLevel(level)
+    # Every pooled connection would be logged at DEBUG
+    logging.getLogger("urllib3").setLevel(max(logging.getLevelName(level), logging.WARNING))
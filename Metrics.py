@@ -0,0 +1,188 @@
+import contextlib, json, os, threading, time
+
+import numpy as np
+
+# Quantiles reported for every latency
+quantiles = (0.5, 0.9, 0.99)
+# Shared by every disabled Metrics, so timing something costs one method call when metrics are off
+disabled_timer = contextlib.nullcontext()
+
+
+class Timer:
+    def __init__(self, record: callable, name: str):
+        """
+        Context manager that measures the wall time of its block and passes it to record.
+        Args:
+            record: called with (name, seconds) when the block exits, even if it raised
+            name: name the time is recorded under
+        """
+        self.record = record
+        self.name = name
+        self.start = None
+
+    def __enter__(self) -> "Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.record(self.name, time.perf_counter() - self.start)
+
+
+class Metrics:
+    def __init__(self, enabled: bool = True, search_name: str = ""):
+        """
+        Instrumentation of one Search: wall time per stage of a run, and latency samples of each operation done per
+        listing or per request (fetching, parsing, routing). Safe to record into from worker threads. When disabled,
+        nothing is recorded and timers are a shared no-op context manager.
+        Args:
+            enabled: record metrics
+            search_name: name of the Search, used as a label in the Prometheus export
+        """
+        self.enabled = enabled
+        self.search_name = search_name
+        self.stage_seconds = {}  # stage -> total seconds, across every run of the Search
+        self.stage_runs = {}  # stage -> number of times it ran
+        self.latencies = {}  # operation -> list of seconds
+        self._lock = threading.Lock()
+
+    def stage(self, name: str):
+        """
+        Times a stage of a run.
+        Args:
+            name: name of the stage, e.g. "get_listings"
+
+        Returns: context manager timing its block
+        """
+        if not self.enabled:
+            return disabled_timer
+        return Timer(self.record_stage, name)
+
+    def time(self, name: str):
+        """
+        Times one operation, e.g. fetching one listing page, as a latency sample.
+        Args:
+            name: name of the operation, e.g. "listing_fetch"
+
+        Returns: context manager timing its block
+        """
+        if not self.enabled:
+            return disabled_timer
+        return Timer(self.observe, name)
+
+    def record_stage(self, name: str, seconds: float) -> None:
+        """Adds the wall time of one run of a stage."""
+        with self._lock:
+            self.stage_seconds[name] = self.stage_seconds.get(name, 0.0) + seconds
+            self.stage_runs[name] = self.stage_runs.get(name, 0) + 1
+
+    def observe(self, name: str, seconds: float, count: int = 1) -> None:
+        """
+        Adds latency samples of an operation.
+        Args:
+            name: name of the operation
+            seconds: latency of the operation
+            count: number of samples with this latency, e.g. one per listing of a batched request
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.latencies.setdefault(name, []).extend([seconds] * count)
+
+    def summarize(self, name: str) -> dict:
+        """
+        Summarizes the latency samples of an operation.
+        Args:
+            name: name of the operation
+
+        Returns: dict with "count", "sum", "max", and one "p<quantile>" per quantile, e.g. "p50"
+        """
+        with self._lock:
+            samples = np.array(self.latencies.get(name, []), dtype=float)
+        if not len(samples):
+            return {"count": 0, "sum": 0.0, "max": 0.0, **{f"p{q * 100:g}": 0.0 for q in quantiles}}
+        summary = {"count": len(samples), "sum": float(samples.sum()), "max": float(samples.max())}
+        for q, value in zip(quantiles, np.quantile(samples, quantiles)):
+            summary[f"p{q * 100:g}"] = float(value)
+        return summary
+
+    def report(self, host_stats: dict = None) -> dict:
+        """
+        Builds the run report.
+        Args:
+            host_stats: HTTPSession.host_stats of the session the Search uses
+
+        Returns: dict with "search", "stages" (stage -> seconds and runs), "latencies" (operation -> summarize) and
+            "hosts" (host -> requests and bytes)
+        """
+        with self._lock:
+            stages = {name: {"seconds": seconds, "runs": self.stage_runs[name]}
+                      for name, seconds in self.stage_seconds.items()}
+            operations = list(self.latencies)
+        return {
+            "search": self.search_name,
+            "stages": stages,
+            "latencies": {name: self.summarize(name) for name in operations},
+            "hosts": host_stats or {},
+        }
+
+    def to_prometheus(self, report: dict) -> str:
+        """
+        Formats a run report in the Prometheus text exposition format, e.g. for node_exporter's textfile collector.
+        Args:
+            report: dict from report
+
+        Returns: metrics text
+        """
+        search = escape_label(report["search"])
+        lines = [
+            "# HELP listing_scraper_stage_seconds_total Wall time spent in each stage of Search.run.",
+            "# TYPE listing_scraper_stage_seconds_total counter",
+        ]
+        lines += [f'listing_scraper_stage_seconds_total{{search="{search}",stage="{escape_label(name)}"}} '
+                  f'{stage["seconds"]}' for name, stage in report["stages"].items()]
+        lines += [
+            "# HELP listing_scraper_latency_seconds Latency of each operation done per listing or per request.",
+            "# TYPE listing_scraper_latency_seconds summary",
+        ]
+        for name, summary in report["latencies"].items():
+            labels = f'search="{search}",operation="{escape_label(name)}"'
+            lines += [f'listing_scraper_latency_seconds{{{labels},quantile="{q:g}"}} {summary[f"p{q * 100:g}"]}'
+                      for q in quantiles]
+            lines += [f"listing_scraper_latency_seconds_sum{{{labels}}} {summary['sum']}",
+                      f"listing_scraper_latency_seconds_count{{{labels}}} {summary['count']}"]
+        lines += [
+            "# HELP listing_scraper_http_requests_total Requests sent to each host by the session the search uses.",
+            "# TYPE listing_scraper_http_requests_total counter",
+        ]
+        lines += [f'listing_scraper_http_requests_total{{search="{search}",host="{escape_label(host)}"}} '
+                  f'{stats["requests"]}' for host, stats in report["hosts"].items()]
+        lines += [
+            "# HELP listing_scraper_http_bytes_total Bytes downloaded from each host by the session the search uses.",
+            "# TYPE listing_scraper_http_bytes_total counter",
+        ]
+        lines += [f'listing_scraper_http_bytes_total{{search="{search}",host="{escape_label(host)}"}} '
+                  f'{stats["bytes"]}' for host, stats in report["hosts"].items()]
+        return "\n".join(lines) + "\n"
+
+    def write(self, json_path: str, prometheus_path: str, host_stats: dict = None) -> None:
+        """
+        Writes the run report as JSON and in the Prometheus text format. Does nothing when disabled.
+        Args:
+            json_path: path of the JSON report
+            prometheus_path: path of the Prometheus text file
+            host_stats: HTTPSession.host_stats of the session the Search uses
+        """
+        if not self.enabled:
+            return
+        report = self.report(host_stats)
+        with open(json_path, "w") as json_file:
+            json.dump(report, json_file, indent=2)
+        # Written under another name and renamed, so a collector never reads a half written file
+        with open(prometheus_path + ".tmp", "w") as prometheus_file:
+            prometheus_file.write(self.to_prometheus(report))
+        os.replace(prometheus_path + ".tmp", prometheus_path)
+
+
+def escape_label(value: str) -> str:
+    """Escapes a Prometheus label value."""
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
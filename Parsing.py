@@ -0,0 +1,69 @@
+from bs4 import BeautifulSoup, FeatureNotFound, SoupStrainer
+
+# Parser backends BeautifulSoup can use. "lxml" is faster, but needs the lxml package installed.
+html_parsers = ("html.parser", "lxml")
+
+
+def is_search_page_element(name: str, attrs: dict) -> bool:
+    """
+    Checks if an element of a search page is one Search reads: a listing <li>, or the JSON embedded in the page.
+    Args:
+        name: tag name
+        attrs: tag attributes
+
+    Returns: True if the element should be parsed
+    """
+    return name == "li" or attrs.get("id") == "ld_searchpage_results"
+
+
+def is_listing_page_element(name: str, attrs: dict) -> bool:
+    """
+    Checks if an element of a listing page is one Listing reads: the #map element with lat/lon, or the
+    .date.timeago element with the date posted.
+    Args:
+        name: tag name
+        attrs: tag attributes
+
+    Returns: True if the element should be parsed
+    """
+    if attrs.get("id") == "map":
+        return True
+    # Depending on the parser, class is either still a string or already split into a list
+    classes = attrs.get("class") or ""
+    if isinstance(classes, str):
+        classes = classes.split()
+    return "timeago" in classes
+
+
+search_page_strainer = SoupStrainer(is_search_page_element)
+listing_page_strainer = SoupStrainer(is_listing_page_element)
+
+
+def check_parser(html_parser: str) -> None:
+    """
+    Checks that a parser backend is supported and installed.
+    Args:
+        html_parser: name of the parser backend
+
+    Raises: ValueError if it can't be used
+    """
+    if html_parser not in html_parsers:
+        raise ValueError(f"HTML parser must be one of {list(html_parsers)}")
+    try:
+        BeautifulSoup("", html_parser)
+    except FeatureNotFound:
+        raise ValueError(f"HTML parser '{html_parser}' is not installed. Try: pip install {html_parser}")
+
+
+def make_soup(markup: str, html_parser: str = "html.parser", parse_only: SoupStrainer = None) -> BeautifulSoup:
+    """
+    Parses HTML into a soup.
+    Args:
+        markup: HTML to parse
+        html_parser: parser backend, one of html_parsers
+        parse_only: if given, only elements matching this strainer (and their children) are built, which is much
+            faster than building the whole tree
+
+    Returns: the soup
+    """
+    return BeautifulSoup(markup, html_parser, parse_only=parse_only)
@@ -0,0 +1,74 @@
+import re
+
+import pandas as pd
+
+
+class Prefilter:
+    def __init__(self, min_rent_cutoff: int = 0, title_blocklist: list = (), max_crow_distance: float = None):
+        """
+        Rules a Listing is checked against using only what the search page gives (price, title, location, PID, and
+        lat/lon when available), so rejected listings never get a listing page request or an OSRM route. Counts the
+        listings each rule rejected.
+        Args:
+            min_rent_cutoff: reject listings at or below this price
+            title_blocklist: reject listings whose title contains any of these keywords, ignoring case
+            max_crow_distance: reject listings further than this many miles from the commute location, as the crow
+                flies. Only checked once a listing has lat/lon. No limit if not given.
+        """
+        self.min_rent_cutoff = min_rent_cutoff
+        self.title_blocklist = [keyword.lower() for keyword in title_blocklist]
+        self.max_crow_distance = max_crow_distance
+        # Rule name -> check, in the order they are applied
+        self.rules = {
+            "rent_cutoff": self.below_rent_cutoff,
+            "title_blocklist": self.has_blocked_title,
+            "crow_distance": self.too_far,
+        }
+        self.fetches_avoided = dict.fromkeys(self.rules, 0)
+        self.dropped_after_fetch = dict.fromkeys(self.rules, 0)
+
+    def check(self, listing, fetched: bool = False) -> str | None:
+        """
+        Checks a listing against every rule.
+        Args:
+            listing: Listing with at least its search page fields parsed
+            fetched: whether the listing page was already fetched, for counting
+
+        Returns: name of the first rule that rejected the listing, or None if it passed
+        """
+        for rule_name, rule in self.rules.items():
+            if rule(listing):
+                counts = self.dropped_after_fetch if fetched else self.fetches_avoided
+                counts[rule_name] += 1
+                return rule_name
+        return None
+
+    def below_rent_cutoff(self, listing) -> bool:
+        """Rejects listings at or below min_rent_cutoff, which are usually spam."""
+        return listing.price <= self.min_rent_cutoff
+
+    def has_blocked_title(self, listing) -> bool:
+        """Rejects listings with a blocklisted keyword in their title."""
+        title = listing.title.lower()
+        return any(keyword in title for keyword in self.title_blocklist)
+
+    def too_far(self, listing) -> bool:
+        """Rejects listings further than max_crow_distance from the commute location, if their lat/lon is known."""
+        return self.max_crow_distance is not None and bool(listing.lat_lon) \
+            and listing.crow_distance > self.max_crow_distance
+
+    def rejected_rows(self, df: pd.DataFrame) -> pd.Series:
+        """
+        Applies the same rules to listings already in a df, e.g. after the rules were changed.
+        Args:
+            df: df of listings
+
+        Returns: boolean Series, True for rows the rules reject
+        """
+        rejected = df["PRICE ($)"] <= self.min_rent_cutoff
+        if self.title_blocklist:
+            pattern = "|".join(re.escape(keyword) for keyword in self.title_blocklist)
+            rejected |= df["TITLE"].astype(str).str.lower().str.contains(pattern, regex=True)
+        if self.max_crow_distance is not None:
+            rejected |= df["CROW_DISTANCE"] > self.max_crow_distance
+        return rejected
@@ -0,0 +1,106 @@
+import threading, time
+
+from consts import (
+    HTTP_RATE_LIMIT,
+    HTTP_RATE_LIMIT_BURST,
+    HTTP_RATE_LIMIT_EXEMPT_HOSTS,
+    HTTP_RATE_LIMIT_MIN,
+    HTTP_RATE_LIMIT_RECOVERY
+)
+
+
+class RateLimiter:
+    # Seconds after halving a host's rate during which further 429s don't halve it again, since requests already in
+    # flight when the first 429 came back are answered with 429s too
+    DECREASE_COOLDOWN = 1.0
+
+    def __init__(self, rate: float = HTTP_RATE_LIMIT, burst: int = HTTP_RATE_LIMIT_BURST,
+                 min_rate: float = HTTP_RATE_LIMIT_MIN, recovery: float = HTTP_RATE_LIMIT_RECOVERY,
+                 exempt_hosts: tuple = HTTP_RATE_LIMIT_EXEMPT_HOSTS):
+        """
+        Token bucket per host. Each request to a host takes a token, and tokens refill at that host's rate. A host
+        that answers 429 gets its rate halved and, if it sent a Retry-After, no requests at all until then. Every
+        successful response raises the rate again by recovery, up to rate.
+        Args:
+            rate: max requests per second to each host
+            burst: number of requests a host can get at once before the rate applies
+            min_rate: rate is never lowered below this
+            recovery: requests per second added back to a throttled host's rate per successful response
+            exempt_hosts: hosts that are never rate limited, e.g. a local OSRM server
+        """
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self.recovery = recovery
+        self.exempt_hosts = exempt_hosts
+        # host -> {"rate", "tokens", "updated", "blocked_until", "decreased"}
+        self.buckets = {}
+        self.delayed = 0
+        self.delayed_seconds = 0.0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+    def get_bucket(self, host: str, now: float) -> dict:
+        """Gets the bucket of a host with its tokens refilled up to now. Must be called with the lock held."""
+        bucket = self.buckets.get(host)
+        if bucket is None:
+            bucket = self.buckets[host] = {"rate": self.rate, "tokens": self.burst, "updated": now,
+                                           "blocked_until": 0.0, "decreased": None}
+        bucket["tokens"] = min(self.burst, bucket["tokens"] + (now - bucket["updated"]) * bucket["rate"])
+        bucket["updated"] = now
+        return bucket
+
+    def acquire(self, host: str) -> None:
+        """
+        Waits until a request can be sent to a host.
+        Args:
+            host: host the request is for
+        """
+        if host in self.exempt_hosts:
+            return
+        with self._lock:
+            now = time.monotonic()
+            bucket = self.get_bucket(host, now)
+            # Take the token now so threads waiting on the same host queue up one after another
+            bucket["tokens"] -= 1
+            wait = max(-bucket["tokens"] / bucket["rate"], bucket["blocked_until"] - now, 0.0)
+            if wait > 0:
+                self.delayed += 1
+                self.delayed_seconds += wait
+        if wait > 0:
+            time.sleep(wait)
+
+    def record_throttled(self, host: str, retry_after: float = None) -> None:
+        """
+        Slows down requests to a host after it answered 429.
+        Args:
+            host: host that answered 429
+            retry_after: seconds the host asked to wait, from its Retry-After header
+        """
+        with self._lock:
+            self.throttled += 1
+            now = time.monotonic()
+            bucket = self.get_bucket(host, now)
+            if bucket["decreased"] is None or now - bucket["decreased"] >= self.DECREASE_COOLDOWN:
+                bucket["rate"] = max(bucket["rate"] / 2, self.min_rate)
+                bucket["decreased"] = now
+            if retry_after:
+                bucket["blocked_until"] = max(bucket["blocked_until"], now + retry_after)
+
+    def record_success(self, host: str) -> None:
+        """
+        Speeds a throttled host back up after a successful response.
+        Args:
+            host: host that answered
+        """
+        with self._lock:
+            bucket = self.buckets.get(host)
+            if bucket is not None and bucket["rate"] < self.rate:
+                bucket["rate"] = min(bucket["rate"] + self.recovery, self.rate)
+
+    def stats(self) -> dict:
+        """
+        Counts of requests delayed by the rate limit, and of 429 responses.
+        Returns: dict with "delayed", "delayed_seconds" and "throttled"
+        """
+        return {"delayed": self.delayed, "delayed_seconds": self.delayed_seconds, "throttled": self.throttled}
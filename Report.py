@@ -0,0 +1,362 @@
+import datetime, html, json, os
+
+import pandas as pd
+from Commutes import is_travel_time_col
+from consts import REPORT_PAGE_SIZE
+
+# Article on pd.cut https://towardsdatascience.com/how-to-bin-numerical-data-with-pandas-fe5146c9dc55
+# https://towardsdatascience.com/all-pandas-cut-you-should-know-for-transforming-numerical-data-into-categorical-data-1370cf7f4c4f
+
+# Listings are put in commute buckets by TRAVEL TIME: (0, 20], (20, 30], (30, 45] and (45, 60] minutes. Listings
+# further away get no bucket, and sort after the ones that have one
+commute_bins = [datetime.timedelta(minutes=minutes) for minutes in (0, 20, 30, 45, 60)]
+commute_buckets = ["Short", "Medium", "Long", "Very Long"]
+# Name of the commute bucket column of the report
+bucket_col = "COMMUTE"
+# Columns left out of the report
+hidden_cols = ["PID", "LAT", "LON"]
+# Columns the page sorts by when it opens: commute bucket, then recency of listing. Putting more recent listings near
+# the top means you are more likely to get a response
+default_sort = [[bucket_col, "asc"], ["POSTED", "asc"]]
+
+
+def column_kind(col: str) -> str:
+    """
+    Gets how the page formats a column.
+    Args:
+        col: column name
+
+    Returns: "duration" (seconds shown as HH:MM:SS), "age" (seconds shown as days and hours ago), "link", "number",
+        "bucket" (index into commute_buckets) or "text"
+    """
+    if col == "TRAVEL TIME" or is_travel_time_col(col):
+        return "duration"
+    if col == "POSTED":
+        return "age"
+    if col == "LINK":
+        return "link"
+    if col in ("PRICE ($)", "CROW_DISTANCE"):
+        return "number"
+    if col == bucket_col:
+        return "bucket"
+    return "text"
+
+
+def column_values(values: pd.Series, kind: str) -> list:
+    """
+    Converts a column to JSON-ready values. Missing values become None.
+    Args:
+        values: column of the df
+        kind: column_kind of the column
+
+    Returns: list of values. Durations and ages are whole seconds.
+    """
+    if kind in ("duration", "age"):
+        values = pd.to_timedelta(values).dt.total_seconds().round()
+    elif kind == "number":
+        values = pd.to_numeric(values, errors="coerce")
+    missing = values.isna().to_numpy()
+    if kind in ("duration", "age", "bucket") or (kind == "number" and pd.api.types.is_integer_dtype(values.dropna())):
+        # Whole numbers are written without ".0"
+        values = values.fillna(0).astype("int64")
+    converted = values.astype(object).to_numpy()
+    converted[missing] = None
+    return converted.tolist()
+
+
+class Report:
+    def __init__(self, html_path: str, data_path: str, title: str, page_size: int = REPORT_PAGE_SIZE):
+        """
+        Results page of a Search, in two files: a static HTML page that sorts, filters and pages through the listings
+        in the browser, and a data file with the listings as compact JSON. The page is only written when it is
+        missing or its settings changed, and the data file only when the listings changed, so a run that finds the
+        same listings leaves both files alone. The data file is a script that sets window.listingReport, because
+        browsers do not let a page opened from disk fetch a .json file next to it.
+        Args:
+            html_path: path of the HTML page
+            data_path: path of the data file. The page loads it by file name, so it must be in the same folder.
+            title: title of the page, e.g. the search name
+            page_size: number of listings shown at a time
+        """
+        self.html_path = html_path
+        self.data_path = data_path
+        self.title = title
+        self.page_size = page_size
+
+    def make_data(self, df: pd.DataFrame) -> str:
+        """
+        Serializes listings for the page. Rows are ordered by PID, so the same listings always give the same data no
+        matter how df is sorted.
+        Args:
+            df: listings of the Search
+
+        Returns: script setting window.listingReport to {"columns": [{"name", "kind"}], "buckets": [...],
+            "rows": [[value per column], ...]}
+        """
+        df = df.sort_values("PID", kind="stable")
+        df = df.drop(columns=[col for col in hidden_cols if col in df.columns])
+        buckets = pd.cut(pd.to_timedelta(df["TRAVEL TIME"]), bins=commute_bins, labels=False)
+        df = df.assign(**{bucket_col: buckets})
+        kinds = [column_kind(col) for col in df.columns]
+        columns = [column_values(df[col], kind) for col, kind in zip(df.columns, kinds)]
+        data = {
+            "columns": [{"name": col, "kind": kind} for col, kind in zip(df.columns, kinds)],
+            "buckets": commute_buckets,
+            "rows": [list(row) for row in zip(*columns)],
+        }
+        return "window.listingReport = " + json.dumps(data, separators=(",", ":")) + ";\n"
+
+    def make_page(self) -> str:
+        """Fills in the page template with this report's settings."""
+        settings = {"pageSize": self.page_size, "defaultSort": default_sort, "priceColumn": "PRICE ($)",
+                    "bucketColumn": bucket_col}
+        return (page_template
+                .replace("{{title}}", html.escape(self.title))
+                .replace("{{data_file}}", html.escape(os.path.basename(self.data_path)))
+                .replace("{{settings}}", json.dumps(settings)))
+
+    def write(self, df: pd.DataFrame) -> bool:
+        """
+        Writes the files of the report that changed.
+        Args:
+            df: listings of the Search
+
+        Returns: True if the data file was rewritten
+        """
+        write_if_changed(self.html_path, self.make_page())
+        return write_if_changed(self.data_path, self.make_data(df))
+
+
+def write_if_changed(path: str, text: str) -> bool:
+    """
+    Writes a file, unless it already holds text. Written under another name and renamed, so a browser never reads a
+    half written file.
+    Args:
+        path: path of the file
+        text: contents of the file
+
+    Returns: True if the file was written
+    """
+    if os.path.exists(path):
+        with open(path) as old_file:
+            if old_file.read() == text:
+                return False
+    with open(path + ".tmp", "w") as new_file:
+        new_file.write(text)
+    os.replace(path + ".tmp", path)
+    return True
+
+
+page_template = """<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>{{title}}</title>
+<style>
+body { font-family: sans-serif; margin: 1em; }
+#controls > * { margin-right: 1em; }
+table { border-collapse: collapse; margin: 1em 0; }
+th, td { border: 1px solid #ccc; padding: 0.25em 0.5em; text-align: center; }
+th { background: #eee; cursor: pointer; user-select: none; }
+</style>
+</head>
+<body>
+<h1>{{title}}</h1>
+<div id="controls">
+<label>Search <input id="text" type="search" placeholder="Title or location"></label>
+<label>Max price <input id="max-price" type="number" min="0" step="50"></label>
+<label>Commute <select id="bucket"><option value="">Any</option></select></label>
+<label>Per page <select id="page-size"></select></label>
+</div>
+<table><thead><tr id="header"></tr></thead><tbody id="rows"></tbody></table>
+<div id="pager">
+<button id="previous">Previous</button>
+<span id="showing"></span>
+<button id="next">Next</button>
+</div>
+<script src="{{data_file}}"></script>
+<script>
+(function () {
+    var settings = {{settings}};
+    var data = window.listingReport;
+    if (!data) {
+        document.getElementById("showing").textContent = "Could not load {{data_file}}";
+        return;
+    }
+    var columns = data.columns;
+    var index = {};
+    columns.forEach(function (column, i) { index[column.name] = i; });
+    var textColumns = columns.map(function (column, i) { return column.kind === "text" ? i : -1; })
+        .filter(function (i) { return i >= 0; });
+    var state = {
+        sort: settings.defaultSort.filter(function (key) { return key[0] in index; })
+            .map(function (key) { return {column: index[key[0]], direction: key[1] === "desc" ? -1 : 1}; }),
+        page: 0,
+        pageSize: settings.pageSize,
+        text: "",
+        maxPrice: null,
+        bucket: null
+    };
+    var view = [];
+
+    function pad(number) {
+        return (number < 10 ? "0" : "") + number;
+    }
+
+    function format(value, kind) {
+        if (value === null) {
+            return "";
+        }
+        if (kind === "duration") {
+            // Like the old table, only the time of day is shown
+            var seconds = value % 86400;
+            return pad(Math.floor(seconds / 3600)) + ":" + pad(Math.floor(seconds / 60) % 60) + ":"
+                + pad(seconds % 60);
+        }
+        if (kind === "age") {
+            return Math.floor(value / 86400) + " days, " + Math.floor(value % 86400 / 3600) + " hours ago";
+        }
+        if (kind === "bucket") {
+            return data.buckets[value];
+        }
+        return String(value);
+    }
+
+    function compare(a, b) {
+        for (var i = 0; i < state.sort.length; i++) {
+            var key = state.sort[i];
+            var x = a[key.column], y = b[key.column];
+            if (x === y) {
+                continue;
+            }
+            // Missing values sort last in both directions
+            if (x === null) {
+                return 1;
+            }
+            if (y === null) {
+                return -1;
+            }
+            return (x < y ? -1 : 1) * key.direction;
+        }
+        return 0;
+    }
+
+    function matches(row) {
+        if (state.maxPrice !== null && row[index[settings.priceColumn]] > state.maxPrice) {
+            return false;
+        }
+        if (state.bucket !== null && row[index[settings.bucketColumn]] !== state.bucket) {
+            return false;
+        }
+        if (!state.text) {
+            return true;
+        }
+        return textColumns.some(function (i) {
+            return row[i] !== null && String(row[i]).toLowerCase().indexOf(state.text) >= 0;
+        });
+    }
+
+    function refresh() {
+        view = data.rows.filter(matches).sort(compare);
+        state.page = Math.min(state.page, Math.max(Math.ceil(view.length / state.pageSize) - 1, 0));
+        render();
+    }
+
+    function render() {
+        var header = document.getElementById("header");
+        header.textContent = "";
+        columns.forEach(function (column, i) {
+            var th = document.createElement("th");
+            th.textContent = column.name;
+            if (state.sort.length && state.sort[0].column === i) {
+                th.textContent += state.sort[0].direction > 0 ? " \\u25b2" : " \\u25bc";
+            }
+            th.addEventListener("click", function () {
+                if (state.sort.length && state.sort[0].column === i) {
+                    state.sort[0].direction *= -1;
+                } else {
+                    state.sort = [{column: i, direction: 1}];
+                }
+                state.page = 0;
+                refresh();
+            });
+            header.appendChild(th);
+        });
+
+        var start = state.page * state.pageSize;
+        var page = view.slice(start, start + state.pageSize);
+        var tbody = document.createElement("tbody");
+        tbody.id = "rows";
+        page.forEach(function (row) {
+            var tr = document.createElement("tr");
+            columns.forEach(function (column, i) {
+                var td = document.createElement("td");
+                if (column.kind === "link" && row[i] !== null && /^https?:\\/\\//.test(row[i])) {
+                    var a = document.createElement("a");
+                    a.href = row[i];
+                    a.rel = "noopener noreferrer";
+                    a.target = "_blank";
+                    a.textContent = "URL";
+                    td.appendChild(a);
+                } else {
+                    td.textContent = format(row[i], column.kind);
+                }
+                tr.appendChild(td);
+            });
+            tbody.appendChild(tr);
+        });
+        document.getElementById("rows").replaceWith(tbody);
+
+        document.getElementById("showing").textContent = view.length
+            ? "Showing " + (start + 1) + "-" + (start + page.length) + " of " + view.length + " listings"
+            : "No listings match";
+        document.getElementById("previous").disabled = state.page === 0;
+        document.getElementById("next").disabled = start + state.pageSize >= view.length;
+    }
+
+    var bucketSelect = document.getElementById("bucket");
+    data.buckets.forEach(function (bucket, i) {
+        bucketSelect.add(new Option(bucket, String(i)));
+    });
+    var pageSizeSelect = document.getElementById("page-size");
+    [settings.pageSize, 25, 50, 100, 250, 1000]
+        .filter(function (size, i, sizes) { return sizes.indexOf(size) === i; })
+        .sort(function (a, b) { return a - b; })
+        .forEach(function (size) {
+            pageSizeSelect.add(new Option(String(size), String(size), false, size === settings.pageSize));
+        });
+
+    document.getElementById("text").addEventListener("input", function (event) {
+        state.text = event.target.value.trim().toLowerCase();
+        state.page = 0;
+        refresh();
+    });
+    document.getElementById("max-price").addEventListener("input", function (event) {
+        state.maxPrice = event.target.value === "" ? null : Number(event.target.value);
+        state.page = 0;
+        refresh();
+    });
+    bucketSelect.addEventListener("change", function (event) {
+        state.bucket = event.target.value === "" ? null : Number(event.target.value);
+        state.page = 0;
+        refresh();
+    });
+    pageSizeSelect.addEventListener("change", function (event) {
+        state.pageSize = Number(event.target.value);
+        state.page = 0;
+        refresh();
+    });
+    document.getElementById("previous").addEventListener("click", function () {
+        state.page -= 1;
+        render();
+    });
+    document.getElementById("next").addEventListener("click", function () {
+        state.page += 1;
+        render();
+    });
+    refresh();
+})();
+</script>
+</body>
+</html>
+"""
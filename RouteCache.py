@@ -0,0 +1,122 @@
+import sqlite3, threading, time
+
+from consts import ROUTE_CACHE_MAX_ENTRIES, ROUTE_CACHE_PRECISION, ROUTE_CACHE_TTL
+
+
+class RouteCache:
+    # Number of writes between checks for expired entries and the size bound
+    EVICT_EVERY = 500
+
+    def __init__(self, path: str, ttl: float = ROUTE_CACHE_TTL, max_entries: int = ROUTE_CACHE_MAX_ENTRIES,
+                 precision: int = ROUTE_CACHE_PRECISION):
+        """
+        On-disk cache of OSRM travel times, stored in a SQLite file. Start coordinates are rounded so reposted
+        listings at (almost) the same spot share an entry.
+        Args:
+            path: path of the SQLite file. Created if it does not exist.
+            ttl: seconds an entry stays valid
+            max_entries: max number of entries kept. Least recently used entries are evicted first.
+            precision: number of decimals lat/lon are rounded to. 4 decimals is about 10m.
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.precision = precision
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS routes ("
+                "commute_type TEXT, src_lat REAL, src_lon REAL, dst_lat REAL, dst_lon REAL, "
+                "duration REAL, created REAL, last_used REAL, "
+                "PRIMARY KEY (commute_type, src_lat, src_lon, dst_lat, dst_lon))"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS routes_last_used ON routes (last_used)")
+        self.evict()
+
+    def make_key(self, commute_type: str, src_lat_lon: tuple, dst_lat_lon: tuple) -> tuple:
+        """
+        Builds the cache key for a route.
+        Args:
+            commute_type: OSRM profile
+            src_lat_lon: (lat, lon) of the start of the route
+            dst_lat_lon: (lat, lon) of the commute location
+
+        Returns: tuple key with rounded coordinates
+        """
+        return (commute_type,
+                round(src_lat_lon[0], self.precision), round(src_lat_lon[1], self.precision),
+                round(dst_lat_lon[0], self.precision), round(dst_lat_lon[1], self.precision))
+
+    def get(self, commute_type: str, src_lat_lon: tuple, dst_lat_lon: tuple):
+        """
+        Looks up a cached travel time.
+        Args:
+            commute_type: OSRM profile
+            src_lat_lon: (lat, lon) of the start of the route
+            dst_lat_lon: (lat, lon) of the commute location
+
+        Returns: duration in seconds, or None if it is not cached or has expired
+        """
+        key = self.make_key(commute_type, src_lat_lon, dst_lat_lon)
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT duration, created FROM routes WHERE commute_type = ? AND src_lat = ? AND src_lon = ? "
+                "AND dst_lat = ? AND dst_lon = ?", key
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl:
+                self.misses += 1
+                return None
+            self.hits += 1
+            with self.conn:
+                self.conn.execute(
+                    "UPDATE routes SET last_used = ? WHERE commute_type = ? AND src_lat = ? AND src_lon = ? "
+                    "AND dst_lat = ? AND dst_lon = ?", (now, *key)
+                )
+            return row[0]
+
+    def put(self, commute_type: str, src_lat_lon: tuple, dst_lat_lon: tuple, duration: float) -> None:
+        """
+        Stores a travel time.
+        Args:
+            commute_type: OSRM profile
+            src_lat_lon: (lat, lon) of the start of the route
+            dst_lat_lon: (lat, lon) of the commute location
+            duration: travel time in seconds
+        """
+        key = self.make_key(commute_type, src_lat_lon, dst_lat_lon)
+        now = time.time()
+        with self._lock:
+            with self.conn:
+                self.conn.execute("INSERT OR REPLACE INTO routes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                  (*key, duration, now, now))
+            self._writes += 1
+            evict = self._writes % self.EVICT_EVERY == 0
+        if evict:
+            self.evict()
+
+    def evict(self) -> None:
+        """Deletes expired entries, then the least recently used ones above max_entries."""
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM routes WHERE created < ?", (time.time() - self.ttl,))
+            (count,) = self.conn.execute("SELECT COUNT(*) FROM routes").fetchone()
+            if count > self.max_entries:
+                self.conn.execute(
+                    "DELETE FROM routes WHERE rowid IN (SELECT rowid FROM routes ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+
+    def stats(self) -> dict:
+        """
+        Hit/miss counts since the cache was opened.
+        Returns: dict with "hits" and "misses"
+        """
+        return {"hits": self.hits, "misses": self.misses}
+
+    def close(self) -> None:
+        """Applies the size bound and closes the SQLite file."""
+        self.evict()
+        self.conn.close()
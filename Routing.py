@@ -0,0 +1,155 @@
+import json, time
+
+from consts import COMMUTE_LAT_LON, COMMUTE_TYPE, OSRM_HOST, OSRM_TABLE_CHUNK_SIZE, OSRM_TABLE_URL, OSRM_URL
+from HTTPSession import HTTPSession
+from Logger import get_logger
+from Metrics import Metrics
+from RouteCache import RouteCache
+
+logger = get_logger(__name__)
+
+
+class Router:
+    def __init__(self, session: HTTPSession = None, commute_type: str = COMMUTE_TYPE,
+                 commute_lat_lon: tuple = COMMUTE_LAT_LON, osrm_host: str = OSRM_HOST,
+                 chunk_size: int = OSRM_TABLE_CHUNK_SIZE, route_cache: RouteCache = None, metrics: Metrics = None):
+        """
+        Gets commute times from OSRM, either one route at a time or in batches through the table service.
+        Args:
+            session: HTTPSession used for OSRM requests. Defaults to a process-wide session.
+            commute_type: OSRM profile - "bike", "foot", or "car"
+            commute_lat_lon: (lat, lon) of the commute location
+            osrm_host: scheme and host of the OSRM server
+            chunk_size: max number of sources per table request
+            route_cache: RouteCache checked before querying OSRM. No caching if not given.
+            metrics: Metrics the time taken to route each listing is recorded in. Not recorded if not given.
+        """
+        self.session = session if session is not None else HTTPSession.get_default()
+        self.commute_type = commute_type
+        self.commute_lat_lon = commute_lat_lon
+        self.osrm_host = osrm_host.rstrip("/")
+        self.chunk_size = chunk_size
+        self.route_cache = route_cache
+        self.metrics = metrics if metrics is not None else Metrics(enabled=False)
+
+    @property
+    def commute_key(self) -> str:
+        """Identifies the commute this Router gets travel times for."""
+        return f"{self.commute_type}:{self.commute_lat_lon[0]},{self.commute_lat_lon[1]}"
+
+    def route(self, lat_lon: tuple, commute_lat_lon: tuple = None) -> dict:
+        """
+        Queries the OSRM route service for a single route to the commute location. A cached travel time is returned
+        as route JSON holding only the duration.
+        Args:
+            lat_lon: (lat, lon) of the start of the route
+            commute_lat_lon: (lat, lon) of the end of the route. Defaults to the commute location.
+
+        Returns: OSRM route JSON
+        """
+        if commute_lat_lon is None:
+            commute_lat_lon = self.commute_lat_lon
+        if self.route_cache is not None:
+            duration = self.route_cache.get(self.commute_type, lat_lon, commute_lat_lon)
+            if duration is not None:
+                return {"code": "Ok", "routes": [{"duration": duration}]}
+
+        formatted_url = OSRM_URL.format(osrm_host=self.osrm_host, commute_type=self.commute_type,
+                                        start_lon=lat_lon[1], start_lat=lat_lon[0],
+                                        commute_lon=commute_lat_lon[1], commute_lat=commute_lat_lon[0])
+        r = self.session.get(formatted_url, use_cache=True)
+        r.raise_for_status()
+        routes = json.loads(r.content)
+        if self.route_cache is not None and routes.get("routes"):
+            self.route_cache.put(self.commute_type, lat_lon, commute_lat_lon, routes["routes"][0]["duration"])
+        return routes
+
+    def matrix(self, lat_lons: list, destinations: list) -> list:
+        """
+        Gets the travel time from every lat/lon to every destination. Cached travel times are used where available,
+        and lat/lons missing any of them are queried in a single table request.
+        Args:
+            lat_lons: list of (lat, lon) tuples
+            destinations: list of (lat, lon) tuples
+
+        Returns: one list of durations in seconds per lat/lon, in the same order as destinations. None where OSRM
+            found no route.
+        """
+        if self.route_cache is None:
+            return self.query_matrix(lat_lons, destinations)
+
+        rows = [[self.route_cache.get(self.commute_type, lat_lon, destination) for destination in destinations]
+                for lat_lon in lat_lons]
+        missing = [i for i, row in enumerate(rows) if None in row]
+        if missing:
+            queried = self.query_matrix([lat_lons[i] for i in missing], destinations)
+            for i, row in zip(missing, queried):
+                rows[i] = row
+                for destination, duration in zip(destinations, row):
+                    if duration is not None:
+                        self.route_cache.put(self.commute_type, lat_lons[i], destination, duration)
+        return rows
+
+    def query_matrix(self, lat_lons: list, destinations: list) -> list:
+        """
+        Queries the OSRM table service for the travel time from every lat/lon to every destination in a single
+        request.
+        Args:
+            lat_lons: list of (lat, lon) tuples
+            destinations: list of (lat, lon) tuples
+
+        Returns: one list of durations in seconds per lat/lon, in the same order as destinations. None where OSRM
+            found no route.
+        """
+        # OSRM takes coordinates as lon,lat. The destinations go after the sources.
+        coordinates = ";".join(f"{lon},{lat}" for lat, lon in [*lat_lons, *destinations])
+        formatted_url = OSRM_TABLE_URL.format(
+            osrm_host=self.osrm_host, commute_type=self.commute_type, coordinates=coordinates,
+            sources=";".join(str(i) for i in range(len(lat_lons))),
+            destinations=";".join(str(len(lat_lons) + i) for i in range(len(destinations)))
+        )
+        r = self.session.get(formatted_url, use_cache=True)
+        r.raise_for_status()
+        table_json = json.loads(r.content)
+        if table_json.get("code") != "Ok":
+            raise ValueError(f"OSRM table request failed: {table_json.get('message', table_json.get('code'))}")
+        durations = table_json["durations"]
+        if len(durations) != len(lat_lons) or any(len(row) != len(destinations) for row in durations):
+            raise ValueError(f"OSRM table returned the wrong shape for {len(lat_lons)} sources and "
+                             f"{len(destinations)} destinations")
+        return durations
+
+    def resolve_matrix(self, lat_lons: list, destinations: list) -> list:
+        """
+        Gets the travel time from every lat/lon to every destination using chunked table requests. If a chunk fails,
+        or OSRM has no duration for a pair, that pair falls back to its own route request.
+        Args:
+            lat_lons: list of (lat, lon) tuples
+            destinations: list of (lat, lon) tuples
+
+        Returns: one list of durations in seconds per lat/lon, in the same order as destinations, or None for a
+            lat/lon whose travel time to any destination could not be found
+        """
+        resolved = []
+        for chunk_start in range(0, len(lat_lons), self.chunk_size):
+            chunk = lat_lons[chunk_start:chunk_start + self.chunk_size]
+            chunk_start_time = time.perf_counter()
+            try:
+                rows = self.matrix(chunk, destinations)
+            except Exception as e:
+                logger.warning("OSRM table request failed for %d listings, falling back to single routes: %s",
+                               len(chunk), e)
+                rows = [[None] * len(destinations) for _ in chunk]
+
+            for lat_lon, row in zip(chunk, rows):
+                try:
+                    row = [duration if duration is not None
+                           else self.route(lat_lon, destination)["routes"][0]["duration"]
+                           for destination, duration in zip(destinations, row)]
+                except Exception as e:
+                    logger.warning("Could not get travel time from %s: %s", lat_lon, e)
+                    row = None
+                resolved.append(row)
+            # Every listing in the chunk waited for the whole chunk
+            self.metrics.observe("route", time.perf_counter() - chunk_start_time, count=len(chunk))
+        return resolved
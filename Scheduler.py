@@ -0,0 +1,135 @@
+import os, time
+from concurrent.futures import ThreadPoolExecutor
+
+from JSONProcessing import JSONProcessing
+from ListingStore import ListingStore
+from Logger import get_logger
+from RouteCache import RouteCache
+from Search import Search
+from SharedSessions import SharedSessions
+from SpatialIndex import SpatialIndex
+from consts import (
+    FULL_WALK_INTERVAL,
+    GLOBAL_MAX_CONCURRENCY,
+    LISTING_STORE_FILENAME,
+    MAX_CONCURRENT_SEARCHES,
+    MAX_POLL_INTERVAL,
+    POLL_BACKOFF_FACTOR,
+    POLL_INTERVAL,
+    ROUTE_CACHE_FILENAME,
+    SPATIAL_INDEX_FILENAME,
+    json_folder
+)
+
+logger = get_logger(__name__)
+
+
+class Scheduler:
+    def __init__(self, search_names: list, max_concurrency: int = GLOBAL_MAX_CONCURRENCY,
+                 max_concurrent_searches: int = MAX_CONCURRENT_SEARCHES):
+        """
+        Keeps Searches running in one process instead of starting each run from scratch. Each Search is loaded once
+        and keeps its df and pid's in memory. It is then polled on its own interval: only the first results page is
+        fetched, and every page is walked only if it changed. Intervals back off while a Search finds nothing new.
+        Searches with the same HTTP cache and timeout settings share one HTTP session, and all Searches share one route
+        cache, listing store and spatial index.
+        Args:
+            search_names: names of the Searches to keep running
+            max_concurrency: max number of requests in flight at the same time, across all Searches
+            max_concurrent_searches: max number of Searches polled at the same time
+        """
+        self.max_concurrent_searches = max_concurrent_searches
+        self.sessions = SharedSessions(max_concurrency)
+        self.route_cache = RouteCache(os.path.join(json_folder, ROUTE_CACHE_FILENAME))
+        self.listing_store = ListingStore(os.path.join(json_folder, LISTING_STORE_FILENAME))
+        self.spatial_index = SpatialIndex(os.path.join(json_folder, SPATIAL_INDEX_FILENAME))
+
+        self.searches = {}
+        self.base_intervals = {}
+        self.intervals = {}
+        self.next_polls = {}
+        self.last_full_walks = {}
+        for search_name in search_names:
+            if not JSONProcessing.search_name_exists(search_name):
+                logger.warning("Search %s does not exist; skipping", search_name)
+                continue
+            data_dict = JSONProcessing.get_json_dict(search_name)
+            search = Search(data_dict, session=self.sessions.get(data_dict), route_cache=self.route_cache,
+                            listing_store=self.listing_store, spatial_index=self.spatial_index)
+            search.load_pid_data()
+            self.searches[search_name] = search
+            self.base_intervals[search_name] = data_dict.get("poll_interval", POLL_INTERVAL)
+            self.intervals[search_name] = self.base_intervals[search_name]
+            self.next_polls[search_name] = time.monotonic()
+            self.last_full_walks[search_name] = None
+
+    def poll(self, search_name: str) -> bool:
+        """
+        Checks one Search for new or removed listings. Every page is walked on the first poll, when the first results
+        page changed, or when the last full walk is older than FULL_WALK_INTERVAL, since listings removed from later
+        pages don't show up on the first one.
+        Args:
+            search_name: name of the Search to poll
+
+        Returns: True if listings were added or deleted
+        """
+        search = self.searches[search_name]
+        try:
+            last_full_walk = self.last_full_walks[search_name]
+            if (last_full_walk is not None and time.monotonic() - last_full_walk < FULL_WALK_INTERVAL
+                    and not search.first_page_changed()):
+                logger.info("First results page unchanged", extra={"search": search_name})
+                return False
+            self.last_full_walks[search_name] = time.monotonic()
+            changed = search.update()
+            if search.pages_failed:
+                # Walk every page again on the next poll, so removed listings are not missed for FULL_WALK_INTERVAL
+                self.last_full_walks[search_name] = None
+            search.write_metrics()
+            return changed
+        except Exception as e:
+            logger.exception("Search failed: %s", e, extra={"search": search_name})
+            return False
+
+    def reschedule(self, search_name: str, changed: bool) -> None:
+        """
+        Sets when a Search is polled next. A Search that changed goes back to its base interval, and a quiet one
+        waits POLL_BACKOFF_FACTOR times longer than last time, up to MAX_POLL_INTERVAL.
+        Args:
+            search_name: name of the Search that was polled
+            changed: whether the poll found new or removed listings
+        """
+        if changed:
+            interval = self.base_intervals[search_name]
+        else:
+            interval = min(self.intervals[search_name] * POLL_BACKOFF_FACTOR,
+                           max(MAX_POLL_INTERVAL, self.base_intervals[search_name]))
+        self.intervals[search_name] = interval
+        self.next_polls[search_name] = time.monotonic() + interval
+        logger.info("Next poll in %.0f seconds", interval, extra={"search": search_name})
+
+    def run(self) -> None:
+        """Polls Searches as they come due, until interrupted with Ctrl-C."""
+        if not self.searches:
+            logger.warning("No searches to run.")
+            self.close()
+            return
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_concurrent_searches) as executor:
+                while True:
+                    now = time.monotonic()
+                    due = [name for name, next_poll in self.next_polls.items() if next_poll <= now]
+                    for search_name, changed in zip(due, executor.map(self.poll, due)):
+                        self.reschedule(search_name, changed)
+                    time.sleep(max(min(self.next_polls.values()) - time.monotonic(), 0))
+        except KeyboardInterrupt:
+            logger.info("Stopping.")
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        """Closes the shared sessions, route cache, listing store and spatial index."""
+        self.sessions.close()
+        self.route_cache.close()
+        self.listing_store.close()
+        self.spatial_index.close()
@@ -1,17 +1,44 @@
-import datetime, os, pandas as pd, requests
+import json, logging, math, os, pandas as pd
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from consts import (
-    HEADER,
+    COMMUTE_AGGREGATE,
+    CRAIGSLIST_HOST,
+    HTML_PARSER,
+    HTTP_CACHE_FOLDERNAME,
+    HTTP_CACHE_MODE,
+    HTTP_TIMEOUT,
+    LISTING_STORE_FILENAME,
+    MAX_CONCURRENCY,
+    MAX_SEARCH_PAGES,
+    METRICS,
+    OSRM_HOST,
+    PARTIAL_PARSING,
+    REPORT_PAGE_SIZE,
+    ROUTE_CACHE_FILENAME,
+    SEARCH_PAGE_ONLY,
+    SPATIAL_INDEX_FILENAME,
+    STORAGE_BACKEND,
     cols,
     required_search_cols,
     json_folder
 )
 from bs4 import BeautifulSoup
-from Listing import Listing
+from Commutes import CommuteMatrix
+from Geo import haversine_miles
+from HTTPCache import HTTPCache
+from HTTPSession import HTTPSession
+from Listing import Listing, ListingColumns
+from ListingStore import ListingStore
+from Logger import get_logger
+from Metrics import Metrics
+from Parsing import check_parser, make_soup, search_page_strainer
+from Prefilter import Prefilter
+from Report import Report
+from RouteCache import RouteCache
+from SpatialIndex import SpatialIndex
+from Storage import ListingJournal, make_storage
 
 
-# Article on pd.cut https://towardsdatascience.com/how-to-bin-numerical-data-with-pandas-fe5146c9dc55
-# https://towardsdatascience.com/all-pandas-cut-you-should-know-for-transforming-numerical-data-into-categorical-data-1370cf7f4c4f
-
 class Search:
     """Creates a class to scrape and operate Craigslist listings.
     Constructor requires dictionary of the following parameters:
@@ -25,15 +52,47 @@ class Search:
     min_rent_cutoff (int): Filter out listings below this price. Defaults to 0.
     search_type (str): Type of search - "apa" for whole apartments, "roo" for room(s) in existing apartments.
         Defaults to "apa".
+    max_concurrency (int): Optional. Max number of listings fetched at the same time. Defaults to MAX_CONCURRENCY.
+    http_timeout (list): Optional. [connect, read] timeout in seconds for HTTP requests. Defaults to HTTP_TIMEOUT.
+    http_cache (str): Optional. "on", "off" or "replay" to only use cached pages. Defaults to HTTP_CACHE_MODE.
+    osrm_host (str): Optional. OSRM server to get commute times from. Defaults to OSRM_HOST.
+    craigslist_host (str): Optional. Craigslist site to search. Defaults to CRAIGSLIST_HOST.
+    search_page_only (bool): Optional. Only request listing pages for fields missing from the search page.
+        Defaults to SEARCH_PAGE_ONLY.
+    storage_backend (str): Optional. "sqlite" or "csv". Defaults to STORAGE_BACKEND.
+    html_parser (str): Optional. "html.parser" or "lxml". Defaults to HTML_PARSER.
+    partial_parsing (bool): Optional. Only parse the parts of pages that are read. Defaults to PARTIAL_PARSING.
+    max_pages (int): Optional. Max number of results pages fetched per search circle. Defaults to MAX_SEARCH_PAGES.
+    tile_radius (float): Optional. Split the search into overlapping circles of this radius (in miles), fetched in
+        parallel, to get past the cap on results per search. Defaults to no tiling.
+    title_blocklist (list): Optional. Skip listings whose title contains any of these keywords. Defaults to none.
+    max_crow_distance (float): Optional. Skip listings further than this many miles from the (first) commute
+        location, as the crow flies. Defaults to no limit.
+    commutes (list): Optional. Commute locations, each a dict with "name", "lat_lon", "modes" and optionally
+        "weight". Each commute and mode gets its own travel time column. Defaults to COMMUTE_LAT_LON by COMMUTE_TYPE.
+    commute_aggregate (str): Optional. How TRAVEL TIME combines several travel times: "max", "min" or "weighted".
+        Defaults to COMMUTE_AGGREGATE.
+    metrics (bool): Optional. Record stage and per-listing timings and requests per host, and write them to
+        <search_name>.metrics (JSON) and <search_name>.prom after each run. Defaults to METRICS.
+    report_page_size (int): Optional. Number of listings the results page shows at a time. Defaults to
+        REPORT_PAGE_SIZE.
 
     Args:
         data_dict: Dictionary containing all the search parameters
+        session: HTTPSession shared by this Search and its Listings. A new one is created if not given. A given session
+            is used as is, so its cache and timeouts should match http_cache and http_timeout, like the ones
+            SharedSessions makes.
+        route_cache: RouteCache for OSRM travel times. A new one is opened if not given.
+        listing_store: ListingStore shared with other Searches. A new one is opened if not given.
+        spatial_index: SpatialIndex of the stored listings of every Search. A new one is opened if not given.
     """
 
-    def __init__(self, data_dict: dict) -> None:
+    def __init__(self, data_dict: dict, session: HTTPSession = None, route_cache: RouteCache = None,
+                 listing_store: ListingStore = None, spatial_index: SpatialIndex = None) -> None:
         if not all(key in data_dict for key in required_search_cols):
             raise KeyError("Search settings missing values.")
         self.search_name = data_dict['search_name']
+        self.log = get_logger(__name__, search=self.search_name)
         self.max_rent = data_dict['max_rent']
         self.min_rent_cutoff = data_dict['min_rent_cutoff']
         self.search_lat = data_dict['search_lat']
@@ -41,236 +100,663 @@ class Search:
         self.search_radius = data_dict['search_radius']
         self.bedrooms = data_dict['bedrooms']
         self.search_type = data_dict['search_type']
-
-        self.url = (f"https://sfbay.craigslist.org/search/san-francisco-ca/{self.search_type}?lat={self.search_lat}"
-                    f"&lon={self.search_lon}&max_price={self.max_rent}&search_distance={self.search_radius}"
-                    f"&max_bedrooms={self.bedrooms}")
-        print(f"Checking URL {self.url}")
+        self.max_concurrency = data_dict.get('max_concurrency', MAX_CONCURRENCY)
+        self.search_page_only = data_dict.get('search_page_only', SEARCH_PAGE_ONLY)
+        self.html_parser = data_dict.get('html_parser', HTML_PARSER)
+        check_parser(self.html_parser)
+        self.partial_parsing = data_dict.get('partial_parsing', PARTIAL_PARSING)
+        self.max_pages = data_dict.get('max_pages', MAX_SEARCH_PAGES)
+        self.tile_radius = data_dict.get('tile_radius')
+        self.craigslist_host = data_dict.get('craigslist_host', CRAIGSLIST_HOST)
+        self.prefilter = Prefilter(self.min_rent_cutoff, title_blocklist=data_dict.get('title_blocklist', []),
+                                   max_crow_distance=data_dict.get('max_crow_distance'))
+        if session is None:
+            # Like HTTP_POOL_SIZE, room for the results page walk and the listing fetches at the same time
+            session = HTTPSession(pool_size=2 * self.max_concurrency,
+                                  timeout=tuple(data_dict.get('http_timeout', HTTP_TIMEOUT)),
+                                  http_cache=self.make_http_cache(data_dict.get('http_cache', HTTP_CACHE_MODE)))
+        self.session = session
+        if route_cache is None:
+            route_cache = RouteCache(os.path.join(json_folder, ROUTE_CACHE_FILENAME))
+        self.route_cache = route_cache
+        if listing_store is None:
+            listing_store = ListingStore(os.path.join(json_folder, LISTING_STORE_FILENAME))
+        self.listing_store = listing_store
+        self.metrics = Metrics(data_dict.get('metrics', METRICS), search_name=self.search_name)
+        if spatial_index is None:
+            spatial_index = SpatialIndex(os.path.join(json_folder, SPATIAL_INDEX_FILENAME))
+        self.spatial_index = spatial_index
+        self.commutes = CommuteMatrix(data_dict.get('commutes'),
+                                      aggregate=data_dict.get('commute_aggregate', COMMUTE_AGGREGATE),
+                                      session=self.session, osrm_host=data_dict.get('osrm_host', OSRM_HOST),
+                                      route_cache=self.route_cache, metrics=self.metrics)
+        # Router for single routes to the first commute location
+        self.router = next(iter(self.commutes.routers.values()))
+        self.columns = cols + self.commutes.columns
+        self.storage_backend = data_dict.get('storage_backend', STORAGE_BACKEND)
+        self.storage = make_storage(self.search_name, self.storage_backend, columns=self.columns)
+        self.journal = ListingJournal(self.search_name, columns=self.columns)
+
+        self.html_path = os.path.join(json_folder, self.search_name + ".html")
+        self.report = Report(self.html_path, os.path.join(json_folder, self.search_name + ".data.js"),
+                             title=self.search_name, page_size=data_dict.get('report_page_size', REPORT_PAGE_SIZE))
+        self.url = self.make_search_url(self.search_lat, self.search_lon, self.search_radius)
+        self.log.info("Checking URL %s", self.url)
 
         # pid = unique id for a listing
         self.pids = set()  # existing pid's
         self.current_run_pids = set()  # current pid's
-        self.df = pd.DataFrame(columns=cols)
+        self.resumed_pids = set()  # pid's finished by an interrupted run, not yet in storage
+        self.sunk_pids = set()  # pid's written to storage during this run
+        self.new_listings = ListingColumns(self.columns)  # listings finished during this run, added to df at the end
+        self.first_page_urls = set()  # listing urls on the first results page of each tile, as of the last walk
+        self.walk_complete = True  # False if the last walk missed results pages, because they failed or past max_pages
+        self.pages_failed = 0  # results pages of the last walk that could not be fetched
+        self.df = pd.DataFrame(columns=self.columns)
+        self.listing_page_fetches_avoided = 0
+        self.listings_reused = 0
+        # Counters of the session and caches when the last run started. They count since they were created, and may
+        # be shared with other Searches
+        self.stats_at_start = self.get_stats()
+
+    @staticmethod
+    def make_http_cache(http_cache_mode: str) -> HTTPCache | None:
+        """Creates the on-disk HTTP cache for search and listing pages.
 
-    def load_pid_data(self) -> None:
-        """Checks if search savepath and csv available, and loads/creates files as appropriate."""
+        Args:
+            http_cache_mode: "on", "off" or "replay"
 
-        csv_path = os.path.join(json_folder, self.search_name + ".csv")
-        if not os.path.exists(csv_path):
-            print("This search has no .csv of existing listings")
-        else:
-            self.df = pd.read_csv(csv_path, index_col=0)
+        Returns: HTTPCache, or None if the cache is off
+        """
+        if http_cache_mode not in ("on", "off", "replay"):
+            raise ValueError("http_cache must be 'on', 'off' or 'replay'")
+        if http_cache_mode == "off":
+            return None
+        return HTTPCache(os.path.join(json_folder, HTTP_CACHE_FOLDERNAME), replay=http_cache_mode == "replay")
 
-            # Convert travel time and posted columns to timedelta objects
-            self.df["TRAVEL TIME"] = pd.to_timedelta(self.df["TRAVEL TIME"])
-            self.df["POSTED"] = pd.to_timedelta(self.df["POSTED"])
+    def load_pid_data(self) -> None:
+        """Checks if search savepath and stored listings available, and loads/creates files as appropriate."""
 
-            print("Loaded df from csv")
+        if not self.storage.exists():
+            self.log.info("This search has no %s storage of existing listings", self.storage_backend)
+        else:
+            self.df = self.storage.load()
+            self.log.info("Loaded %d listings from %s", len(self.df), self.storage_backend)
             # Save pids to a set
             self.pids = set(self.df["PID"])
-
-    def get_listing_info(self, listing_raw_list) -> []:
-        """Iterates through listing HTML and adds relevant data to a list.
-        Creates Listing() objects using the listing HTML and returns them in a list to be concatenated with df
+            self.fill_lat_lons()
+        self.spatial_index.sync(self.search_name, self.df)
+
+        resumed_df = self.journal.load()
+        resumed_df = resumed_df[~resumed_df["PID"].isin(self.pids)]
+        if not resumed_df.empty:
+            self.log.info("Resuming interrupted run: %d listings were already finished", len(resumed_df))
+            self.resumed_pids = set(resumed_df["PID"])
+            self.df = pd.concat([self.df, resumed_df]) if not self.df.empty else resumed_df
+
+    def fill_lat_lons(self) -> None:
+        """Fills in the lat/lon of stored listings from before it was stored, from the listing store, and writes them
+        back to storage."""
+        missing = self.df["LAT"].isna() | self.df["LON"].isna()
+        if not missing.any():
+            return
+        lat_lons = self.listing_store.get_lat_lons(self.df.loc[missing, "PID"].tolist())
+        if not lat_lons:
+            return
+        filled = self.df["PID"].map(lat_lons)
+        has_lat_lon = missing & filled.notna()
+        self.df.loc[has_lat_lon, "LAT"] = [lat_lon[0] for lat_lon in filled[has_lat_lon]]
+        self.df.loc[has_lat_lon, "LON"] = [lat_lon[1] for lat_lon in filled[has_lat_lon]]
+        self.storage.upsert(self.df[has_lat_lon])
+        self.storage.flush()
+        self.log.info("Filled in lat/lon of %d stored listings", has_lat_lon.sum())
+
+    def get_listing_info(self, listing_raw_list, search_page_items: list = None) -> int:
+        """Iterates through listing HTML and adds relevant data to new_listings.
+        Creates Listing() objects using the listing HTML, and adds the fields of the finished ones to new_listings,
+        to be concatenated with df. The Listings themselves are not kept.
+        Listings rejected by the prefilter are dropped before anything is fetched for them.
+        New listings are fetched concurrently, at most max_concurrency at a time, but the returned list keeps the
+        order of listing_raw_list. Travel times for all fetched listings are then resolved in batched OSRM requests.
+        Listings another Search already resolved are taken from the listing store instead of being fetched and routed.
+        Listings another Search sharing the store is resolving right now are waited for once this Search's own
+        listings on the page are finished, and then taken from the store too. They are added after the others.
+        Finished listings are passed to sink as soon as they are routed.
 
         Args:
             listing_raw_list: List of bs4 Tag objects representing Listing HTML
+            search_page_items: Embedded search page JSON for each listing, in the same order as listing_raw_list
 
-        Returns: List of Listings
+        Returns: number of listings added to new_listings
         """
 
-        new_listings = []
-        for curr_listing_idx, listing_raw in enumerate(listing_raw_list):
+        if search_page_items is None or len(search_page_items) != len(listing_raw_list):
+            search_page_items = [None] * len(listing_raw_list)
+
+        candidates = []
+        claimed_pids = []  # listings this Search resolves, that other Searches wait for
+        waiting = []  # (index, Listing, Future) of listings another Search is resolving
+        for curr_listing_idx, (listing_raw, search_page_item) in enumerate(zip(listing_raw_list, search_page_items)):
             curr_listing_idx += 1  # For one-indexing
-            curr_listing = Listing(listing_raw)
+            curr_listing = Listing(listing_raw, session=self.session, router=self.router,
+                                   search_page_item=search_page_item, search_page_only=self.search_page_only,
+                                   html_parser=self.html_parser, partial_parsing=self.partial_parsing,
+                                   commute_lat_lon=self.commutes.lat_lon, metrics=self.metrics)
+            # Pages and tiles overlap, so skip listings already seen during this run
+            if curr_listing.pid in self.current_run_pids:
+                self.log.debug("Listing %d - %d already seen in this run; skipping", curr_listing_idx,
+                               curr_listing.pid, extra={"pid": curr_listing.pid})
+                continue
             self.current_run_pids.add(curr_listing.pid)
 
+            if curr_listing.pid in self.resumed_pids:
+                self.log.debug("Listing %d - %d finished before the last run was interrupted; skipping",
+                               curr_listing_idx, curr_listing.pid, extra={"pid": curr_listing.pid})
+                continue
+
             # If data exists for this listing, skip it
             if curr_listing.pid in self.pids:
-                print(
-                    f"Listing {curr_listing_idx} - {curr_listing.pid} already exists; skipping"
-                )
+                self.log.debug("Listing %d - %d already exists; skipping", curr_listing_idx, curr_listing.pid,
+                               extra={"pid": curr_listing.pid})
                 continue
 
-            # If listing cannot be processed for some reason, print and skip. Else, add it to csv
+            # Filter on the search page fields before anything is fetched
             try:
-                print(f"PROCESSING listing {curr_listing_idx}")
-                curr_listing.generate_listing_data()
+                curr_listing.get_summary_info()
+                if self.search_page_only:
+                    curr_listing.get_search_page_info()
+                curr_listing.drop_parse_tree()
             except Exception as e:
-                print(
-                    f"Could not get data for listing number {curr_listing_idx} - {curr_listing.url}"
-                )
-                print(f"Exception: \n{e}")
+                self.log.warning("Could not parse listing number %d - %s: %s", curr_listing_idx, curr_listing.url, e,
+                                 extra={"pid": curr_listing.pid})
+                continue
+            stored_record, in_flight = self.listing_store.claim(curr_listing.pid)
+            if in_flight is not None:
+                waiting.append((curr_listing_idx, curr_listing, in_flight))
+                continue
+            if stored_record is not None:
+                curr_listing.load_stored(stored_record, self.commutes.commute_key)
             else:
-                print(
-                    f"Adding {curr_listing.pid} to dataframe, \nposted {curr_listing.posted.days} days ago"
-                    f"\nTitle: {curr_listing.title}\nURL: {curr_listing.url}\n"
-                )
-                new_listings.append(curr_listing.get_data())
-        return new_listings
+                claimed_pids.append(curr_listing.pid)
+            candidates.append((curr_listing_idx, curr_listing))
+
+        # Claimed listings are released before waiting for other Searches, so two Searches never wait for each other
+        try:
+            routed = self.finish_listings(candidates)
+        finally:
+            self.listing_store.release(claimed_pids)
+        if not waiting:
+            return routed
+        wait([in_flight for _, _, in_flight in waiting])
+        candidates = []
+        for curr_listing_idx, curr_listing, _ in waiting:
+            # Not stored if the other Search could not resolve it or its filters rejected it, so it is resolved here
+            stored_record = self.listing_store.get(curr_listing.pid)
+            if stored_record is not None:
+                curr_listing.load_stored(stored_record, self.commutes.commute_key)
+            candidates.append((curr_listing_idx, curr_listing))
+        return routed + self.finish_listings(candidates)
+
+    def finish_listings(self, candidates: list) -> int:
+        """Filters, fetches and routes listings, then adds the ones that got a travel time to new_listings and passes
+        them to sink. See get_listing_info.
 
-    def get_listings(self) -> int:
-        """Scrapes data from main page and gets information for each listing.
-        - gets the response from the URL and creates a soup out of it.
-        - finds all the list items and grabs their HTML <li> tag
-        - removes non-listing list items
-        - Calls get_listing_info() on linking HTML to get info about listings
+        Args:
+            candidates: (one-indexed position on the search page, Listing) of partially parsed listings
 
-        Returns: -1 if no listings, +1 if yes listings
+        Returns: number of listings added to new_listings
         """
-        source = requests.get(self.url, headers=HEADER)
-        soup = BeautifulSoup(source.text, "html.parser")
-        # Should find most listings, unless result set is huge
-        listing_raw_list = soup.find_all("li")
+        # Including listings from the store, whose stored crow distance may be to another Search's commute
+        self.set_crow_distances([curr_listing for _, curr_listing in candidates if curr_listing.lat_lon])
+        listings_to_process = []
+        for curr_listing_idx, curr_listing in candidates:
+            rejected_by = self.prefilter.check(curr_listing)
+            if rejected_by is not None:
+                self.log.debug("Listing %d - %d rejected by %s filter; skipping", curr_listing_idx, curr_listing.pid,
+                               rejected_by, extra={"pid": curr_listing.pid})
+                continue
+            listings_to_process.append((curr_listing_idx, curr_listing))
+
+        # executor.map yields results in submission order, so the df keeps the order of the search page
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            processed = executor.map(lambda args: self.process_listing(*args), listings_to_process)
+            fetched_listings = [curr_listing for curr_listing in processed if curr_listing is not None]
+        self.set_crow_distances([curr_listing for curr_listing in fetched_listings
+                                 if curr_listing.listing_page_fetched])
+        # Listings without lat/lon on the search page can only be checked against crow_distance now, before routing
+        fetched_listings = [curr_listing for curr_listing in fetched_listings
+                            if self.prefilter.check(curr_listing, fetched=True) is None]
+        # Listings from the store are counted in listings_reused instead
+        self.listing_page_fetches_avoided += sum(
+            not curr_listing.listing_page_fetched and not curr_listing.from_store for curr_listing in fetched_listings
+        )
+        self.listings_reused += sum(curr_listing.from_store for curr_listing in fetched_listings)
+
+        newly_routed = {id(curr_listing) for curr_listing in self.commutes.resolve_travel_times(
+            [curr_listing for curr_listing in fetched_listings if curr_listing.travel_time is None]
+        )}
+        routed_listings = [curr_listing for curr_listing in fetched_listings
+                           if curr_listing.travel_time is not None and
+                           (id(curr_listing) in newly_routed or curr_listing.from_store)]
+        self.listing_store.put_many([curr_listing for curr_listing in routed_listings
+                                     if id(curr_listing) in newly_routed], self.commutes.commute_key)
+        for curr_listing in routed_listings:
+            self.log.debug("Adding %d, posted %d days ago: %s %s", curr_listing.pid, curr_listing.posted.days,
+                           curr_listing.title, curr_listing.url, extra={"pid": curr_listing.pid})
+        page_start = len(self.new_listings)
+        self.new_listings.extend(routed_listings)
+        if routed_listings:
+            self.sink(self.new_listings.to_df(start=page_start))
+        return len(routed_listings)
+
+    def sink(self, new_listings_df: pd.DataFrame) -> None:
+        """Writes out listings as soon as they are finished, so they survive an interrupted run and are available
+        before the run ends. Storage that can be written incrementally gets them right away. Otherwise they go to
+        the journal until write_to_csv rewrites the storage file.
 
-        if len(listing_raw_list) > 0:
-            print(f"{len(listing_raw_list)} listings found\n")
+        Args:
+            new_listings_df: df of the finished listings
+        """
+        if self.storage.incremental:
+            self.storage.upsert(new_listings_df)
+            self.storage.flush()
+            self.spatial_index.add(self.search_name, new_listings_df)
+            self.sunk_pids.update(new_listings_df["PID"].tolist())
         else:
-            print("NO LISTINGS FOUND")
-            return -1
+            self.journal.append(new_listings_df)
 
-        if listing_raw_list[0].div.text == "see also":
-            print("Removed 'see also' div")
-            del listing_raw_list[0]
+    def set_crow_distances(self, listings: list) -> None:
+        """Sets crow_distance on every listing in one vectorized pass, instead of one geodesic per listing.
 
-        new_listings = self.get_listing_info(listing_raw_list)
-        new_listings_df = pd.DataFrame(new_listings, columns=cols)
-        print(f"old df size: {len(self.df)}")
-        self.df = pd.concat([self.df, new_listings_df])
-        print(f"new df size: {len(self.df)}")
-        return 1
+        Args:
+            listings: Listings whose lat_lon is set
+        """
+        if not listings:
+            return
+        distances = haversine_miles([curr_listing.lat_lon for curr_listing in listings], [self.commutes.lat_lon])
+        for curr_listing, crow_distance in zip(listings, distances[:, 0].round(1).tolist()):
+            curr_listing.crow_distance = crow_distance
 
-    def delete_old_listings(self) -> None:
-        """Deletes removed listings from craigslist search."""
+    def process_listing(self, curr_listing_idx: int, curr_listing: Listing) -> Listing | None:
+        """Fetches all the data for a single listing, except its crow distance and travel time. Safe to call from a
+        worker thread.
 
-        old_listings = self.pids - self.current_run_pids
-        preserved_listings = self.current_run_pids.intersection(self.pids)
-        if not old_listings:
-            print("No removed listings to be deleted")
-        else:
-            print("Listings to be deleted:\n", old_listings)
-            print(f"df size before removing old pids: {len(self.df)}")
-            self.df = self.df[~self.df.PID.isin(old_listings)]
-            print(f"new df size after removing old pids: {len(self.df)}")
-            print(self.df.to_string())
-            print(f"preserved listings: {preserved_listings}")
+        Args:
+            curr_listing_idx: One-indexed position of the listing on the search page
+            curr_listing: Partially parsed Listing
 
-    def drop_listings(self) -> None:
-        """Drops listings below a specified threshold to filter fake listings."""
-        print(
-            "listings to be dropped because of price:",
-            self.df[(self.df["PRICE ($)"] <= self.min_rent_cutoff)].to_string(),
-        )
-        self.df = self.df[~(self.df["PRICE ($)"] <= self.min_rent_cutoff)]
-
-    # Sort according to buckets
-    def sort_df(self):
-        """Sorts data according to parameters."""
-        minute = 60
-        # Create bins to store listings by commute time in buckets
-        # bins = [0,20], (20,30], (30,45], (45, 60]
-        bins = [
-            datetime.timedelta(0, 0 * minute),
-            datetime.timedelta(0, 20 * minute),
-            datetime.timedelta(0, 30 * minute),
-            datetime.timedelta(0, 45 * minute),
-            datetime.timedelta(0, 60 * minute),
-        ]
-        # Journey length labels
-        labels = ["Short", "Medium", "Long", "Very Long"]
-
-        # Create new column called "Cat" to store the category of journey length
-        self.df["Cat"] = pd.cut(self.df["TRAVEL TIME"], bins=bins, labels=labels)
-        # Sort by commute time bucket, then recency of listing. Putting more recent listings near the top means
-        # you are more likely to get a response. If you want to sort by price, the column name is "PRICE ($)"
-        self.df = self.df.sort_values(by=["Cat", "POSTED"], ascending=True)
+        Returns: the Listing, or None if it could not be processed
+        """
 
-    def write_to_csv(self) -> None:
-        """Saves dataframe results to a csv."""
-        # Save all columns except the Cat column to csv
-        self.df.loc[:, self.df.columns != "Cat"].to_csv(
-            os.path.join(json_folder, self.search_name + ".csv"), mode="w+"
-        )
+        # If listing cannot be processed for some reason, print and skip. Else, add it to csv
+        try:
+            self.log.debug("Processing listing %d - %d", curr_listing_idx, curr_listing.pid,
+                           extra={"pid": curr_listing.pid})
+            curr_listing.generate_listing_data(route=False)
+        except Exception as e:
+            self.log.warning("Could not get data for listing number %d - %s: %s", curr_listing_idx, curr_listing.url,
+                             e, extra={"pid": curr_listing.pid})
+            return None
+        return curr_listing
 
-    def save_to_html(self) -> None:
-        """Saves df to HTML file. Also makes it look better."""
-        self.make_df_pretty()
-        html_path = os.path.join(json_folder, self.search_name + ".html")
-        with open(html_path, "w+") as html_file:
-            self.df = self.df.drop(columns=["PID"])
-            print(html_path)
-
-            # Write to HTML
-            html_file.write(
-                self.df.to_html(escape=False, index=False)
-                .replace("<td>", "<td align='center'>")
-                .replace("<th>", "<th align='center'>")
-            )  # escape=False is needed to render HTML links
-
-    def make_clickable(self, url: str) -> str:
-        """Converts url to an HTML hyperlink for the HTML file.
+    def make_search_url(self, lat: float, lon: float, radius, offset: int = 0) -> str:
+        """Builds the URL of a results page.
 
         Args:
-            url (string): Raw url.
+            lat: Latitude of search circle
+            lon: Longitude of search circle
+            radius: Radius of search circle
+            offset: Number of results to skip, for pages after the first
 
-        Returns:
-            str: HTML hyperlink element
+        Returns: URL of the results page
         """
-        return '<a href="{}" rel="noopener noreferrer" target="_blank">{}</a>'.format(
-            url, "URL"
-        )
+        url = (f"{self.craigslist_host}/search/san-francisco-ca/{self.search_type}?lat={lat}"
+               f"&lon={lon}&max_price={self.max_rent}&search_distance={radius}"
+               f"&max_bedrooms={self.bedrooms}")
+        if offset:
+            url += f"&s={offset}"
+        return url
+
+    def make_tiles(self) -> list:
+        """Splits the search circle into overlapping circles of tile_radius. Centers are on a hexagonal grid with
+        spacing tile_radius * sqrt(3), so the circles cover the whole search circle.
+
+        Returns: list of (lat, lon, radius) tuples. Just the search circle if tiling is off.
+        """
+        radius = float(self.search_radius)
+        if not self.tile_radius or float(self.tile_radius) >= radius:
+            return [(self.search_lat, self.search_lon, self.search_radius)]
+
+        tile_radius = float(self.tile_radius)
+        spacing = tile_radius * math.sqrt(3)
+        row_spacing = spacing * math.sqrt(3) / 2
+        miles_per_lat_degree = 69.0
+        miles_per_lon_degree = 69.0 * math.cos(math.radians(self.search_lat))
+        tiles = []
+        max_rows = math.ceil((radius + tile_radius) / row_spacing)
+        max_cols = math.ceil((radius + tile_radius) / spacing) + 1
+        for row in range(-max_rows, max_rows + 1):
+            y = row * row_spacing
+            # Every other row is shifted by half a spacing
+            x_shift = spacing / 2 if row % 2 else 0.0
+            for col in range(-max_cols, max_cols + 1):
+                x = col * spacing + x_shift
+                # Keep circles that overlap the search circle
+                if math.hypot(x, y) < radius + tile_radius:
+                    tiles.append((round(self.search_lat + y / miles_per_lat_degree, 6),
+                                  round(self.search_lon + x / miles_per_lon_degree, 6),
+                                  tile_radius))
+        return tiles
+
+    def fetch_search_page(self, url: str) -> tuple:
+        """Gets a results page and finds its listings. Safe to call from a worker thread.
 
-    def make_HMS(self, travel_time: datetime.timedelta) -> str:
-        """Converts timedelta object into HH:MM:SS format.
+        Args:
+            url: URL of the results page
+
+        Returns: (list of bs4 Tag objects representing Listing HTML, list of embedded JSON for each listing)
+        """
+        with self.metrics.time("search_page_fetch"):
+            source = self.session.get(url, use_cache=True)
+            # An error page has no listings, and would end the walk as if every listing after it had been removed
+            source.raise_for_status()
+        with self.metrics.time("search_page_parse"):
+            soup = make_soup(source.text, self.html_parser,
+                             parse_only=search_page_strainer if self.partial_parsing else None)
+            listing_raw_list = soup.find_all("li")
+
+            if (listing_raw_list and listing_raw_list[0].div is not None
+                    and listing_raw_list[0].div.text == "see also"):
+                del listing_raw_list[0]
+            return listing_raw_list, self.get_search_page_items(soup)
+
+    def iter_search_pages(self):
+        """Walks every results page of every tile, at most max_pages per tile. Tiles are fetched in parallel, and
+        pages are yielded as they arrive so only a few are held in memory at once. A tile's next page is requested
+        once its current page arrives, and the walk stops when a page has no listings that tile has not seen yet.
+        If a page cannot be fetched, or a tile's last page allowed by max_pages still had new listings, that tile's
+        walk stops there and walk_complete is set to False.
+
+        Yields: (list of bs4 Tag objects representing Listing HTML, list of embedded JSON for each listing)
+        """
+        first_page_urls = set()
+        self.walk_complete = True
+        self.pages_failed = 0
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            pending = {}
+            for tile in self.make_tiles():
+                # (tile, offset, page number, urls of listings seen in this tile)
+                pending[executor.submit(self.fetch_search_page, self.make_search_url(*tile))] = (tile, 0, 1, set())
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    tile, offset, page_number, tile_urls = pending.pop(future)
+                    try:
+                        listing_raw_list, search_page_items = future.result()
+                    except Exception as e:
+                        self.log.warning("Could not get results page %d of search circle %s: %s", page_number,
+                                         tile, e)
+                        self.walk_complete = False
+                        self.pages_failed += 1
+                        continue
+
+                    page_urls = self.get_listing_urls(listing_raw_list)
+                    if page_number == 1:
+                        first_page_urls |= page_urls
+                    if not page_urls - tile_urls:
+                        continue
+                    tile_urls |= page_urls
+                    self.log.info("%d listings found on page %d of search circle %s", len(listing_raw_list),
+                                  page_number, tile)
+
+                    if page_number < self.max_pages:
+                        offset += len(listing_raw_list)
+                        next_url = self.make_search_url(*tile, offset=offset)
+                        pending[executor.submit(self.fetch_search_page, next_url)] = (
+                            tile, offset, page_number + 1, tile_urls
+                        )
+                    else:
+                        self.log.warning("Search circle %s has more results than max_pages (%d) pages", tile,
+                                         self.max_pages)
+                        self.walk_complete = False
+                    yield listing_raw_list, search_page_items
+        self.first_page_urls = first_page_urls
+
+    def get_listing_urls(self, listing_raw_list: list) -> set:
+        """Gets the urls of the listings on a results page.
 
         Args:
-            travel_time (datetime.timedelta): timedelta object representing travel time to USF.
+            listing_raw_list: List of bs4 Tag objects representing Listing HTML
+
+        Returns: set of listing urls
+        """
+        return {listing_raw.find("a").get("href") for listing_raw in listing_raw_list
+                if listing_raw.find("a") is not None}
+
+    def first_page_changed(self) -> bool:
+        """Fetches only the first results page of each tile and compares its listings with the last walk. Results are
+        sorted newest first, so a new listing shows up on the first page.
+
+        Returns: True if the first pages have listings that were not there in the last walk, or lost some
+        """
+        with ThreadPoolExecutor(max_workers=self.max_concurrency) as executor:
+            first_pages = executor.map(self.fetch_search_page,
+                                       [self.make_search_url(*tile) for tile in self.make_tiles()])
+            first_page_urls = set()
+            for listing_raw_list, _ in first_pages:
+                first_page_urls |= self.get_listing_urls(listing_raw_list)
+        return first_page_urls != self.first_page_urls
+
+    def get_listings(self) -> int:
+        """Scrapes data from the results pages and gets information for each listing.
+        - walks the results pages of the search (or of each tile) as they arrive
+        - finds all the list items and grabs their HTML <li> tag
+        - removes non-listing list items
+        - Calls get_listing_info() on linking HTML to get info about listings, page by page
+        New listings are kept in the typed columns of new_listings, and only added to df by add_new_listings.
 
-        Returns:
-            str: readable string of travel time.
+        Returns: -1 if no listings, +1 if yes listings
         """
-        travel_time = str(travel_time).split()[-1].split(".")[0]
-        return travel_time
+        self.new_listings = ListingColumns(self.columns)
+        listings_found = 0
+        for listing_raw_list, search_page_items in self.iter_search_pages():
+            listings_found += len(listing_raw_list)
+            self.get_listing_info(listing_raw_list, search_page_items)
+
+        if listings_found > 0:
+            self.log.info("%d listings found, %d unique", listings_found, len(self.current_run_pids))
+        else:
+            self.log.warning("No listings found")
+            return -1
+        return 1
+
+    def add_new_listings(self) -> None:
+        """Adds the listings finished during this run to df, in a single concat."""
+        if not len(self.new_listings):
+            return
+        new_listings_df = self.new_listings.to_df()
+        self.new_listings = ListingColumns(self.columns)
+        self.log.debug("df size before adding new listings: %d", len(self.df))
+        self.df = pd.concat([self.df, new_listings_df]) if not self.df.empty else new_listings_df
+        self.log.debug("df size after adding new listings: %d", len(self.df))
 
-    def format_posted(self, posted: datetime.timedelta) -> str:
-        """Converts timedelta object to a string based on how long ago a posting was listed.
+    def get_search_page_items(self, soup: BeautifulSoup) -> list:
+        """Gets the per-listing JSON Craigslist embeds in the search page. Its items are in the same order as the
+        listings and can carry lat/lon.
 
         Args:
-            posted (datetime.timedelta): object representing time ago a listing was posted.
+            soup: soup of the search page
 
-        Returns:
-            str: readable format of above.
+        Returns: list of dicts, empty if the search page has no embedded JSON
         """
-        days = posted.days
-        hours = posted.seconds // 60 ** 2
-        return f"{days} days, {hours} hours ago"
+        script = soup.find("script", id="ld_searchpage_results")
+        if script is None:
+            return []
+        try:
+            item_list = json.loads(script.string)["itemListElement"]
+            return [list_item.get("item", {}) for list_item in item_list]
+        except (TypeError, KeyError, ValueError) as e:
+            self.log.warning("Could not parse search page JSON: %s", e)
+            return []
 
-    def make_df_pretty(self):
-        """Formats df data to make it more readable and when saving to an HTML file."""
+    def delete_old_listings(self) -> None:
+        """Deletes removed listings from craigslist search. Skipped if the walk was incomplete, since listings on the
+        pages that were not fetched were not seen, but may not have been removed."""
 
-        # Transform travel time format
-        self.df["TRAVEL TIME"] = self.df.apply(
-            lambda x: self.make_HMS(travel_time=x["TRAVEL TIME"]), axis=1
-        )
-        # Code to convert URL column to hyperlink, for HTML email purposes
-        self.df["LINK"] = self.df.apply(
-            lambda x: self.make_clickable(url=x["LINK"]), axis=1
-        )
-        self.df["POSTED"] = self.df.apply(
-            lambda x: self.format_posted(posted=x["POSTED"]), axis=1
-        )
+        if not self.walk_complete:
+            self.log.warning("Some results pages were not fetched; not deleting listings missing from this run")
+            return
+        old_listings = (self.pids | self.resumed_pids) - self.current_run_pids
+        preserved_listings = self.current_run_pids.intersection(self.pids | self.resumed_pids)
+        if not old_listings:
+            self.log.info("No removed listings to be deleted")
+        else:
+            self.log.info("Deleting %d removed listings", len(old_listings))
+            self.log.debug("Listings to be deleted: %s", old_listings)
+            self.log.debug("df size before removing old pids: %d", len(self.df))
+            self.df = self.df[~self.df.PID.isin(old_listings)]
+            self.log.debug("new df size after removing old pids: %d", len(self.df))
+            # Formatting the whole df is O(rows), so only do it when it is logged
+            if self.log.isEnabledFor(logging.DEBUG):
+                self.log.debug("Listings left:\n%s", self.df.to_string())
+            self.log.debug("preserved listings: %s", preserved_listings)
+
+    def drop_listings(self) -> None:
+        """Drops listings the prefilter rejects: below a specified threshold to filter fake listings, blocklisted titles,
+        or too far away."""
+        rejected = self.prefilter.rejected_rows(self.df)
+        if rejected.any():
+            self.log.info("Dropping %d listings rejected by the filters", rejected.sum())
+            if self.log.isEnabledFor(logging.DEBUG):
+                self.log.debug("Listings dropped by the filters:\n%s", self.df[rejected].to_string())
+        self.df = self.df[~rejected]
+
+    def write_to_csv(self) -> None:
+        """Saves dataframe results to storage. Only listings added or deleted during this run, and not already written
+        by sink, are written."""
+        current_pids = set(self.df["PID"])
+        deleted_pids = (self.pids | self.sunk_pids) - current_pids
+        new_rows = self.df.loc[~self.df["PID"].isin(self.pids | self.sunk_pids), self.columns]
+        self.storage.delete(deleted_pids)
+        self.storage.upsert(new_rows)
+        self.storage.flush()
+        self.spatial_index.delete(self.search_name, deleted_pids)
+        self.spatial_index.add(self.search_name, new_rows)
+        self.log.info("Stored %d new listings, deleted %d", len(new_rows) + len(self.sunk_pids & current_pids),
+                      len(deleted_pids))
+
+    def save_to_html(self) -> None:
+        """Saves the results page. The listings are sorted, filtered and formatted by the page in the browser, so only
+        their data file is rewritten, and only when it changed."""
+        if self.report.write(self.df):
+            self.log.info("Saved results to %s", self.html_path)
+        else:
+            self.log.info("Results in %s unchanged", self.html_path)
 
     def run(self) -> None:
         """Runs all the helper functions in class."""
 
-        self.load_pid_data()
-        cont = self.get_listings()
+        with self.metrics.stage("load_pid_data"):
+            self.load_pid_data()
+        self.update()
+        self.print_run_stats()
+        self.write_metrics()
+
+    def update(self) -> bool:
+        """Walks the results pages, adds new listings and deletes removed ones. Storage is only written if listings
+        were added or deleted. The results page is always saved, as listings sunk to storage by an interrupted run may
+        not be on it yet, but save_to_html only rewrites the files that changed. Can be called repeatedly on the same
+        Search, which keeps its df and pid's in memory between calls.
+
+        Returns: True if listings were added or deleted
+        """
+        self.current_run_pids = set()
+        self.sunk_pids = set()
+        self.stats_at_start = self.get_stats()
+        with self.metrics.stage("get_listings"):
+            cont = self.get_listings()
         if cont == -1:
-            print("Current search settings have no results.")
-            print("Please overwrite with new settings or wait for new listings.")
-            return
-        self.delete_old_listings()
-        self.drop_listings()
-        self.sort_df()
-        self.write_to_csv()
-        self.save_to_html()
+            self.log.warning("Current search settings have no results. Please overwrite with new settings or wait "
+                             "for new listings.")
+            return False
+        # New listings are never old or rejected by the prefilter, so only the existing ones need filtering before the
+        # new ones are added
+        with self.metrics.stage("delete_old_listings"):
+            self.delete_old_listings()
+        with self.metrics.stage("drop_listings"):
+            self.drop_listings()
+        with self.metrics.stage("add_new_listings"):
+            self.add_new_listings()
+        changed = set(self.df["PID"]) != self.pids
+        if changed:
+            with self.metrics.stage("write_to_csv"):
+                self.write_to_csv()
+        else:
+            self.log.info("No listings added or deleted; not rewriting storage")
+        with self.metrics.stage("save_to_html"):
+            self.save_to_html()
+        self.pids = set(self.df["PID"])
+        self.clear_journal()
+        return changed
+
+    def clear_journal(self) -> None:
+        """Clears the journal once this run's listings are stored or dropped, so the next run does not resume them."""
+        self.journal.clear()
+        self.resumed_pids = set()
+
+    def write_metrics(self) -> None:
+        """Writes this Search's metrics to <search_name>.metrics and <search_name>.prom, if metrics are on."""
+        self.metrics.write(os.path.join(json_folder, self.search_name + ".metrics"),
+                           os.path.join(json_folder, self.search_name + ".prom"), self.session.host_stats())
+
+    def get_stats(self) -> dict:
+        """Gets the counters of the session, HTTP cache and route cache.
+
+        Returns: dict with "connections", "retries", "http_cache" (if there is one) and "route_cache", each a dict of
+            counts like connection_stats, retry_stats and stats
+        """
+        stats = {"connections": self.session.connection_stats(), "retries": self.session.retry_stats(),
+                 "route_cache": self.route_cache.stats()}
+        if self.session.http_cache is not None:
+            stats["http_cache"] = self.session.http_cache.stats()
+        return stats
+
+    def get_run_stats(self) -> dict:
+        """Gets how much the counters of get_stats went up since the last run started. With a session or caches shared
+        with Searches running at the same time, their requests during this run are included.
+
+        Returns: dict like get_stats
+        """
+        stats = self.get_stats()
+        return {group: {key: value - self.stats_at_start[group][key] for key, value in counts.items()}
+                for group, counts in stats.items()}
+
+    def print_run_stats(self) -> None:
+        """Logs network and cache statistics for this run. The numbers are also given as extra fields, for the json
+        log format."""
+        run_stats = self.get_run_stats()
+        connection_stats = run_stats["connections"]
+        self.log.info("HTTP requests: %d, connections opened: %d, reused: %d", connection_stats["requests"],
+                      connection_stats["opened"], connection_stats["reused"], extra=connection_stats)
+        retry_stats = run_stats["retries"]
+        self.log.info("HTTP retries: %d, failed after retrying: %d, rate limited (429): %d, delayed by rate limit: %d "
+                      "(%.1fs)", retry_stats["retries"], retry_stats["failures"], retry_stats["throttled"],
+                      retry_stats["delayed"], retry_stats["delayed_seconds"], extra=retry_stats)
+        if "http_cache" in run_stats:
+            http_cache_stats = run_stats["http_cache"]
+            self.log.info("HTTP cache hits: %d, not modified: %d, misses: %d", http_cache_stats["hits"],
+                          http_cache_stats["revalidated"], http_cache_stats["misses"],
+                          extra={"http_cache": http_cache_stats})
+        route_cache_stats = run_stats["route_cache"]
+        self.log.info("Route cache hits: %d, misses: %d", route_cache_stats["hits"], route_cache_stats["misses"],
+                      extra={"route_cache": route_cache_stats})
+        self.log.info("Listing page requests avoided using search page data: %d", self.listing_page_fetches_avoided)
+        self.log.info("Listings reused from other searches: %d", self.listings_reused)
+        self.log.info("Listing fetches avoided by filter: %s",
+                      ", ".join(f"{rule_name} {count}" for rule_name, count in self.prefilter.fetches_avoided.items()),
+                      extra={"fetches_avoided": self.prefilter.fetches_avoided})
+        self.log.info("Listings dropped by filter after fetching: %s",
+                      ", ".join(f"{rule_name} {count}"
+                                for rule_name, count in self.prefilter.dropped_after_fetch.items()),
+                      extra={"dropped_after_fetch": self.prefilter.dropped_after_fetch})
@@ -0,0 +1,46 @@
+import threading
+
+from consts import HTTP_CACHE_MODE, HTTP_TIMEOUT
+from HTTPSession import HTTPSession
+from RateLimiter import RateLimiter
+from Search import Search
+
+
+class SharedSessions:
+    def __init__(self, max_concurrency: int):
+        """
+        HTTP sessions for Searches run together. Searches with the same "http_cache" and "http_timeout" settings share
+        one session, and so one connection pool per host, so each Search still gets the cache mode and timeouts it is
+        set up with. Every session shares one rate limiter and one limit on requests in flight.
+        Args:
+            max_concurrency: max number of requests in flight at the same time, across all Searches
+        """
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = RateLimiter()
+        self.in_flight = threading.BoundedSemaphore(max_concurrency)
+        self.sessions = {}  # (http_cache, http_timeout) -> HTTPSession
+        self._lock = threading.Lock()
+
+    def get(self, data_dict: dict) -> HTTPSession:
+        """
+        Gets the session for a Search, creating it if no Search with the same settings asked for one yet.
+        Args:
+            data_dict: settings of the Search
+
+        Returns: HTTPSession to pass to the Search
+        """
+        http_cache_mode = data_dict.get("http_cache", HTTP_CACHE_MODE)
+        timeout = tuple(data_dict.get("http_timeout", HTTP_TIMEOUT))
+        with self._lock:
+            if (http_cache_mode, timeout) not in self.sessions:
+                self.sessions[http_cache_mode, timeout] = HTTPSession(
+                    pool_size=self.max_concurrency, timeout=timeout, rate_limiter=self.rate_limiter,
+                    in_flight=self.in_flight, http_cache=Search.make_http_cache(http_cache_mode)
+                )
+            return self.sessions[http_cache_mode, timeout]
+
+    def close(self) -> None:
+        """Closes every session."""
+        with self._lock:
+            for session in self.sessions.values():
+                session.close()
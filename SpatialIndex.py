@@ -0,0 +1,160 @@
+import math, sqlite3, threading
+
+import numpy as np
+import pandas as pd
+from consts import NEAREST_LISTINGS, SPATIAL_INDEX_CELL_SIZE
+from Geo import EARTH_RADIUS_MILES, MILES_PER_DEGREE, haversine_miles
+
+result_cols = ["SEARCH", "PID", "LAT", "LON", "LINK", "DISTANCE (mi)"]
+
+
+class SpatialIndex:
+    def __init__(self, path: str, cell_size: float = SPATIAL_INDEX_CELL_SIZE):
+        """
+        Grid index over the stored listings of every Search, in a SQLite file. Each listing is filed under the grid
+        cell of cell_size degrees its lat/lon falls in, so a query only reads the listings in the cells around the
+        query point instead of every Search's storage. Searches add and delete their listings as they run.
+        Args:
+            path: path of the SQLite file. Created if it does not exist.
+            cell_size: size of a grid cell in degrees of latitude and longitude
+        """
+        self.cell_size = cell_size
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS listings ("
+                "search_name TEXT, pid INTEGER, lat REAL, lon REAL, link TEXT, cell_y INTEGER, cell_x INTEGER, "
+                "PRIMARY KEY (search_name, pid))"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS listings_cell ON listings (cell_y, cell_x)")
+            # Cells depend on the cell size, so an index built with another one is rebuilt from scratch
+            self.conn.execute("CREATE TABLE IF NOT EXISTS settings (cell_size REAL)")
+            stored_cell_size = self.conn.execute("SELECT cell_size FROM settings").fetchone()
+            if stored_cell_size is None or stored_cell_size[0] != cell_size:
+                self.conn.execute("DELETE FROM listings")
+                self.conn.execute("DELETE FROM settings")
+                self.conn.execute("INSERT INTO settings VALUES (?)", (cell_size,))
+
+    def get_cell(self, lat: float, lon: float) -> tuple:
+        """Gets the (row, column) of the grid cell a point falls in."""
+        return math.floor(lat / self.cell_size), math.floor(lon / self.cell_size)
+
+    def add(self, search_name: str, rows: pd.DataFrame) -> None:
+        """
+        Adds or moves listings of a Search. Listings without lat/lon are skipped.
+        Args:
+            search_name: name of the Search the listings are stored under
+            rows: df of listings with PID, LAT, LON and LINK columns
+        """
+        rows = rows[rows["LAT"].notna() & rows["LON"].notna()]
+        if rows.empty:
+            return
+        values = [
+            (search_name, int(pid), float(lat), float(lon), link, *self.get_cell(lat, lon))
+            for pid, lat, lon, link in zip(rows["PID"], rows["LAT"], rows["LON"], rows["LINK"])
+        ]
+        with self._lock, self.conn:
+            self.conn.executemany("INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?, ?, ?)", values)
+
+    def delete(self, search_name: str, pids: set) -> None:
+        """
+        Deletes listings of a Search.
+        Args:
+            search_name: name of the Search the listings are stored under
+            pids: PIDs of listings to delete
+        """
+        if not pids:
+            return
+        with self._lock, self.conn:
+            self.conn.executemany("DELETE FROM listings WHERE search_name = ? AND pid = ?",
+                                  [(search_name, int(pid)) for pid in pids])
+
+    def sync(self, search_name: str, df: pd.DataFrame) -> None:
+        """
+        Makes the listings indexed for a Search match its stored listings, if they got out of step, e.g. for listings
+        stored before the Search was indexed. Only rewrites the Search's entries when their count differs.
+        Args:
+            search_name: name of the Search
+            df: all stored listings of the Search
+        """
+        located = df[df["LAT"].notna() & df["LON"].notna()]
+        if self.count([search_name]) == len(located):
+            return
+        with self._lock, self.conn:
+            self.conn.execute("DELETE FROM listings WHERE search_name = ?", (search_name,))
+        self.add(search_name, located)
+
+    def count(self, search_names: list = None) -> int:
+        """
+        Counts indexed listings.
+        Args:
+            search_names: only count listings of these Searches. Defaults to all of them.
+
+        Returns: number of indexed listings
+        """
+        query, params = "SELECT COUNT(*) FROM listings", []
+        if search_names:
+            query += f" WHERE search_name IN ({', '.join('?' * len(search_names))})"
+            params = list(search_names)
+        with self._lock:
+            return self.conn.execute(query, params).fetchone()[0]
+
+    def within(self, lat_lon: tuple, radius: float, search_names: list = None) -> pd.DataFrame:
+        """
+        Finds the listings within a radius of a point. Reads the cells of the box around the circle, then keeps the
+        listings inside the circle. The box does not wrap around the antimeridian.
+        Args:
+            lat_lon: (lat, lon) of the point
+            radius: radius in miles
+            search_names: only find listings of these Searches. Defaults to all of them.
+
+        Returns: df of result_cols, closest first
+        """
+        lat, lon = lat_lon
+        lat_span = radius / MILES_PER_DEGREE
+        min_lat, max_lat = max(lat - lat_span, -90.0), min(lat + lat_span, 90.0)
+        # Degrees of longitude get shorter away from the equator, so use the box edge closest to a pole
+        cos_lat = math.cos(math.radians(max(abs(min_lat), abs(max_lat))))
+        lon_span = radius / (MILES_PER_DEGREE * cos_lat) if cos_lat > 1e-9 else 360.0
+        min_lon, max_lon = max(lon - lon_span, -180.0), min(lon + lon_span, 180.0)
+        min_cell_y, min_cell_x = self.get_cell(min_lat, min_lon)
+        max_cell_y, max_cell_x = self.get_cell(max_lat, max_lon)
+
+        query = ("SELECT search_name, pid, lat, lon, link FROM listings "
+                 "WHERE cell_y BETWEEN ? AND ? AND cell_x BETWEEN ? AND ?")
+        params = [min_cell_y, max_cell_y, min_cell_x, max_cell_x]
+        if search_names:
+            query += f" AND search_name IN ({', '.join('?' * len(search_names))})"
+            params += list(search_names)
+        with self._lock:
+            rows = self.conn.execute(query, params).fetchall()
+
+        df = pd.DataFrame(rows, columns=result_cols[:-1])
+        df[result_cols[-1]] = haversine_miles(df[["LAT", "LON"]].to_numpy(), [lat_lon])[:, 0] if rows else []
+        df = df[df[result_cols[-1]] <= radius]
+        return df.sort_values(result_cols[-1], kind="stable").reset_index(drop=True)
+
+    def nearest(self, lat_lon: tuple, k: int = NEAREST_LISTINGS, search_names: list = None) -> pd.DataFrame:
+        """
+        Finds the k listings closest to a point. Searches a radius of one cell, and doubles it until it holds k
+        listings. Every listing closer than the k-th one is then inside the radius too.
+        Args:
+            lat_lon: (lat, lon) of the point
+            k: number of listings to find
+            search_names: only find listings of these Searches. Defaults to all of them.
+
+        Returns: df of result_cols, closest first
+        """
+        total = self.count(search_names)
+        radius = self.cell_size * MILES_PER_DEGREE
+        while True:
+            found = self.within(lat_lon, radius, search_names)
+            # Half the Earth's circumference covers every point
+            if len(found) >= min(k, total) or radius >= np.pi * EARTH_RADIUS_MILES:
+                return found.head(k)
+            radius *= 2
+
+    def close(self) -> None:
+        """Closes the SQLite file."""
+        self.conn.close()
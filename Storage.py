@@ -0,0 +1,301 @@
+import json, os, re, sqlite3
+
+import pandas as pd
+from Commutes import is_travel_time_col
+from consts import STORAGE_BACKEND, cols, json_folder
+from Logger import get_logger
+
+logger = get_logger(__name__)
+
+# Column name in the df -> (column name in SQLite, SQLite type). Timedeltas are stored as integer nanoseconds so
+# they load straight back into timedelta64[ns] columns.
+sqlite_cols = {
+    "PID": ("pid", "INTEGER PRIMARY KEY"),
+    "TITLE": ("title", "TEXT"),
+    "PRICE ($)": ("price", "INTEGER"),
+    "TRAVEL TIME": ("travel_time_ns", "INTEGER"),
+    "LINK": ("link", "TEXT"),
+    "LOCATION": ("location", "TEXT"),
+    "CROW_DISTANCE": ("crow_distance", "REAL"),
+    "POSTED": ("posted_ns", "INTEGER"),
+    "LAT": ("lat", "REAL"),
+    "LON": ("lon", "REAL"),
+}
+timedelta_cols = ["TRAVEL TIME", "POSTED"]
+
+
+def get_sqlite_col(col: str) -> tuple:
+    """
+    Gets the name and type a df column is stored as in SQLite. Travel time columns of searches with several commutes
+    or modes are stored like TRAVEL TIME.
+    Args:
+        col: column name in the df
+
+    Returns: (column name in SQLite, SQLite type)
+    """
+    if col in sqlite_cols:
+        return sqlite_cols[col]
+    return "travel_time_ns_" + re.sub(r"\W+", "_", col[len("TRAVEL TIME ("):-1]).strip("_").lower(), "INTEGER"
+
+
+def get_timedelta_cols(columns: list) -> list:
+    """Gets the columns holding timedeltas."""
+    return [col for col in columns if col in timedelta_cols or is_travel_time_col(col)]
+
+
+class CSVStorage:
+    # Flushing rewrites the whole file, so it should only happen once per run
+    incremental = False
+
+    def __init__(self, search_name: str, folder: str = json_folder, columns: list = cols):
+        """
+        Stores a Search's listings in <search_name>.csv. Every flush rewrites the whole file.
+        Args:
+            search_name: Name of search
+            folder: Directory to store the file in
+            columns: columns to store, cols plus any extra travel time columns
+        """
+        self.path = os.path.join(folder, search_name + ".csv")
+        self.columns = columns
+        self.df = pd.DataFrame(columns=columns)
+
+    def exists(self) -> bool:
+        """Checks if this search has stored listings."""
+        return os.path.exists(self.path)
+
+    def load(self) -> pd.DataFrame:
+        """
+        Loads stored listings.
+        Returns: df of listings, with timedelta columns parsed
+        """
+        if not self.exists():
+            return pd.DataFrame(columns=self.columns)
+        # Columns of commutes added since the csv was written are left empty
+        self.df = pd.read_csv(self.path, index_col=0).reindex(columns=self.columns)
+
+        # Convert travel time and posted columns to timedelta objects
+        for col in get_timedelta_cols(self.columns):
+            self.df[col] = pd.to_timedelta(self.df[col])
+        return self.df.copy()
+
+    def upsert(self, rows: pd.DataFrame) -> None:
+        """
+        Adds or replaces listings, matched on PID.
+        Args:
+            rows: df of listings to store
+        """
+        if rows.empty:
+            return
+        if self.df.empty:
+            self.df = rows.loc[:, self.columns].copy()
+            return
+        self.df = pd.concat([self.df[~self.df["PID"].isin(rows["PID"])], rows.loc[:, self.columns]])
+
+    def delete(self, pids: set) -> None:
+        """
+        Deletes listings.
+        Args:
+            pids: PIDs of listings to delete
+        """
+        if pids:
+            self.df = self.df[~self.df["PID"].isin(pids)]
+
+    def flush(self) -> None:
+        """Writes all listings to the csv."""
+        self.df.loc[:, self.columns].to_csv(self.path, mode="w+")
+
+    def close(self) -> None:
+        """Nothing to close for a csv."""
+
+
+class SQLiteStorage:
+    # Flushing only commits the rows changed since the last flush, so it can happen after every results page
+    incremental = True
+
+    def __init__(self, search_name: str, folder: str = json_folder, columns: list = cols):
+        """
+        Stores a Search's listings in a typed SQLite table keyed on PID, in <search_name>.sqlite. Listings are
+        upserted and deleted one by one instead of rewriting everything. If the search has a .csv from the csv
+        backend and no SQLite file yet, the csv is imported once and renamed to <search_name>.csv.migrated.
+        Args:
+            search_name: Name of search
+            folder: Directory to store the file in
+            columns: columns to store, cols plus any extra travel time columns
+        """
+        self.path = os.path.join(folder, search_name + ".sqlite")
+        self.columns = columns
+        csv_storage = CSVStorage(search_name, folder, columns)
+        needs_migration = not os.path.exists(self.path) and csv_storage.exists()
+
+        # A Search can be created in one thread and run in another (run.py --daemon), but only one thread uses it
+        # at a time
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS listings ("
+                + ", ".join(f"{name} {sql_type}" for name, sql_type in sqlite_cols.values()) + ")"
+            )
+            # Add columns for commutes added since the table was created
+            existing_names = {row[1] for row in self.conn.execute("PRAGMA table_info(listings)")}
+            for col in columns:
+                name, sql_type = get_sqlite_col(col)
+                if name not in existing_names:
+                    self.conn.execute(f"ALTER TABLE listings ADD COLUMN {name} {sql_type}")
+        if needs_migration:
+            self.migrate_csv(csv_storage)
+
+    def migrate_csv(self, csv_storage: CSVStorage) -> None:
+        """
+        Imports listings stored by the csv backend, then renames the csv so it is not imported again.
+        Args:
+            csv_storage: CSVStorage of the same search
+        """
+        df = csv_storage.load()
+        self.upsert(df)
+        self.flush()
+        os.rename(csv_storage.path, csv_storage.path + ".migrated")
+        logger.info("Migrated %d listings from %s to %s", len(df), csv_storage.path, self.path)
+
+    def exists(self) -> bool:
+        """Checks if this search has stored listings."""
+        return self.conn.execute("SELECT EXISTS (SELECT 1 FROM listings)").fetchone()[0] == 1
+
+    def load(self) -> pd.DataFrame:
+        """
+        Loads stored listings.
+        Returns: df of listings
+        """
+        df = pd.read_sql_query(
+            "SELECT " + ", ".join(get_sqlite_col(col)[0] for col in self.columns) + " FROM listings", self.conn
+        )
+        df.columns = self.columns
+        for col in get_timedelta_cols(self.columns):
+            df[col] = pd.to_timedelta(df[col], unit="ns")
+        return df
+
+    def upsert(self, rows: pd.DataFrame) -> None:
+        """
+        Adds or replaces listings, matched on PID.
+        Args:
+            rows: df of listings to store
+        """
+        if rows.empty:
+            return
+        values = []
+        timedelta_columns = get_timedelta_cols(self.columns)
+        for col in self.columns:
+            if col in timedelta_columns:
+                # NaT (a travel time column added after the row was stored) is stored as NULL
+                col_values = pd.to_timedelta(rows[col])
+                nanoseconds = pd.Series(col_values.to_numpy().view("int64"), index=col_values.index)
+                values.append(nanoseconds.astype(object).where(col_values.notna(), None).tolist())
+            else:
+                values.append(rows[col].tolist())
+        names = ", ".join(get_sqlite_col(col)[0] for col in self.columns)
+        self.conn.executemany(
+            f"INSERT OR REPLACE INTO listings ({names}) VALUES ({', '.join('?' * len(self.columns))})", zip(*values)
+        )
+
+    def delete(self, pids: set) -> None:
+        """
+        Deletes listings.
+        Args:
+            pids: PIDs of listings to delete
+        """
+        self.conn.executemany("DELETE FROM listings WHERE pid = ?", [(int(pid),) for pid in pids])
+
+    def flush(self) -> None:
+        """Commits pending changes."""
+        self.conn.commit()
+
+    def close(self) -> None:
+        """Commits pending changes and closes the SQLite file."""
+        self.conn.commit()
+        self.conn.close()
+
+
+class ListingJournal:
+    def __init__(self, search_name: str, folder: str = json_folder, columns: list = cols):
+        """
+        Append-only journal of listings finished during a run, in <search_name>.journal with one JSON row per line.
+        Rows are appended as soon as they are routed, so an interrupted run can pick them up instead of fetching and
+        routing them again. It is cleared once the run has written its results to storage.
+        Args:
+            search_name: Name of search
+            folder: Directory to store the file in
+            columns: columns of each row, cols plus any extra travel time columns
+        """
+        self.path = os.path.join(folder, search_name + ".journal")
+        self.columns = columns
+        self.file = None
+
+    def load(self) -> pd.DataFrame:
+        """
+        Loads the listings journaled by an interrupted run. A last line cut off by the interruption is skipped.
+        Returns: df of journaled listings, empty if there is no journal
+        """
+        rows = []
+        if os.path.exists(self.path):
+            with open(self.path) as journal_file:
+                for line in journal_file:
+                    try:
+                        rows.append(json.loads(line))
+                    except ValueError:
+                        continue
+        df = pd.DataFrame(rows, columns=self.columns)
+        for col in get_timedelta_cols(self.columns):
+            df[col] = pd.to_timedelta(df[col], unit="s")
+        # A listing can be journaled twice if a run was interrupted between journaling and clearing
+        return df.drop_duplicates(subset="PID", keep="last")
+
+    def append(self, rows: pd.DataFrame) -> None:
+        """
+        Appends finished listings and syncs them to disk.
+        Args:
+            rows: df of listings
+        """
+        if rows.empty:
+            return
+        if self.file is None:
+            self.file = open(self.path, "a")
+        rows = rows[self.columns].copy()
+        for col in get_timedelta_cols(self.columns):
+            rows[col] = rows[col].dt.total_seconds()
+        for record in rows.to_dict(orient="records"):
+            self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def clear(self) -> None:
+        """Deletes the journal, once its listings are in storage."""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def close(self) -> None:
+        """Closes the journal file."""
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+storage_backends = {
+    "csv": CSVStorage,
+    "sqlite": SQLiteStorage,
+}
+
+
+def make_storage(search_name: str, backend: str = STORAGE_BACKEND, folder: str = json_folder, columns: list = cols):
+    """
+    Creates the storage backend for a search.
+    Args:
+        search_name: Name of search
+        backend: "csv" or "sqlite"
+        folder: Directory to store files in
+        columns: columns to store, cols plus any extra travel time columns
+
+    Returns: CSVStorage or SQLiteStorage
+    """
+    if backend not in storage_backends:
+        raise ValueError(f"Storage backend must be one of {list(storage_backends)}")
+    return storage_backends[backend](search_name, folder, columns)
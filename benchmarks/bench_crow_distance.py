@@ -0,0 +1,75 @@
+"""Times the vectorized haversine crow distance against one geopy geodesic per listing, and measures its error.
+
+geopy is only needed for the comparison: pip install geopy
+Run from the repo root: python benchmarks/bench_crow_distance.py [points ...]
+"""
+import os, sys, time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from consts import COMMUTE_LAT_LON  # noqa: E402
+from Geo import haversine_miles  # noqa: E402
+
+# geopy is slow, so it is timed on at most this many points and its time per point is scaled up
+GEOPY_SAMPLE = 20_000
+# A second and third reference point, to time several commutes at once
+EXTRA_REFERENCES = [(37.7946, -122.3999), (37.8716, -122.2727)]
+
+
+def make_points(points: int, seed: int = 0) -> np.ndarray:
+    """
+    Makes random listing coordinates in a box around the Bay Area, up to about 45 miles from COMMUTE_LAT_LON.
+    Args:
+        points: number of points
+        seed: random seed
+
+    Returns: array of (lat, lon), shape (points, 2)
+    """
+    rng = np.random.default_rng(seed)
+    return np.column_stack([rng.uniform(37.3, 38.2, points), rng.uniform(-122.9, -121.9, points)])
+
+
+def geopy_miles(lat_lons: np.ndarray, reference_lat_lon: tuple) -> np.ndarray:
+    """One geopy geodesic per point, the way Listing.get_crow_distance used to work."""
+    from geopy import distance
+    return np.array([distance.distance(tuple(lat_lon), reference_lat_lon).miles for lat_lon in lat_lons])
+
+
+if __name__ == "__main__":
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    try:
+        import geopy  # noqa: F401
+        has_geopy = True
+    except ImportError:
+        print("geopy is not installed, so only the vectorized times are shown. Try: pip install geopy")
+        has_geopy = False
+
+    print(f"{'points':>9} {'geopy (s)':>11} {'haversine (s)':>14} {'speedup':>9} {'3 refs (s)':>11} "
+          f"{'max err (mi)':>13} {'max err (%)':>12} {'0.1mi diff':>11}")
+    for points in sizes:
+        lat_lons = make_points(points)
+
+        start = time.perf_counter()
+        haversine = haversine_miles(lat_lons, [COMMUTE_LAT_LON])[:, 0]
+        haversine_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        haversine_miles(lat_lons, [COMMUTE_LAT_LON, *EXTRA_REFERENCES])
+        three_references_time = time.perf_counter() - start
+
+        if not has_geopy:
+            print(f"{points:>9} {'-':>11} {haversine_time:>14.4f} {'-':>9} {three_references_time:>11.4f}")
+            continue
+        sample = min(points, GEOPY_SAMPLE)
+        start = time.perf_counter()
+        geodesic = geopy_miles(lat_lons[:sample], COMMUTE_LAT_LON)
+        # Scaled up to every point when only a sample was timed
+        geopy_time = (time.perf_counter() - start) * points / sample
+
+        error = np.abs(haversine[:sample] - geodesic)
+        relative_error = error / np.maximum(geodesic, 1e-9) * 100
+        rounded_differ = np.mean(haversine[:sample].round(1) != geodesic.round(1)) * 100
+        print(f"{points:>9} {geopy_time:>11.2f} {haversine_time:>14.4f} {geopy_time / haversine_time:>8.0f}x "
+              f"{three_references_time:>11.4f} {error.max():>13.4f} {relative_error.max():>12.3f} "
+              f"{rounded_differ:>10.1f}%")
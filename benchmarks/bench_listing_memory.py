@@ -0,0 +1,173 @@
+"""Measures how much memory finished listings take while a Search runs.
+
+Two measurements:
+    accumulator: bytes still allocated (tracemalloc) after N finished listings are kept until the end of a run, and
+        the peak while their df is built. Listings are kept either as one list per row from Listing.get_data, the
+        way Search kept them before, or in a ListingColumns
+    search run: peak RSS of a cold Search.run against a local stand-in for Craigslist and OSRM. Each run is done in a
+        fresh child process, so its peak RSS (VmHWM) is not inflated by earlier runs. The stand-in (FixtureServer)
+        runs in the parent, so its memory is not counted either. "after setup" is the RSS of the child once everything
+        is imported and the Search is created, and "growth" is how much the run added to it. Slow: about 100
+        listings a second
+
+Linux only, as RSS is read from /proc. ru_maxrss is not used, as Linux carries it over from the parent process.
+Run from the repo root: python benchmarks/bench_listing_memory.py [--accumulator-sizes N ...] [--sizes N ...]
+    [--output FILE]
+"""
+import argparse, datetime, json, math, os, subprocess, sys, tempfile, time, tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from bench_search_run import get_commit, make_durations, read_fixture  # noqa: E402
+from consts import cols, json_folder  # noqa: E402
+from FixtureServer import FixtureServer  # noqa: E402
+from Listing import Listing, ListingColumns  # noqa: E402
+
+# When the run started, so every fake listing was posted a different, sub-second time ago, like real ones
+RUN_START = datetime.datetime(2024, 1, 1)
+
+
+def read_rss_kb(field: str = "VmRSS") -> int:
+    """
+    Gets the RSS of this process in kilobytes.
+    Args:
+        field: "VmRSS" for the current RSS, or "VmHWM" for the peak
+
+    Returns: RSS in kilobytes
+    """
+    with open("/proc/self/status") as status_file:
+        for line in status_file:
+            if line.startswith(field + ":"):
+                return int(line.split()[1])
+    return 0
+
+
+def make_listing(i: int) -> Listing:
+    """
+    Creates a finished listing without parsing or fetching anything, with the fields a routed Listing has.
+    Args:
+        i: number of the listing, to make its fields unique
+
+    Returns: Listing
+    """
+    listing = Listing.__new__(Listing)
+    listing.pid = 7_000_000_000 + i
+    listing.title = f"Sunny 2BR apartment with in-unit laundry #{i}"
+    listing.price = 2000 + i % 3000
+    listing.travel_time = datetime.timedelta(seconds=600 + i % 3600)
+    listing.url = f"https://sfbay.craigslist.org/sfc/apa/d/san-francisco-sunny-2br-apartment/{listing.pid}.html"
+    listing.location = f"neighborhood {i % 50}"
+    listing.crow_distance = round(i % 100 / 10, 1)
+    listing.posted = RUN_START - datetime.datetime(2023, 12, 1) + datetime.timedelta(microseconds=i * 7919)
+    listing.lat_lon = (37.7 + i % 1000 / 10_000, -122.4 - i % 1000 / 10_000)
+    listing.travel_times = {}
+    return listing
+
+
+def measure_accumulator(listings: int, keep_columns: bool) -> dict:
+    """
+    Keeps finished listings until the end of a run, then builds their df, under tracemalloc. Each Listing is dropped
+    once it is kept, like in Search.
+    Args:
+        listings: number of listings
+        keep_columns: keep them in a ListingColumns, instead of one list per row
+
+    Returns: dict with "retained_mb", allocated once every listing is kept, and "build_peak_mb", the peak while the
+        df is built
+    """
+    tracemalloc.start()
+    if keep_columns:
+        kept = ListingColumns(cols)
+        for i in range(listings):
+            kept.append(make_listing(i))
+    else:
+        kept = [make_listing(i).get_data() for i in range(listings)]
+    retained = tracemalloc.get_traced_memory()[0]
+    tracemalloc.reset_peak()
+    df = kept.to_df() if keep_columns else pd.DataFrame(kept, columns=cols)
+    build_peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    del df
+    return {"retained_mb": retained / 2 ** 20, "build_peak_mb": build_peak / 2 ** 20}
+
+
+def child_run(server_url: str, listings: int, page_listings: int) -> None:
+    """
+    Runs one cold Search in the working directory and prints its memory use as JSON. Run in the child process.
+    Args:
+        server_url: URL of the FixtureServer
+        listings: number of listings served
+        page_listings: number of listings on each results page
+    """
+    from Search import Search
+
+    os.makedirs(json_folder)
+    data_dict = {
+        "search_name": "bench", "search_lat": 37.76, "search_lon": -122.44, "search_radius": 3, "bedrooms": 2,
+        "max_rent": 10_000, "min_rent_cutoff": 100, "search_type": "apa", "craigslist_host": server_url,
+        "osrm_host": server_url, "max_pages": math.ceil(listings / page_listings) + 1,
+    }
+    search = Search(data_dict)
+    setup_rss = read_rss_kb()
+    start = time.perf_counter()
+    search.run()
+    seconds = time.perf_counter() - start
+    print(json.dumps({"listings": len(search.df), "setup_kb": setup_rss,
+                      "peak_kb": read_rss_kb("VmHWM"), "seconds": seconds}))
+
+
+def bench_size(listings: int) -> dict:
+    """
+    Serves a number of listings and runs a cold Search on them in a child process.
+    Args:
+        listings: number of listings served
+
+    Returns: dict with "listings" (stored by the run), "setup_kb", "peak_kb" and "seconds"
+    """
+    server = FixtureServer(search_page=read_fixture("search_page.html"),
+                           listing_page=read_fixture("listing_page.html"), listings=listings)
+    server.durations = make_durations(server, listings)
+    with server, tempfile.TemporaryDirectory() as folder:
+        child = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", server.url, str(listings),
+                                str(len(server.listing_items))], cwd=folder, capture_output=True, text=True,
+                               check=True)
+    return json.loads(child.stdout.strip().splitlines()[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures the peak RSS of Search.run offline.")
+    parser.add_argument("--accumulator-sizes", help="Numbers of listings to keep.", nargs="+", type=int,
+                        default=[20_000, 100_000])
+    parser.add_argument("--sizes", help="Numbers of listings to run a Search with.", nargs="+", type=int,
+                        default=[1000, 5000])
+    parser.add_argument("--output", help="JSON file to write results to.")
+    parser.add_argument("--child", help=argparse.SUPPRESS, nargs=3)
+    args = parser.parse_args()
+    if args.child:
+        child_run(args.child[0], int(args.child[1]), int(args.child[2]))
+        sys.exit()
+
+    accumulator_results = []
+    print(f"{'listings':>8} {'kept as':<8} {'retained (MB)':>14} {'peak building df (MB)':>22}")
+    for size in args.accumulator_sizes:
+        for keep_columns in (False, True):
+            result = measure_accumulator(size, keep_columns)
+            kept_as = "columns" if keep_columns else "rows"
+            accumulator_results.append({"size": size, "kept_as": kept_as, **result})
+            print(f"{size:>8} {kept_as:<8} {result['retained_mb']:>14.1f} {result['build_peak_mb']:>22.1f}")
+    print()
+
+    results = []
+    print(f"{'listings':>8} {'stored':>8} {'after setup (MB)':>17} {'peak (MB)':>10} {'growth (MB)':>12} "
+          f"{'time (s)':>9}")
+    for size in args.sizes:
+        result = bench_size(size)
+        results.append({"size": size, **result})
+        print(f"{size:>8} {result['listings']:>8} {result['setup_kb'] / 1024:>17.1f} "
+              f"{result['peak_kb'] / 1024:>10.1f} {(result['peak_kb'] - result['setup_kb']) / 1024:>12.1f} "
+              f"{result['seconds']:>9.2f}")
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump({"commit": get_commit(), "accumulator": accumulator_results, "search_run": results},
+                      output_file, indent=2)
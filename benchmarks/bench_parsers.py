@@ -0,0 +1,80 @@
+"""Times each HTML parser backend, with full and partial parsing, on the saved fixture pages.
+
+Run from the repo root: python benchmarks/bench_parsers.py [repeats]
+"""
+import os, sys, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from Parsing import check_parser, html_parsers, listing_page_strainer, make_soup, search_page_strainer  # noqa: E402
+
+fixtures_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def read_fixture(filename: str) -> str:
+    """
+    Reads a saved page.
+    Args:
+        filename: name of the file in the fixtures folder
+
+    Returns: page HTML
+    """
+    with open(os.path.join(fixtures_folder, filename)) as fixture_file:
+        return fixture_file.read()
+
+
+def extract_search_page(soup) -> tuple:
+    """Reads what Search.get_listings reads: the listing <li>s and the embedded JSON."""
+    listing_urls = tuple(li.find("a").get("href") for li in soup.find_all("li"))
+    script = soup.find("script", id="ld_searchpage_results")
+    return listing_urls, len(script.string)
+
+
+def extract_listing_page(soup) -> tuple:
+    """Reads what Listing.get_listing_page_info reads: lat/lon and date posted."""
+    map_element = soup.find(id="map")
+    return map_element["data-latitude"], map_element["data-longitude"], soup.find(class_="date timeago").text
+
+
+def time_parse(markup: str, html_parser: str, strainer, extract, repeats: int) -> tuple:
+    """
+    Parses a page repeatedly and reads the fields from it.
+    Args:
+        markup: page HTML
+        html_parser: parser backend
+        strainer: SoupStrainer for partial parsing, or None to build the whole tree
+        extract: function reading the needed fields from the soup
+        repeats: number of times to parse the page
+
+    Returns: (milliseconds per page, extracted fields)
+    """
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fields = extract(make_soup(markup, html_parser, parse_only=strainer))
+    return (time.perf_counter() - start) * 1000 / repeats, fields
+
+
+if __name__ == "__main__":
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    pages = [
+        ("search page", read_fixture("search_page.html"), search_page_strainer, extract_search_page),
+        ("listing page", read_fixture("listing_page.html"), listing_page_strainer, extract_listing_page),
+    ]
+
+    available_parsers = []
+    for html_parser in html_parsers:
+        try:
+            check_parser(html_parser)
+            available_parsers.append(html_parser)
+        except ValueError as e:
+            print(f"Skipping {html_parser}: {e}")
+
+    print(f"{'page':<14} {'parser':<12} {'mode':<8} {'ms/page':>9} {'same fields':>12}")
+    for page_name, markup, strainer, extract in pages:
+        reference_fields = None
+        for html_parser in available_parsers:
+            for mode, mode_strainer in (("full", None), ("partial", strainer)):
+                ms_per_page, fields = time_parse(markup, html_parser, mode_strainer, extract, repeats)
+                if reference_fields is None:
+                    reference_fields = fields
+                print(f"{page_name:<14} {html_parser:<12} {mode:<8} {ms_per_page:>9.2f} "
+                      f"{str(fields == reference_fields):>12}")
@@ -0,0 +1,197 @@
+"""Times each stage of Search.run against a local stand-in for Craigslist and OSRM, at several numbers of listings.
+
+The stand-in (FixtureServer) serves the recorded pages in benchmarks/fixtures, repeated to any number of listings, and
+canned OSRM travel times, so no network is needed. Every size is run twice in a fresh folder:
+    cold: nothing stored yet, so every listing is fetched, routed and stored
+    update: a second run where UPDATE_CHURN of the listings were removed and as many new ones were added
+Results are written as JSON, to compare across commits.
+
+Run from the repo root: python benchmarks/bench_search_run.py [--sizes N ...] [--latency S] [--output FILE]
+    [--compare OLD_FILE]
+"""
+import argparse, datetime, json, math, os, platform, subprocess, sys, tempfile, time
+
+repo_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, repo_folder)
+from consts import COMMUTE_LAT_LON, STORAGE_BACKEND, json_folder  # noqa: E402
+from FixtureServer import FixtureServer  # noqa: E402
+from Geo import haversine_miles  # noqa: E402
+from Logger import setup_logging  # noqa: E402
+from Search import Search  # noqa: E402
+
+fixtures_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# Search.run stages that are timed, in the order they run
+stages = ["load_pid_data", "get_listings", "delete_old_listings", "drop_listings", "write_to_csv", "save_to_html"]
+# Share of listings replaced between the cold and the update run
+UPDATE_CHURN = 0.1
+# Canned walking time per mile as the crow flies, so travel times spread over every commute bucket
+SECONDS_PER_MILE = 20 * 60
+
+
+def read_fixture(filename: str) -> str:
+    """
+    Reads a saved page.
+    Args:
+        filename: name of the file in the fixtures folder
+
+    Returns: page HTML
+    """
+    with open(os.path.join(fixtures_folder, filename)) as fixture_file:
+        return fixture_file.read()
+
+
+def make_durations(server: FixtureServer, listings: int) -> dict:
+    """
+    Canned OSRM travel times for every listing the server can serve, proportional to its crow distance.
+    Args:
+        server: FixtureServer serving the listings
+        listings: number of listings, including the ones added by the update run
+
+    Returns: durations keyed like FixtureServer.durations
+    """
+    lat_lons = [server.listing_lat_lon(i) for i in range(listings)]
+    miles = haversine_miles(lat_lons, [COMMUTE_LAT_LON])[:, 0]
+    return {(round(lat, 5), round(lon, 5)): float(mile * SECONDS_PER_MILE)
+            for (lat, lon), mile in zip(lat_lons, miles)}
+
+
+def timed_run(data_dict: dict) -> dict:
+    """
+    Creates and runs a Search with each stage timed.
+    Args:
+        data_dict: search settings
+
+    Returns: dict of stage -> seconds, plus "total" for all of Search.run. Stages that did not run are left out.
+    """
+    return time_stages(Search(data_dict))
+
+
+def time_stages(search: Search) -> dict:
+    """Runs a Search with each stage wrapped in a timer. See timed_run."""
+    timings = {}
+    for stage in stages:
+        def timed_stage(*args, stage=stage, method=getattr(search, stage), **kwargs):
+            start = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - start
+        setattr(search, stage, timed_stage)
+
+    start = time.perf_counter()
+    search.run()
+    timings["total"] = time.perf_counter() - start
+    return timings
+
+
+def bench_size(listings: int, latency: float, backend: str, max_concurrency: int) -> list:
+    """
+    Runs the cold and update runs of one size, in a fresh folder.
+    Args:
+        listings: number of listings served
+        latency: seconds every response from the stand-in server is delayed by
+        backend: storage backend
+        max_concurrency: max number of listings fetched at the same time
+
+    Returns: list of result dicts, one per run and stage
+    """
+    churn = math.ceil(listings * UPDATE_CHURN)
+    server = FixtureServer(search_page=read_fixture("search_page.html"),
+                           listing_page=read_fixture("listing_page.html"), listings=listings, latency=latency)
+    server.durations = make_durations(server, listings + churn)
+    results = []
+    with server, tempfile.TemporaryDirectory() as folder:
+        # Everything a Search stores goes under json_folder, relative to the working directory
+        os.chdir(folder)
+        os.makedirs(json_folder)
+        data_dict = {
+            "search_name": "bench", "search_lat": 37.76, "search_lon": -122.44, "search_radius": 3, "bedrooms": 2,
+            "max_rent": 10_000, "min_rent_cutoff": 100, "search_type": "apa", "storage_backend": backend,
+            "craigslist_host": server.url, "osrm_host": server.url, "max_concurrency": max_concurrency,
+            # One more page than needed, which comes back empty and ends the walk
+            "max_pages": math.ceil(listings / len(server.listing_items)) + 1,
+        }
+        for run_name in ("cold", "update"):
+            if run_name == "update":
+                server.pid_offset = churn
+            requests_before = dict(server.request_counts)
+            timings = timed_run(data_dict)
+            requests = {service: count - requests_before[service]
+                        for service, count in server.request_counts.items()}
+            for stage, seconds in timings.items():
+                results.append({"listings": listings, "run": run_name, "stage": stage, "seconds": round(seconds, 4),
+                                "requests": requests})
+        os.chdir(repo_folder)
+    return results
+
+
+def get_commit() -> str | None:
+    """Gets the commit the benchmark is run on, if the repo is a git checkout."""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=repo_folder, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: list, old_results: list) -> None:
+    """
+    Prints how much slower or faster each stage got since an earlier results file.
+    Args:
+        results: results of this benchmark
+        old_results: results loaded from an earlier output file
+    """
+    old_seconds = {(result["listings"], result["run"], result["stage"]): result["seconds"] for result in old_results}
+    print(f"{'listings':>8} {'run':<7} {'stage':<20} {'old (s)':>9} {'new (s)':>9} {'change':>8}")
+    for result in results:
+        key = (result["listings"], result["run"], result["stage"])
+        if key in old_seconds and old_seconds[key] > 0:
+            change = (result["seconds"] / old_seconds[key] - 1) * 100
+            print(f"{key[0]:>8} {key[1]:<7} {key[2]:<20} {old_seconds[key]:>9.4f} {result['seconds']:>9.4f} "
+                  f"{change:>+7.0f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Times each stage of Search.run offline.")
+    parser.add_argument("--sizes", help="Numbers of listings to run with.", nargs="+", type=int,
+                        default=[120, 600, 2400])
+    parser.add_argument("--latency", help="Seconds every response is delayed by.", type=float, default=0.005)
+    parser.add_argument("--backend", help="Storage backend.", choices=["sqlite", "csv"], default=STORAGE_BACKEND)
+    parser.add_argument("--max-concurrency", help="Max number of listings fetched at once.", type=int, default=8)
+    parser.add_argument("--output", help="JSON file to write results to.", default="bench_search_run.json")
+    parser.add_argument("--compare", help="Earlier JSON results file to compare with.", metavar="OLD_FILE")
+    args = parser.parse_args()
+    # Search logs several lines per listing at INFO and DEBUG
+    setup_logging(level="WARNING")
+    old_report = None
+    if args.compare:
+        with open(args.compare) as old_file:
+            old_report = json.load(old_file)
+    output = os.path.abspath(args.output)
+
+    results = []
+    print(f"{'listings':>8} {'run':<7} " + " ".join(f"{stage:>12.12}" for stage in stages) + f" {'total':>8}")
+    for size in args.sizes:
+        size_results = bench_size(size, args.latency, args.backend, args.max_concurrency)
+        results.extend(size_results)
+        for run_name in ("cold", "update"):
+            seconds = {result["stage"]: result["seconds"] for result in size_results if result["run"] == run_name}
+            print(f"{size:>8} {run_name:<7} "
+                  + " ".join(f"{seconds[stage]:>12.4f}" if stage in seconds else f"{'-':>12}" for stage in stages)
+                  + f" {seconds['total']:>8.3f}")
+
+    report = {
+        "commit": get_commit(),
+        "date": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "latency": args.latency,
+        "backend": args.backend,
+        "max_concurrency": args.max_concurrency,
+        "results": results,
+    }
+    with open(output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"Results written to {output}")
+    if old_report is not None:
+        compare(results, old_report["results"])
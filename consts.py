@@ -1,9 +1,33 @@
+# Craigslist site searched, and listings are linked to. Can be overridden per search with the optional
+# "craigslist_host" key, e.g. to point at the stand-in server in FixtureServer.py
+CRAIGSLIST_HOST = "https://sfbay.craigslist.org"
 # Make sure it is stored as a tuple, i.e. within parentheses
 COMMUTE_LAT_LON = (37.77935412096749, -122.45205444263789)
-OSRM_URL = ("https://routing.openstreetmap.de/routed-{commute_type}/route/v1/{commute_type}/"
+# OSRM_HOST can be overridden per search with the optional "osrm_host" key, e.g. to point at a local OSRM server
+OSRM_HOST = "https://routing.openstreetmap.de"
+OSRM_URL = ("{osrm_host}/routed-{commute_type}/route/v1/{commute_type}/"
             "{start_lon},{start_lat};{commute_lon},{commute_lat}?overview=false")
+# The table service returns travel times from many sources to many destinations in one request
+OSRM_TABLE_URL = ("{osrm_host}/routed-{commute_type}/table/v1/{commute_type}/"
+                  "{coordinates}?sources={sources}&destinations={destinations}&annotations=duration")
+# Max number of listings per table request. OSRM servers cap the table size (100 coordinates by default)
+OSRM_TABLE_CHUNK_SIZE = 50
+
+# On-disk cache of OSRM travel times, stored under json_folder. Coordinates are rounded to ROUTE_CACHE_PRECISION
+# decimals (4 is about 10m), entries expire after ROUTE_CACHE_TTL seconds, and the least recently used entries are
+# evicted above ROUTE_CACHE_MAX_ENTRIES
+ROUTE_CACHE_FILENAME = "route_cache.sqlite"
+ROUTE_CACHE_PRECISION = 4
+ROUTE_CACHE_TTL = 30 * 24 * 60 * 60
+ROUTE_CACHE_MAX_ENTRIES = 100_000
 # COMMUTE_TYPE can be "bike", "foot", or "car"
 COMMUTE_TYPE = "foot"
+# A search can list several commutes with the optional "commutes" key, e.g.
+# [{"name": "work", "lat_lon": [37.79, -122.40], "modes": ["foot", "bike"], "weight": 2}, ...]
+# Each commute and mode gets its own travel time column, and TRAVEL TIME becomes their COMMUTE_AGGREGATE: "max",
+# "min", or "weighted" (weighted mean). Can be overridden per search with the optional "commute_aggregate" key
+COMMUTE_TYPES = ("bike", "foot", "car")
+COMMUTE_AGGREGATE = "max"
 HEADER = {
     "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:109.0) Gecko/20100101 Firefox/113.0",
     "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,*/*;q=0.8",
@@ -18,6 +42,8 @@ dtypes = {
     "LOCATION": "str",  # str
     "CROW_DISTANCE": "float64",  # float
     "POSTED": "str",  # timedelta object
+    "LAT": "float64",  # float
+    "LON": "float64",  # float
 }
 
 cols = [
@@ -29,8 +55,110 @@ cols = [
     "LOCATION",  # str
     "CROW_DISTANCE",  # float64
     "POSTED",  # timedelta64[ns]
+    "LAT",  # float64
+    "LON",  # float64
 ]
 
+# Max number of listings fetched from Craigslist/OSRM at the same time. Can be overridden per search with the
+# optional "max_concurrency" key in the search .json
+MAX_CONCURRENCY = 8
+
+# Stored listings of every search are indexed by lat/lon in a grid of SPATIAL_INDEX_CELL_SIZE degree cells, in
+# SPATIAL_INDEX_FILENAME under json_folder, so run.py --near can find them without loading every search. Queries for
+# the closest listings return NEAREST_LISTINGS by default
+SPATIAL_INDEX_FILENAME = "spatial_index.sqlite"
+SPATIAL_INDEX_CELL_SIZE = 0.01
+NEAREST_LISTINGS = 20
+
+# Listings resolved by any search are kept in a store shared by all searches, and reused by other searches for
+# LISTING_STORE_TTL seconds instead of being fetched and routed again
+LISTING_STORE_FILENAME = "listings.sqlite"
+LISTING_STORE_TTL = 7 * 24 * 60 * 60
+
+# Take listing lat/lon and date posted from the search results page when it has them, and only request listing pages
+# for listings that are still missing fields. Can be overridden per search with the optional "search_page_only" key
+SEARCH_PAGE_ONLY = True
+
+# Where a search's listings are stored: "sqlite" for <search_name>.sqlite, with rows added and deleted incrementally,
+# or "csv" to rewrite <search_name>.csv every run. Can be overridden per search with the optional "storage_backend"
+# key. Existing .csv files are imported the first time a search runs with the sqlite backend
+STORAGE_BACKEND = "sqlite"
+
+# BeautifulSoup parser backend: "html.parser" (built in) or "lxml" (faster, needs the lxml package). With
+# PARTIAL_PARSING, only the elements that are read are built into the soup. Can be overridden per search with the
+# optional "html_parser" and "partial_parsing" keys
+HTML_PARSER = "html.parser"
+PARTIAL_PARSING = True
+
+# Max number of results pages fetched per search (or per tile, when a search is split into tiles). Can be overridden
+# per search with the optional "max_pages" key
+MAX_SEARCH_PAGES = 25
+
+# When several searches run together (run.py --run NAME... or --run-all), at most MAX_CONCURRENT_SEARCHES run at the
+# same time, and they share one HTTP session that sends at most GLOBAL_MAX_CONCURRENCY requests at the same time
+MAX_CONCURRENT_SEARCHES = 4
+GLOBAL_MAX_CONCURRENCY = 16
+
+# Daemon mode (run.py --daemon) polls the first results page of each search every POLL_INTERVAL seconds, and only
+# walks every page when it changed, or FULL_WALK_INTERVAL seconds after the last full walk. Each poll that finds no
+# change multiplies the search's interval by POLL_BACKOFF_FACTOR, up to MAX_POLL_INTERVAL. The interval can be
+# overridden per search with the optional "poll_interval" key
+POLL_INTERVAL = 10 * 60
+MAX_POLL_INTERVAL = 2 * 60 * 60
+POLL_BACKOFF_FACTOR = 2
+FULL_WALK_INTERVAL = 60 * 60
+
+# Results are saved as <search_name>.html, a page that sorts, filters and pages through the listings in the browser,
+# and <search_name>.data.js, which holds the listings and is only rewritten when they change. The page shows
+# REPORT_PAGE_SIZE listings at a time by default. Can be overridden per search with the optional "report_page_size" key
+REPORT_PAGE_SIZE = 100
+
+# Log messages at or above LOG_LEVEL ("DEBUG", "INFO", "WARNING" or "ERROR") are written to stderr, as "text" or
+# one "json" object per line (LOG_FORMAT). Per-listing messages and dumps of the listings are DEBUG. Can be changed
+# for a run with run.py --log-level, --log-format, and --quiet (only warnings and errors)
+LOG_LEVEL = "INFO"
+LOG_FORMAT = "text"
+
+# Record wall time per stage of a run, per-listing fetch/parse/route latencies and requests and bytes per host, and
+# write them to <search_name>.metrics (JSON) and <search_name>.prom (Prometheus text format) under json_folder after
+# every run. The JSON report does not end in .json, as every .json file in json_folder is taken for a search. Can be
+# overridden per search with the optional "metrics" key
+METRICS = False
+
+# Connection pooling for the shared HTTP session. HTTP_TIMEOUT is (connect, read) in seconds, and can be overridden
+# per search with the optional "http_timeout" key in the search .json. A Search walks results pages and fetches
+# listings at the same time, each with up to MAX_CONCURRENCY requests, so the pool holds twice as many connections
+HTTP_POOL_SIZE = 2 * MAX_CONCURRENCY
+HTTP_MAX_HOSTS = 10
+HTTP_TIMEOUT = (5, 30)
+
+# Requests to each host (Craigslist, OSRM) are limited to HTTP_RATE_LIMIT per second, with bursts of up to
+# HTTP_RATE_LIMIT_BURST. A 429 response halves the host's rate (down to HTTP_RATE_LIMIT_MIN) and honors Retry-After,
+# and each successful response adds HTTP_RATE_LIMIT_RECOVERY back. Local hosts are not limited
+HTTP_RATE_LIMIT = 10.0
+HTTP_RATE_LIMIT_BURST = 20
+HTTP_RATE_LIMIT_MIN = 0.5
+HTTP_RATE_LIMIT_RECOVERY = 0.1
+HTTP_RATE_LIMIT_EXEMPT_HOSTS = ("127.0.0.1", "localhost", "::1")
+
+# Requests that fail with a connection error, a timeout, 429 or a 5xx are retried up to HTTP_MAX_RETRIES times. The
+# wait before retry n is random between 0 and HTTP_BACKOFF_BASE * 2 ** n seconds (at most HTTP_BACKOFF_MAX), or the
+# server's Retry-After if that is longer
+HTTP_MAX_RETRIES = 4
+HTTP_RETRY_STATUSES = (429, 500, 502, 503, 504)
+HTTP_BACKOFF_BASE = 0.5
+HTTP_BACKOFF_MAX = 30.0
+
+# On-disk cache of search and listing pages, stored under json_folder. "on" revalidates cached pages with conditional
+# requests (ETag/Last-Modified), "replay" serves everything from the cache without the network, and "off" disables it.
+# Can be overridden per search with the optional "http_cache" key. Least recently used pages are evicted above
+# HTTP_CACHE_MAX_BYTES, as soon as a stored page takes the cache over it. The cache is then trimmed down to
+# HTTP_CACHE_EVICT_TO of HTTP_CACHE_MAX_BYTES, so it is not trimmed again on every page stored after that
+HTTP_CACHE_MODE = "on"
+HTTP_CACHE_FOLDERNAME = "http-cache"
+HTTP_CACHE_MAX_BYTES = 256 * 1024 * 1024
+HTTP_CACHE_EVICT_TO = 0.9
+
 required_search_cols = {"max_rent",
                         "search_radius",
                         "bedrooms",
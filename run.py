@@ -1,11 +1,31 @@
 import argparse, pprint
 import os
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 import pandas as pd
 from JSONProcessing import JSONProcessing
+from ListingStore import ListingStore
+from Logger import get_logger, log_formats, setup_logging
+from RouteCache import RouteCache
+from Scheduler import Scheduler
 from Search import Search
-from consts import json_folder
+from SharedSessions import SharedSessions
+from SpatialIndex import SpatialIndex
+from consts import (
+    GLOBAL_MAX_CONCURRENCY,
+    LISTING_STORE_FILENAME,
+    MAX_CONCURRENT_SEARCHES,
+    NEAREST_LISTINGS,
+    ROUTE_CACHE_FILENAME,
+    SPATIAL_INDEX_FILENAME,
+    LOG_FORMAT,
+    LOG_LEVEL,
+    json_folder
+)
+
+logger = get_logger(__name__)
 
 
 def show_all_searches() -> None:
@@ -213,6 +233,80 @@ def create_new_search(overwrite: bool = False) -> None:
     JSONProcessing.make_search_json_file(json_filename=search_dict['search_name'], data=search_dict, overwrite=overwrite)
 
 
+def run_searches(search_names: list, max_concurrency: int = GLOBAL_MAX_CONCURRENCY,
+                 max_concurrent_searches: int = MAX_CONCURRENT_SEARCHES) -> None:
+    """
+    Runs several Searches concurrently without prompting, then logs how long each one took. Searches with the same
+    HTTP cache and timeout settings share one HTTP session (and so one connection pool per host), and all Searches
+    share one route cache, one listing store and one spatial index, so a listing found by more than one Search is only
+    fetched and routed once.
+    Args:
+        search_names: names of the Searches to run
+        max_concurrency: max number of requests in flight at the same time, across all Searches
+        max_concurrent_searches: max number of Searches running at the same time
+    """
+    missing_names = [name for name in search_names if not JSONProcessing.search_name_exists(name)]
+    for name in missing_names:
+        logger.warning("Search %s does not exist; skipping", name)
+    search_names = [name for name in search_names if name not in missing_names]
+    if not search_names:
+        logger.warning("No searches to run.")
+        return
+
+    sessions = SharedSessions(max_concurrency)
+    route_cache = RouteCache(os.path.join(json_folder, ROUTE_CACHE_FILENAME))
+    listing_store = ListingStore(os.path.join(json_folder, LISTING_STORE_FILENAME))
+    spatial_index = SpatialIndex(os.path.join(json_folder, SPATIAL_INDEX_FILENAME))
+
+    def run_search(search_name: str) -> tuple:
+        start = time.perf_counter()
+        try:
+            data_dict = JSONProcessing.get_json_dict(search_name)
+            Search(data_dict, session=sessions.get(data_dict), route_cache=route_cache, listing_store=listing_store,
+                   spatial_index=spatial_index).run()
+        except Exception as e:
+            logger.exception("Search failed: %s", e, extra={"search": search_name})
+            status = "failed"
+        else:
+            status = "ok"
+        return search_name.removesuffix(".json"), round(time.perf_counter() - start, 1), status
+
+    with ThreadPoolExecutor(max_workers=max_concurrent_searches) as executor:
+        timings = list(executor.map(run_search, search_names))
+    sessions.close()
+    route_cache.close()
+    listing_store.close()
+    spatial_index.close()
+
+    timings_df = pd.DataFrame(timings, columns=["search_name", "seconds", "status"]).set_index("search_name")
+    logger.info("Timing summary:\n%s", timings_df.to_string(),
+                extra={"timings": timings_df.to_dict(orient="index")})
+
+
+def show_listings_near(lat_lon: tuple, radius: float = None, nearest: int = NEAREST_LISTINGS,
+                       search_names: list = None) -> None:
+    """
+    Shows stored listings near a point, across Searches, using the spatial index instead of loading every Search.
+    Args:
+        lat_lon: (lat, lon) of the point
+        radius: show every listing within this many miles. If not given, show the nearest listings instead.
+        nearest: number of listings to show when no radius is given
+        search_names: only show listings of these Searches. Defaults to all of them.
+    """
+    spatial_index = SpatialIndex(os.path.join(json_folder, SPATIAL_INDEX_FILENAME))
+    if radius is not None:
+        df = spatial_index.within(lat_lon, radius, search_names)
+    else:
+        df = spatial_index.nearest(lat_lon, nearest, search_names)
+    spatial_index.close()
+
+    if df.empty:
+        print("No stored listings found near that point.")
+    else:
+        df["DISTANCE (mi)"] = df["DISTANCE (mi)"].round(2)
+        print(df.to_string(index=False))
+
+
 if __name__ == "__main__":
     if not os.path.exists(json_folder):
         os.mkdir(json_folder)
@@ -227,9 +321,45 @@ if __name__ == "__main__":
 
     # Run a search on Craigslist
     parser.add_argument("--run",
-                        help="Run a specific Search from available searches.",
+                        help="Run a specific Search from available searches. Give one or more search names to run "
+                             "them concurrently without prompting.",
+                        nargs="*",
+                        metavar="NAME")
+
+    # Run every saved search on Craigslist
+    parser.add_argument("--run-all",
+                        help="Run all saved Searches concurrently.",
                         action="store_true")
 
+    # Keep the searches running in the background instead of running them once
+    parser.add_argument("--daemon",
+                        help="With --run NAME... or --run-all, keep running and re-poll the searches on an interval "
+                             "that backs off while they are quiet. Results are only rewritten when listings change.",
+                        action="store_true")
+
+    # Limit on requests in flight across all searches run together
+    parser.add_argument("--max-concurrency",
+                        help="Max number of requests in flight at once across searches run together "
+                             f"(default {GLOBAL_MAX_CONCURRENCY}).",
+                        type=int,
+                        default=GLOBAL_MAX_CONCURRENCY)
+
+    # Query stored listings by location
+    parser.add_argument("--near",
+                        help="Show the stored listings of all Searches closest to a point, or within --radius of it.",
+                        nargs=2,
+                        type=float,
+                        metavar=("LAT", "LON"))
+
+    parser.add_argument("--radius",
+                        help="With --near, show every listing within this many miles.",
+                        type=float)
+
+    parser.add_argument("--nearest",
+                        help=f"With --near, number of closest listings to show (default {NEAREST_LISTINGS}).",
+                        type=int,
+                        default=NEAREST_LISTINGS)
+
     # Let user create things one by one - error handling done by JSONProcessing
     parser.add_argument("--new",
                         help="Create a new Search.",
@@ -240,15 +370,41 @@ if __name__ == "__main__":
                         help="Overwrite an existing Search with new parameters",
                         action="store_true")
 
+    parser.add_argument("--log-level",
+                        help=f"Only log messages at or above this level (default {LOG_LEVEL}). "
+                             f"DEBUG logs every listing.",
+                        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        default=LOG_LEVEL)
+
+    parser.add_argument("--log-format",
+                        help=f"Log as text, or as one JSON object per line (default {LOG_FORMAT}).",
+                        choices=log_formats,
+                        default=LOG_FORMAT)
+
+    parser.add_argument("--quiet",
+                        help="Only log warnings and errors. Same as --log-level WARNING.",
+                        action="store_true")
+
     args = parser.parse_args()
+    setup_logging("WARNING" if args.quiet else args.log_level, args.log_format)
 
     if args.show:
         show_all_searches()
+    if args.near:
+        show_listings_near(tuple(args.near), radius=args.radius, nearest=args.nearest)
     if args.new:
         create_new_search()
     if args.overwrite:
         create_new_search(args.overwrite)
-    if args.run:
+    if args.run_all or args.run:
+        search_names = JSONProcessing.get_existing_searches() if args.run_all else args.run
+        if args.daemon:
+            Scheduler(search_names, max_concurrency=args.max_concurrency).run()
+        else:
+            run_searches(search_names, max_concurrency=args.max_concurrency)
+    elif args.daemon:
+        print("--daemon needs the searches to run, given with --run NAME... or --run-all.")
+    elif args.run is not None:
         show_all_searches()
         while True:
             current_search_name = input("Which search do you want to run?\n")
@@ -260,5 +416,5 @@ if __name__ == "__main__":
             else:
                 print("This search does not exist. Please try again, or type 'Q' to exit.")
                 continue
-    else:
+    elif not args.near:
         print("No args supplied. Use the -h flag to see what options exist.")
@@ -0,0 +1,47 @@
+import os, sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from consts import json_folder  # noqa: E402
+from FixtureServer import FixtureServer  # noqa: E402
+
+fixtures_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "benchmarks", "fixtures")
+
+
+def read_fixture(filename: str) -> str:
+    """Reads a recorded page from benchmarks/fixtures."""
+    with open(os.path.join(fixtures_folder, filename)) as fixture_file:
+        return fixture_file.read()
+
+
+def make_data_dict(server: FixtureServer, **settings) -> dict:
+    """
+    Search settings pointed at a FixtureServer for both Craigslist and OSRM.
+    Args:
+        server: running FixtureServer
+        **settings: settings to add or override
+
+    Returns: data_dict for a Search
+    """
+    return {
+        "search_name": "test", "search_lat": 37.76, "search_lon": -122.44, "search_radius": 3, "bedrooms": 2,
+        "max_rent": 10_000, "min_rent_cutoff": 100, "search_type": "apa", "craigslist_host": server.url,
+        "osrm_host": server.url, "http_cache": "off", "metrics": False, **settings,
+    }
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Runs the test in an empty folder with a json_folder, where a Search stores everything."""
+    monkeypatch.chdir(tmp_path)
+    os.makedirs(json_folder)
+    return tmp_path
+
+
+@pytest.fixture
+def craigslist_server():
+    """FixtureServer serving 30 listings on one results page, with canned travel times."""
+    with FixtureServer(search_page=read_fixture("search_page.html"), listing_page=read_fixture("listing_page.html"),
+                       listings=30) as server:
+        yield server
@@ -0,0 +1,42 @@
+import os
+
+import requests
+
+from HTTPCache import HTTPCache
+
+
+def make_response(url: str, content: bytes) -> requests.Response:
+    """Builds a 200 response, as if it had been fetched."""
+    response = requests.Response()
+    response.status_code = 200
+    response.url = url
+    response._content = content
+    return response
+
+
+def folder_bytes(folder: str) -> int:
+    """Total size of the bodies stored in a cache folder."""
+    return sum(os.path.getsize(os.path.join(path, filename))
+               for path, _, filenames in os.walk(os.path.join(folder, "objects")) for filename in filenames)
+
+
+def test_size_stays_under_limit_while_storing(tmp_path):
+    folder = str(tmp_path / "http-cache")
+    http_cache = HTTPCache(folder, max_bytes=10_000)
+    for i in range(100):
+        url = f"https://example.org/page/{i}"
+        http_cache.get(lambda url, **kwargs: make_response(url, bytes([i]) * 500), url)
+        assert folder_bytes(folder) <= 10_000
+        assert http_cache.stored_bytes == folder_bytes(folder)
+    # The most recently stored pages are kept
+    assert http_cache.lookup("https://example.org/page/99") is not None
+    assert http_cache.lookup("https://example.org/page/0") is None
+    http_cache.close()
+
+
+def test_replacing_a_page_counts_only_its_new_body(tmp_path):
+    http_cache = HTTPCache(str(tmp_path / "http-cache"), max_bytes=10_000)
+    for size in (4000, 6000, 3000):
+        http_cache.get(lambda url, **kwargs: make_response(url, b"x" * size), "https://example.org/page")
+        assert http_cache.stored_bytes == size
+    http_cache.close()
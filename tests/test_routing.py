@@ -0,0 +1,51 @@
+from conftest import make_data_dict
+from FixtureServer import FIRST_PID, FixtureServer
+from HTTPSession import HTTPSession
+from Routing import Router
+from Search import Search
+
+COMMUTE_LAT_LON = (37.77935, -122.45205)
+LAT_LONS = [(37.76, -122.42), (37.75, -122.41), (37.74, -122.40)]
+
+
+def make_router(server: FixtureServer) -> Router:
+    """Router pointed at a FixtureServer, without retries so a failing table request fails right away."""
+    return Router(session=HTTPSession(max_retries=0), commute_lat_lon=COMMUTE_LAT_LON, osrm_host=server.url)
+
+
+def test_failed_table_falls_back_to_single_routes():
+    durations = {lat_lon: 100.0 * (i + 1) for i, lat_lon in enumerate(LAT_LONS)}
+    with FixtureServer(durations=durations, fail_table=True) as server:
+        rows = make_router(server).resolve_matrix(LAT_LONS, [COMMUTE_LAT_LON])
+        assert rows == [[100.0], [200.0], [300.0]]
+        assert server.request_counts["table"] == 1
+        assert server.request_counts["route"] == 3
+
+
+def test_no_route_only_fails_that_lat_lon():
+    durations = {LAT_LONS[1]: None}
+    with FixtureServer(durations=durations, default_duration=500.0) as server:
+        rows = make_router(server).resolve_matrix(LAT_LONS, [COMMUTE_LAT_LON])
+        assert rows == [[500.0], None, [500.0]]
+        # Only the lat/lon the table had no duration for is routed on its own
+        assert server.request_counts["table"] == 1
+        assert server.request_counts["route"] == 1
+
+
+def test_search_routes_listings_when_table_fails(workdir, craigslist_server):
+    craigslist_server.fail_table = True
+    search = Search(make_data_dict(craigslist_server), session=HTTPSession(max_retries=0))
+    search.run()
+    assert len(search.df) == 30
+    assert search.df["TRAVEL TIME"].notna().all()
+    assert craigslist_server.request_counts["route"] == 30
+
+
+def test_search_skips_listing_without_route(workdir, craigslist_server):
+    lat, lon = craigslist_server.listing_lat_lon(0)
+    craigslist_server.durations = {(round(lat, 5), round(lon, 5)): None}
+    search = Search(make_data_dict(craigslist_server), session=HTTPSession(max_retries=0))
+    search.run()
+    assert len(search.df) == 29
+    assert search.df["TRAVEL TIME"].notna().all()
+    assert FIRST_PID not in set(search.storage.load()["PID"])
@@ -0,0 +1,132 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from conftest import make_data_dict, read_fixture
+from consts import LISTING_STORE_FILENAME, ROUTE_CACHE_FILENAME, SPATIAL_INDEX_FILENAME, json_folder
+from FixtureServer import FixtureServer
+from HTTPSession import HTTPSession
+from JSONProcessing import JSONProcessing
+from ListingStore import ListingStore
+from RouteCache import RouteCache
+from Search import Search
+from SpatialIndex import SpatialIndex
+
+# About 73 miles from the listings served by the FixtureServer, which are in San Francisco
+SACRAMENTO_LAT_LON = (38.5816, -121.4944)
+
+
+def test_crow_distance_of_stored_listing_is_measured_to_own_commute(workdir, craigslist_server):
+    listing_store = ListingStore(os.path.join(json_folder, LISTING_STORE_FILENAME))
+    sf_search = Search(make_data_dict(craigslist_server, search_name="sf"), listing_store=listing_store)
+    sf_search.run()
+    assert len(sf_search.df) == 30
+    assert (sf_search.df["CROW_DISTANCE"] < 10).all()
+
+    sacramento_commutes = [{"name": "sacramento", "lat_lon": SACRAMENTO_LAT_LON, "modes": ["foot"]}]
+    sacramento_search = Search(make_data_dict(craigslist_server, search_name="sacramento",
+                                              commutes=sacramento_commutes), listing_store=listing_store)
+    sacramento_search.run()
+    assert sacramento_search.listings_reused == 30
+    assert sacramento_search.listing_page_fetches_avoided == 0
+    assert len(sacramento_search.df) == 30
+    assert (sacramento_search.df["CROW_DISTANCE"] > 60).all()
+
+    nearby_search = Search(make_data_dict(craigslist_server, search_name="nearby", commutes=sacramento_commutes,
+                                          max_crow_distance=10), listing_store=listing_store)
+    nearby_search.run()
+    assert nearby_search.prefilter.fetches_avoided["crow_distance"] == 30
+    assert nearby_search.df.empty
+    listing_store.close()
+
+
+def test_results_pages_not_walked_do_not_delete_listings(workdir):
+    with FixtureServer(search_page=read_fixture("search_page.html"), listing_page=read_fixture("listing_page.html"),
+                       listings=300) as server:
+        session = HTTPSession(max_retries=0)
+        data_dict = make_data_dict(server, max_pages=4)
+        search = Search(data_dict, session=session)
+        search.run()
+        assert search.walk_complete
+        assert len(search.storage.load()) == 300
+
+        # The second of the three results pages fails with a 503
+        server.fail_search_offsets = {len(server.listing_items)}
+        search = Search(data_dict, session=session)
+        search.run()
+        assert not search.walk_complete
+        assert len(search.storage.load()) == 300
+        assert search.spatial_index.count(["test"]) == 300
+
+        # Only the first two pages are walked, and the second one still has new listings
+        server.fail_search_offsets = set()
+        search = Search(dict(data_dict, max_pages=2), session=session)
+        search.run()
+        assert not search.walk_complete
+        assert len(search.storage.load()) == 300
+        assert search.spatial_index.count(["test"]) == 300
+
+
+def test_listings_sunk_by_interrupted_run_reach_the_report(workdir, craigslist_server):
+    data_dict = make_data_dict(craigslist_server)
+    Search(data_dict).run()
+
+    # The next run stores 5 new listings as they are routed, then is interrupted before the report is saved
+    craigslist_server.listings = 35
+    interrupted_search = Search(data_dict)
+    interrupted_search.load_pid_data()
+    interrupted_search.get_listings()
+    assert len(interrupted_search.storage.load()) == 35
+
+    search = Search(data_dict)
+    search.run()
+    with open(search.report.data_path) as data_file:
+        report_data = data_file.read()
+    assert all(str(pid) in report_data for pid in search.df["PID"])
+    assert len(search.df) == 35
+
+
+def test_report_page_size_change_reaches_page_without_new_listings(workdir, craigslist_server):
+    Search(make_data_dict(craigslist_server, report_page_size=100)).run()
+    search = Search(make_data_dict(craigslist_server, report_page_size=25))
+    search.load_pid_data()
+    # Nothing was added or deleted, so only the page itself changes
+    assert not search.update()
+    with open(search.report.html_path) as html_file:
+        assert '"pageSize": 25' in html_file.read()
+
+
+def test_overlapping_searches_run_together_resolve_each_listing_once(workdir):
+    with FixtureServer(search_page=read_fixture("search_page.html"), listing_page=read_fixture("listing_page.html"),
+                       listings=120, latency=0.01) as server:
+        # Shared like run.py --run-all shares them
+        shared = {
+            "session": HTTPSession(max_retries=0),
+            "route_cache": RouteCache(os.path.join(json_folder, ROUTE_CACHE_FILENAME)),
+            "listing_store": ListingStore(os.path.join(json_folder, LISTING_STORE_FILENAME)),
+            "spatial_index": SpatialIndex(os.path.join(json_folder, SPATIAL_INDEX_FILENAME)),
+        }
+        searches = [Search(make_data_dict(server, search_name=search_name), **shared)
+                    for search_name in ("first", "second")]
+        with ThreadPoolExecutor(max_workers=len(searches)) as executor:
+            list(executor.map(lambda search: search.run(), searches))
+        assert [len(search.df) for search in searches] == [120, 120]
+        assert server.request_counts["listing"] == 120
+        assert sum(search.listings_reused for search in searches) == 120
+
+
+def test_metrics_are_not_taken_for_a_search(workdir, craigslist_server):
+    Search(make_data_dict(craigslist_server, metrics=True)).run()
+    assert os.path.exists(os.path.join(json_folder, "test.metrics"))
+    assert JSONProcessing.get_existing_searches() == []
+
+
+def test_run_stats_count_only_this_run(workdir, craigslist_server):
+    session = HTTPSession(max_retries=0)
+    Search(make_data_dict(craigslist_server, search_name="first"), session=session).run()
+    requests_before = sum(craigslist_server.request_counts.values())
+
+    search = Search(make_data_dict(craigslist_server, search_name="second"), session=session)
+    search.run()
+    run_stats = search.get_run_stats()
+    assert run_stats["connections"]["requests"] == sum(craigslist_server.request_counts.values()) - requests_before
+    assert run_stats["connections"]["requests"] < session.connection_stats()["requests"]
@@ -0,0 +1,20 @@
+from SharedSessions import SharedSessions
+
+
+def test_searches_share_a_session_only_with_the_same_settings(workdir):
+    sessions = SharedSessions(max_concurrency=4)
+    default_session = sessions.get({})
+    assert sessions.get({"http_cache": "on"}) is default_session
+    assert not default_session.http_cache.replay
+
+    replay_session = sessions.get({"http_cache": "replay"})
+    assert replay_session.http_cache.replay
+    assert sessions.get({"http_cache": "off"}).http_cache is None
+    timeout_session = sessions.get({"http_timeout": [1, 2]})
+    assert timeout_session.timeout == (1, 2)
+    assert timeout_session is not default_session
+
+    # Requests in flight and rate limits are still shared by every Search
+    assert replay_session._in_flight is default_session._in_flight
+    assert replay_session.rate_limiter is default_session.rate_limiter
+    sessions.close()